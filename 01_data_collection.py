@@ -3,14 +3,38 @@
 #it uses pandas to add parsed information into a dataframe then saves it as a csv.
 import pandas as pd
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+import argparse
+import codecs
 import os
+import incremental
+import instrumentation
+import table_io
 
 #define the project directory. designed to work relative as long as the html is in the right place.
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 HTML_FILE_PATH = os.path.join(PROJECT_DIR, 'history', 'watch-history.html')
 CSV_OUTPUT_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history.csv')
 
+#class strings of the divs we care about. every watched video lives in its own outer-cell div
+OUTER_CELL_CLASS = 'outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp'
+CONTENT_CELL_CLASS = 'content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1'
+
+#streaming mode settings. chunk size is how much of the html gets read at once,
+#batch size is how many records get buffered before they are written out to the csv
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_BATCH_SIZE = 50000
+
+RECORD_COLUMNS = ['Video Title', 'URL', 'Channel Name', 'Channel URL', 'Date', 'Time']
+
+#parallel mode settings. the html gets cut into byte ranges right before an outer-cell div opens,
+#so every shard holds whole entries. more shards than workers keeps the cores busy when some shards parse slower
+OUTER_CELL_MARKER = ('<div class="' + OUTER_CELL_CLASS + '"').encode('utf-8')
+SHARDS_PER_WORKER = 4
+
 #uses utf 8 encoding.this ensures non latin characters, emojis and symbols display just fine
 #was using the latin 1 encoding at first and many different characters in youtube titles fall outside of these ranges
 #this actually gave me a lot of trouble as diagnosing why the non latin characters looked so weird was hard
@@ -19,15 +43,66 @@ def load_html(file_path):
         content = file.read()
     return content
 
+#turns the raw "Watched ... Jul 20, 2024, 10:15:32 PM EDT" text into the date and time strings we save
+def parse_date_time(date_time_raw):
+    #remove unwanted characters and prefixes
+    date_time_raw = date_time_raw.replace('Watched', '').strip()
+    date_time_str = date_time_raw.rsplit(' ', 1)[0]
+
+    #parse the date and time
+    #the day and the clock are parsed separately so each half can be cached,
+    #a history only has a few thousand distinct days and at most 86400 distinct clock times
+    try:
+        day_str, clock_str = split_date_time(date_time_str)
+        date = parse_day(day_str)
+        time = parse_clock(clock_str)
+    except ValueError as e:
+        print(f"Error parsing date-time: {e}")
+        date = 'Invalid date'
+        time = 'Invalid time'
+    return date, time
+
+
+def split_date_time(date_time_str):
+    parts = date_time_str.rsplit(', ', 1)
+    if len(parts) != 2:
+        raise ValueError(f"time data {date_time_str!r} does not match format '%b %d, %Y, %I:%M:%S %p'")
+    return parts
+
+
+@lru_cache(maxsize=None)
+def parse_day(day_str):
+    return datetime.strptime(day_str, '%b %d, %Y').strftime('%d-%b-%Y')
+
+
+@lru_cache(maxsize=None)
+def parse_clock(clock_str):
+    return datetime.strptime(clock_str, '%I:%M:%S %p').strftime('%H:%M:%S')
+
+
+def build_record(title, url, channel, channel_url, date_time_raw):
+    date, time = parse_date_time(date_time_raw)
+    return {
+        'Video Title': title,
+        'URL': url,
+        'Channel Name': channel,
+        'Channel URL': channel_url,
+        'Date': date,
+        'Time': time,
+    }
+
+
 #uses beautifulsoup to parse through html file.
+@instrumentation.timed('parse_html', rows=lambda result, *args, **kwargs: len(result))
 def parse_html(html_content):
     soup = BeautifulSoup(html_content, 'html.parser')
     records = []
 
     #for loop through the HTML content
     for entry in soup.find_all('div', class_='outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp'):
-        title_element = entry.find('a')
-        channel_element = entry.find_all('a')[1] if len(entry.find_all('a')) > 1 else None
+        anchors = entry.find_all('a')
+        title_element = anchors[0] if anchors else None
+        channel_element = anchors[1] if len(anchors) > 1 else None
         date_time_element = entry.find('div', class_='content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1')
 
         title = title_element.text if title_element else 'No title'
@@ -36,45 +111,267 @@ def parse_html(html_content):
         channel_url = channel_element['href'] if channel_element else 'No URL'
         date_time_raw = date_time_element.contents[-1].strip() if date_time_element else 'No date_time'
 
-        #remove unwanted characters and prefixes
-        date_time_raw = date_time_raw.replace('Watched', '').strip()
-        date_time_str = date_time_raw.rsplit(' ', 1)[0]
-
-        #parse the date and time
-        try:
-            date_time_obj = datetime.strptime(date_time_str, '%b %d, %Y, %I:%M:%S %p')
-            date = date_time_obj.strftime('%d-%b-%Y')
-            time = date_time_obj.strftime('%H:%M:%S')
-        except ValueError as e:
-            print(f"Error parsing date-time: {e}")
-            date = 'Invalid date'
-            time = 'Invalid time'
-
-        records.append({
-            'Video Title': title,
-            'URL': url,
-            'Channel Name': channel,
-            'Channel URL': channel_url,
-            'Date': date,
-            'Time': time,
-        })
+        records.append(build_record(title, url, channel, channel_url, date_time_raw))
 
     return records
 
 
-def save_to_dataframe(records):
+#streaming alternative to beautifulsoup for big exports.
+#beautifulsoup needs the whole file in memory plus a full tree of it, which on heavy accounts is several gb.
+#this parser gets fed the file a chunk at a time and only keeps the outer-cell it is currently inside of,
+#so memory stays flat no matter how big the export is. it pulls the same fields as parse_html:
+#the first link is the video, the second link is the channel and the last piece of the first content cell is the date.
+class WatchHistoryParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self.entry_depth = 0
+        self.anchors = []
+        self.current_anchor = None
+        self.content_cell_depth = None
+        self.content_cell_seen = False
+        self.last_content_child = None
+
+    def handle_starttag(self, tag, attrs):
+        if not self.entry_depth:
+            if tag == 'div' and dict(attrs).get('class') == OUTER_CELL_CLASS:
+                self.entry_depth = 1
+                self.anchors = []
+                self.current_anchor = None
+                self.content_cell_depth = None
+                self.content_cell_seen = False
+                self.last_content_child = None
+            return
+
+        #any tag directly inside the content cell means the last child is no longer text
+        if self.in_content_cell() and self.current_anchor is None:
+            self.last_content_child = None
+
+        if tag == 'div':
+            self.entry_depth += 1
+            if not self.content_cell_seen and dict(attrs).get('class') == CONTENT_CELL_CLASS:
+                self.content_cell_depth = self.entry_depth
+                self.content_cell_seen = True
+        elif tag == 'a':
+            self.current_anchor = {'href': dict(attrs).get('href'), 'text': []}
+            self.anchors.append(self.current_anchor)
+
+    def handle_endtag(self, tag):
+        if not self.entry_depth:
+            return
+        if tag == 'a':
+            self.current_anchor = None
+        elif tag == 'div':
+            if self.entry_depth == self.content_cell_depth:
+                self.content_cell_depth = None
+            self.entry_depth -= 1
+            if not self.entry_depth:
+                self.records.append(self.finish_entry())
+
+    def handle_data(self, data):
+        if not self.entry_depth:
+            return
+        if self.current_anchor is not None:
+            self.current_anchor['text'].append(data)
+        elif self.in_content_cell():
+            self.last_content_child = (self.last_content_child or '') + data
+
+    def in_content_cell(self):
+        return self.content_cell_depth is not None and self.entry_depth == self.content_cell_depth
+
+    def finish_entry(self):
+        title_element = self.anchors[0] if self.anchors else None
+        channel_element = self.anchors[1] if len(self.anchors) > 1 else None
+
+        title = ''.join(title_element['text']) if title_element else 'No title'
+        url = title_element['href'] if title_element else 'No URL'
+        channel = ''.join(channel_element['text']) if channel_element else 'No channel'
+        channel_url = channel_element['href'] if channel_element else 'No URL'
+        if not self.content_cell_seen:
+            date_time_raw = 'No date_time'
+        else:
+            date_time_raw = (self.last_content_child or '').strip()
+
+        return build_record(title, url, channel, channel_url, date_time_raw)
+
+
+#reads the html a chunk at a time and yields one record per outer-cell as soon as it is closed.
+#start and end are byte offsets so the parallel mode can hand each worker its own slice of the file.
+#an incremental decoder is used so multi byte characters split across two chunks still decode fine
+@instrumentation.timed_generator('iter_records')
+def iter_records(file_path, chunk_size=STREAM_CHUNK_SIZE, start=0, end=None):
+    parser = WatchHistoryParser()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start if end is not None else None
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = file.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if parser.records:
+                yield from parser.records
+                parser.records = []
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.records
+
+
+#finds byte offsets that split the file into roughly even shards.
+#each cut point is moved forward to the next outer-cell div so no entry is ever split between two shards
+def find_shard_offsets(file_path, shards):
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, 'rb') as file:
+        for i in range(1, shards):
+            position = find_next_marker(file, max(size * i // shards, offsets[-1] + 1))
+            if position is None:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def find_next_marker(file, position, block_size=STREAM_CHUNK_SIZE):
+    overlap = len(OUTER_CELL_MARKER) - 1
+    while True:
+        file.seek(position)
+        block = file.read(block_size + overlap)
+        if not block:
+            return None
+        index = block.find(OUTER_CELL_MARKER)
+        if index != -1:
+            return position + index
+        if len(block) <= overlap:
+            return None
+        position += block_size
+
+
+def parse_shard(file_path, start, end):
+    return list(iter_records(file_path, start=start, end=end))
+
+
+#parses the shards in a process pool. executor.map hands results back in submission order
+#so the records come out in the same order they are in the html (newest first)
+@instrumentation.timed_generator('iter_records_parallel')
+def iter_records_parallel(file_path, workers):
+    shards = find_shard_offsets(file_path, workers * SHARDS_PER_WORKER)
+    starts = [start for start, _ in shards]
+    ends = [end for _, end in shards]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for records in executor.map(parse_shard, [file_path] * len(shards), starts, ends):
+            yield from records
+
+
+#writes records out in batches so only one batch is ever held in memory.
+#returns the number of rows written and the first few rows for a quick look
+def save_records_streaming(records, output_path=CSV_OUTPUT_PATH, batch_size=STREAM_BATCH_SIZE, fmt='csv'):
+    writer = table_io.batch_writer(output_path, fmt)
+    try:
+        return write_batches(records, writer.write, batch_size)
+    finally:
+        writer.close()
+
+
+def write_batches(records, write, batch_size):
+    total = 0
+    preview = None
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            preview = write_batch(write, batch, preview)
+            total += len(batch)
+            batch = []
+    if batch or total == 0:
+        preview = write_batch(write, batch, preview)
+        total += len(batch)
+    return total, preview
+
+
+def write_batch(write, batch, preview):
+    df = pd.DataFrame(batch, columns=RECORD_COLUMNS)
+    write(df)
+    return df.head() if preview is None else preview
+
+
+def save_to_dataframe(records, fmt='csv'):
     df = pd.DataFrame(records)
     # Save the DataFrame with UTF-8 encoding
-    df.to_csv(CSV_OUTPUT_PATH, index=False, encoding='utf-8-sig')
+    table_io.write_table(df, CSV_OUTPUT_PATH, fmt)
     return df
 #saves it to pandas dataframe
 
-def main():
-    html_content = load_html(HTML_FILE_PATH)
-    records = parse_html(html_content)
-    df = save_to_dataframe(records)
+
+#only parses the entries that are newer than the last run and puts them on top of the existing csv.
+#parsing stops at the first entry we already know, so a monthly re-download only reads the top of the html
+def ingest_new_records(html_path=HTML_FILE_PATH, output_path=CSV_OUTPUT_PATH, fmt='csv'):
+    manifest = incremental.load_manifest()
+    if not manifest or not table_io.table_exists(output_path, fmt):
+        print("No previous run found, parsing the whole file.")
+        return main(stream=True, fmt=fmt)
+
+    records = incremental.take_new_records(iter_records(html_path), manifest)
+    new_records = list(incremental.track_watermark(records, manifest))
+    if new_records:
+        table_io.prepend_table(pd.DataFrame(new_records, columns=RECORD_COLUMNS), output_path, fmt)
+
+    collected = manifest['stages']['collection']['output_rows'] + len(new_records)
+    incremental.mark_stage(manifest, 'collection', collected, collected)
+    incremental.save_manifest(manifest)
+    count_collection(len(new_records))
+    print(f"Found {len(new_records)} new records, 'watch_history.{fmt}' now holds {collected} records.")
+
+
+#a full run rewrites the csv, so it also starts a fresh manifest and every later stage has to start over
+def main(stream=False, workers=1, fmt='csv'):
+    manifest = {}
+    if workers > 1:
+        records = incremental.track_watermark(iter_records_parallel(HTML_FILE_PATH, workers), manifest)
+        total, df = save_records_streaming(records, fmt=fmt)
+        print(f"Parsed {total} records with {workers} workers to 'watch_history.{fmt}'.")
+    elif stream:
+        records = incremental.track_watermark(iter_records(HTML_FILE_PATH), manifest)
+        total, df = save_records_streaming(records, fmt=fmt)
+        print(f"Streamed {total} records to 'watch_history.{fmt}'.")
+    else:
+        html_content = load_html(HTML_FILE_PATH)
+        records = list(incremental.track_watermark(parse_html(html_content), manifest))
+        df = save_to_dataframe(records, fmt)
+        total = len(records)
     print(df.head())  #just for quick verification, remove or comment out in production
 
+    incremental.mark_stage(manifest, 'collection', total, total, rebuild=True)
+    incremental.save_manifest(manifest)
+    count_collection(total)
+
+
+#rows for the run report, plus how often the cached date and clock parsing was hit
+def count_collection(rows):
+    instrumentation.count_rows('collection', rows)
+    instrumentation.count_lru_cache('parse_day', parse_day)
+    instrumentation.count_lru_cache('parse_clock', parse_clock)
+
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Parse watch-history.html into watch_history.csv.')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the html incrementally with constant memory instead of loading it all into beautifulsoup')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='split the html into shards and parse them on this many processes')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only parse entries newer than the last run and add them to the existing csv')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of the output table, parquet keeps typed columns for the later stages')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'collection'):
+        if args.incremental:
+            ingest_new_records(fmt=args.format)
+        else:
+            main(stream=args.stream, workers=args.workers, fmt=args.format)
@@ -3,45 +3,116 @@
 #a video may also just be privated.
 # these have no real records to them and arent useful to us so its best to just remove them.
 import pandas as pd
+import numpy as np
+import argparse
 import os
+import incremental
+import instrumentation
+import table_io
 
 #define the project directory
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 RAW_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history.csv')
 PROCESSED_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_processed.csv')
 
-#ensure proper encoding for non-Latin characters using UTF-8
-def ensure_utf8(text):
-    try:
-        return text.encode('utf-8').decode('utf-8')
-    except UnicodeEncodeError:
-        return text
+#tableau prefers data to be dd-MMM-yyyy so thats what well be using.
+#the collection script already writes the date and time in these formats, so they are parsed with them explicitly
+DATE_FORMAT = '%d-%b-%Y'
+TIME_FORMAT = '%H:%M:%S'
+TIME_COLUMNS = ['Timestamp', 'Year', 'Month', 'Quarter', 'Hour']
 
-def preprocess_data():
-    #load in the raw data file
-    df = pd.read_csv(RAW_CSV_PATH, encoding='utf-8')
+#the titles and channel names are read back as python strings, which are already unicode,
+#so the old utf-8 encode/decode round trip did not change anything and is no longer run
+
+#parses the date and time columns and writes them back in the standard formats.
+#a history only has a few thousand distinct days and at most 86400 distinct clock times, so every distinct string
+#is parsed and formatted once and the results are spread back over the rows by their codes.
+#rows with a date or time that does not parse are dropped.
+#with time_columns the parsed timestamp is kept as well, plus year, month, quarter and hour columns taken from it.
+#the quarter is written as Q1 to Q4, the same labels the nlp script uses for its Quarter column.
+#a timezone only makes sense on the timestamp, so giving one also turns time_columns on
+#the takeout times are in the local time of the export, a timezone name (like 'America/New_York') makes the timestamp timezone aware
+def normalize_date_time(df, time_columns=False, timezone=None):
+    day_codes, days = pd.factorize(df['Date'])
+    clock_codes, clocks = pd.factorize(df['Time'])
+    days = pd.to_datetime(pd.Index(days, dtype=object), format=DATE_FORMAT, errors='coerce')
+    clocks = pd.to_timedelta(pd.Index(clocks, dtype=object), errors='coerce')
+
+    #code -1 (a missing value) picks the NaT added at the end
+    day_values = np.append(days.to_numpy(), np.datetime64('NaT'))[day_codes]
+    clock_values = np.append(clocks.to_numpy(), np.timedelta64('NaT'))[clock_codes]
+    valid = ~np.isnat(day_values) & ~np.isnat(clock_values)
+    df = df[valid]  # Remove rows with invalid dates
+
+    day_strings = np.asarray(days.strftime(DATE_FORMAT), dtype=object)
+    clock_strings = np.asarray((pd.Timestamp(0) + clocks).strftime(TIME_FORMAT), dtype=object)
+    df = df.assign(Date=day_strings[day_codes[valid]], Time=clock_strings[clock_codes[valid]])
 
-    #utf 8 encoding
-    df['Video Title'] = df['Video Title'].apply(lambda x: ensure_utf8(x) if isinstance(x, str) else x)
-    df['Channel Name'] = df['Channel Name'].apply(lambda x: ensure_utf8(x) if isinstance(x, str) else x)
+    if time_columns or timezone:
+        local = pd.Series(day_values[valid] + clock_values[valid], index=df.index)
+        timestamp = local
+        if timezone:
+            #times in the hour repeated when the clocks go back are taken as standard time
+            timestamp = local.dt.tz_localize(timezone, ambiguous=np.zeros(len(local), dtype=bool),
+                                             nonexistent='shift_forward')
+        df = df.assign(Timestamp=timestamp, Year=local.dt.year, Month=local.dt.month,
+                       Quarter='Q' + local.dt.quarter.astype(str), Hour=local.dt.hour)
+    return df
 
+#cleans a dataframe of raw rows. kept separate from the file handling so the incremental mode can run it on just the new rows
+@instrumentation.timed('preprocess', rows=lambda result, df, *args, **kwargs: len(df))
+def preprocess(df, time_columns=False, timezone=None):
     #filter out the unavailable videos
     df = df[~((df['Channel Name'] == 'here') & (df['Channel URL'] == 'https://myaccount.google.com/activitycontrols'))]
 
     #preprocess data
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce', dayfirst=True)
-    df.dropna(subset=['Date'], inplace=True)  # Remove rows with invalid dates
+    return normalize_date_time(df, time_columns, timezone)
 
-    #convert date to desired format with 4-digit year
-    #tableau prefers data to be dd-MMM-yyyy so thats what well be using.
-    df['Date'] = df['Date'].apply(lambda x: x.strftime('%d-%b-%Y') if pd.notnull(x) else x)
-    df['Date'] = df['Date'].apply(lambda x: x[:-2] + "" + x[-2:])  # Add "20" before the last two digits
+def preprocess_data(incremental_run=False, fmt='csv', time_columns=False, timezone=None):
+    manifest = incremental.load_manifest()
+    pending = incremental.pending_rows(manifest, 'preprocessing', 'collection') if incremental_run else None
 
-    df['Time'] = pd.to_datetime(df['Time'], format='%H:%M:%S').dt.strftime('%H:%M:%S')
+    if pending == 0:
+        print("No new rows since the last preprocessing run.")
+        return
+
+    if pending is not None:
+        #only the new rows at the top of the raw file need cleaning, they go on top of the processed file
+        df = preprocess(table_io.read_table(RAW_CSV_PATH, fmt, nrows=pending), time_columns, timezone)
+        if not df.empty:
+            table_io.prepend_table(df, PROCESSED_CSV_PATH, fmt)
+        state = manifest['stages']['preprocessing']
+        incremental.mark_stage(manifest, 'preprocessing', state['input_rows'] + pending, state['output_rows'] + len(df))
+        incremental.save_manifest(manifest)
+        instrumentation.count_rows('preprocessing', pending)
+        print(f"Preprocessed {pending} new rows. Processed file updated: 'watch_history_processed.{fmt}'.")
+        return
+
+    #load in the raw data file
+    df = table_io.read_table(RAW_CSV_PATH, fmt)
+    raw_rows = len(df)
+    df = preprocess(df, time_columns, timezone)
+    instrumentation.count_rows('preprocessing', raw_rows)
 
     #save processed data in a new csv
-    df.to_csv(PROCESSED_CSV_PATH, index=False, encoding='utf-8-sig')
-    print("Data preprocessing complete. Processed file saved as 'watch_history_processed.csv'.")
+    table_io.write_table(df, PROCESSED_CSV_PATH, fmt)
+    if manifest:
+        incremental.mark_stage(manifest, 'preprocessing', raw_rows, len(df), rebuild=True)
+        incremental.save_manifest(manifest)
+    print(f"Data preprocessing complete. Processed file saved as 'watch_history_processed.{fmt}'.")
 
 if __name__ == '__main__':
-    preprocess_data()
+    parser = argparse.ArgumentParser(description='Clean watch_history.csv into watch_history_processed.csv.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only preprocess rows added since the last run and merge them into the existing output')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of the input and output tables')
+    parser.add_argument('--time-columns', action='store_true',
+                        help='also save the parsed Timestamp and Year, Month, Quarter and Hour columns')
+    parser.add_argument('--timezone',
+                        help="timezone the takeout times are in (like 'America/New_York'), makes the Timestamp column timezone aware. implies --time-columns")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'preprocessing'):
+        preprocess_data(incremental_run=args.incremental, fmt=args.format,
+                        time_columns=args.time_columns, timezone=args.timezone)
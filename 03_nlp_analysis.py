@@ -4,21 +4,61 @@
 #it scans every video title for locations.
 #it then utilizes two mapping csvs already included in the project zip to match known cities to their corresponding us state or country
 import pandas as pd
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.util import ngrams
-from collections import Counter
+import numpy as np
+import argparse
+import hashlib
+import json
 import os
-import stanza
+import tempfile
+import gazetteer
+import incremental
+import instrumentation
+import resources
+import sessions
+import table_io
+import token_matrix
 
-#ensure necessary NLTK data packages are downloaded
-nltk.download('punkt')
-nltk.download('stopwords')
+#how many unique titles get sent through stanza at once. bigger batches are faster but need more memory
+NER_BATCH_SIZE = 256
+
+#tokenizers for the title tokens. nltk runs word_tokenize row by row, regex tokenizes the whole column at once
+#into a sparse document-term matrix that the keyword reports and the lda script can use directly
+TOKENIZERS = ['nltk', 'regex']
+
+#engines that can find locations in titles. stanza is the neural ner, gazetteer only looks for the names in the mapping csvs
+LOCATION_ENGINES = ['stanza', 'gazetteer']
+
+#the Stanza pipeline is only initialized the first time it is needed, so the gazetteer engine never loads it.
+#nltk is also only imported once titles get tokenized, and all models come from disk (see resources.py),
+#they are only downloaded when they are missing
+#one stanza pipeline per batch size, so --ner-batch-size also sets the batch size stanza itself uses
+nlp_pipelines = {}
+location_matcher = None
+stop_words = None
+nltk_tokenizers = None
+
+
+def get_nlp(batch_size=NER_BATCH_SIZE):
+    if batch_size not in nlp_pipelines:
+        nlp_pipelines[batch_size] = resources.stanza_pipeline('en', processors='tokenize,ner',
+                                                              tokenize_batch_size=batch_size, ner_batch_size=batch_size)
+    return nlp_pipelines[batch_size]
+
+
+#define stopwords
+def get_stop_words():
+    global stop_words
+    if stop_words is None:
+        stop_words = resources.stop_words('english')
+    return stop_words
+
+
+def get_nltk_tokenizers():
+    global nltk_tokenizers
+    if nltk_tokenizers is None:
+        nltk_tokenizers = resources.nltk_tokenizers()
+    return nltk_tokenizers
 
-#initializes Stanza pipeline
-stanza.download('en')
-nlp = stanza.Pipeline('en', processors='tokenize,ner')
 
 #defines the project directory
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -26,9 +66,8 @@ PROCESSED_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_process
 CITY_STATE_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'city_state_mapping.csv')
 CITY_COUNTRY_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'citiestocountries.csv')
 OUTPUT_DIR = os.path.join(PROJECT_DIR, 'history', 'quarterly_reports')
-
-#load in processed data
-df = pd.read_csv(PROCESSED_CSV_PATH, encoding='utf-8')
+NLP_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_nlp.csv')
+NER_CACHE_PATH = os.path.join(PROJECT_DIR, 'history', 'ner_cache.json')
 
 #load city-state and city-country mappings
 #while doing this project, i had troubles with false positives getting reported as locations with the stanza.
@@ -41,12 +80,12 @@ city_country_mapping = pd.read_csv(CITY_COUNTRY_CSV_PATH)
 city_to_state = dict(zip(city_state_mapping['City'], city_state_mapping['State']))
 city_to_country = dict(zip(city_country_mapping['City'], city_country_mapping['Country']))
 
-#define stopwords
-stop_words = set(stopwords.words('english'))
-
 #tokenize video titles and remove stopwords, then generate unigrams, bigrams, and trigrams
 #unigrams, bigrams and trigrams are basically one word, two word phrases, and three word phrases.
+@instrumentation.timed('process_title')
 def process_title(title):
+    word_tokenize, ngrams = get_nltk_tokenizers()
+    stop_words = get_stop_words()
     tokens = word_tokenize(title.lower())
     filtered_tokens = [word for word in tokens if word.isalnum() and word not in stop_words]
     unigrams = filtered_tokens
@@ -54,28 +93,74 @@ def process_title(title):
     trigrams = [' '.join(gram) for gram in ngrams(filtered_tokens, 3)]
     return unigrams + bigrams + trigrams
 
-df['Title Tokens'] = df['Video Title'].apply(process_title)
-
 # function to get quarter
-def get_quarter(month):
-    if month in [1, 2, 3]:
-        return 'Q1'
-    elif month in [4, 5, 6]:
-        return 'Q2'
-    elif month in [7, 8, 9]:
-        return 'Q3'
-    else:
-        return 'Q4'
-
-df['Quarter'] = df['Date'].apply(lambda x: get_quarter(pd.to_datetime(x).month))
+#works on the whole column of dates at once, Q1 to Q4
+def quarter_labels(dates):
+    return 'Q' + dates.dt.quarter.astype(str)
 
 #extract named entities (locations)
+@instrumentation.timed('extract_locations')
 def extract_locations(title):
-    doc = nlp(title)
+    doc = get_nlp()(title)
     locations = [ent.text for ent in doc.entities if ent.type in ['GPE', 'LOC']]
     return locations
 
-df['Locations'] = df['Video Title'].apply(extract_locations)
+
+#ner is by far the slowest part of this script, so the batched version avoids as much of it as possible.
+#rewatches and autoplay repeat the same titles a lot, so every title only goes through stanza once.
+#the found locations are kept in a cache file keyed by a hash of the title, so reruns never redo a title.
+#the titles that are left get sent through stanza in batches instead of one call per row
+@instrumentation.timed('extract_locations_batch', rows=lambda result, *args, **kwargs: len(result))
+def extract_locations_batch(titles, batch_size=NER_BATCH_SIZE, cache_path=NER_CACHE_PATH):
+    cache = load_ner_cache(cache_path)
+    keys = {title: title_key(title) for title in set(titles) if isinstance(title, str)}
+    missing = [title for title, key in keys.items() if key not in cache]
+
+    if missing:
+        from stanza import Document
+
+    try:
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            docs = get_nlp(batch_size).bulk_process([Document([], text=title) for title in batch])
+            for title, doc in zip(batch, docs):
+                cache[keys[title]] = [ent.text for ent in doc.entities if ent.type in ['GPE', 'LOC']]
+    finally:
+        #saved even when interrupted so the work that was already done is not lost
+        if missing:
+            save_ner_cache(cache, cache_path)
+
+    print(f"NER: {len(titles)} titles, {len(keys)} unique, {len(missing)} not cached yet.")
+    instrumentation.count_cache('ner_cache', len(keys) - len(missing), len(missing))
+    return [list(cache[keys[title]]) if isinstance(title, str) else [] for title in titles]
+
+
+#gazetteer version of extract_locations_batch. it is fast enough that no cache file is needed,
+#but unique titles are still only scanned once
+@instrumentation.timed('extract_locations_gazetteer', rows=lambda result, *args, **kwargs: len(result))
+def extract_locations_gazetteer(titles):
+    global location_matcher
+    if location_matcher is None:
+        location_matcher = gazetteer.from_mappings(city_state_mapping, city_country_mapping)
+    found = {title: location_matcher.find(title) for title in set(titles) if isinstance(title, str)}
+    return [list(found[title]) if isinstance(title, str) else [] for title in titles]
+
+
+def title_key(title):
+    return hashlib.sha1(title.encode('utf-8')).hexdigest()
+
+
+def load_ner_cache(path=NER_CACHE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_ner_cache(cache, path=NER_CACHE_PATH):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(path), delete=False) as file:
+        json.dump(cache, file, ensure_ascii=False)
+    os.replace(file.name, path)
 
 # function to map locations to states and countries
 def map_locations(location_list):
@@ -95,32 +180,193 @@ def map_locations(location_list):
                     countries.append(location)
     return ', '.join(states), ', '.join(countries)
 
-df['State'], df['Country'] = zip(*df['Locations'].apply(map_locations))
+#the date of every row. a timestamp the preprocessing step already parsed (--time-columns) is used as it is,
+#otherwise the date strings are parsed
+def row_dates(df):
+    if 'Timestamp' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+        return df['Timestamp']
+    return pd.to_datetime(df['Date'], format='%d-%b-%Y')
+
+#runs the per row analysis (tokens, quarter, locations) on a dataframe of processed rows.
+#returns the analyzed dataframe and, with the regex tokenizer, the document-term matrix of its titles (None otherwise)
+def analyze(df, ner_batch_size=NER_BATCH_SIZE, location_engine='stanza', tokenizer='nltk'):
+    dtm = None
+    if tokenizer == 'regex':
+        dtm = token_matrix.tokenize_titles(df['Video Title'].tolist(), get_stop_words())
+        df['Title Tokens'] = dtm.token_lists()
+    else:
+        df['Title Tokens'] = df['Video Title'].apply(process_title)
+    df['Quarter'] = quarter_labels(row_dates(df))
+    if location_engine == 'gazetteer':
+        df['Locations'] = extract_locations_gazetteer(df['Video Title'].tolist())
+    else:
+        df['Locations'] = extract_locations_batch(df['Video Title'].tolist(), ner_batch_size)
+    #unpacking zip(*...) fails when there are no rows, so the two columns are filled one after the other
+    mapped = [map_locations(locations) for locations in df['Locations']]
+    df['State'] = [state for state, _ in mapped]
+    df['Country'] = [country for _, country in mapped]
+
+    #drop the 'Locations' column
+    #if anything was added to the locations column, it should automatically get added to either the state column or the country column using the mapping.
+    #by dropping the locations column, all "locations" that didnt get added to either get removed thus fixing the problem of false positives
+    df.drop(columns=['Locations'], inplace=True)
+    return df, dtm
+
+
+#writes the top keywords of every quarter. years limits it to the given years, which the incremental mode uses
+#so only the quarters that actually got new rows are rewritten.
+#the year and quarter of every row are worked out once, then all quarters are counted in a single grouped pass
+#instead of filtering the whole dataframe again for every year and quarter.
+#when a document-term matrix lined up with df is given, the counts come straight from its column sums
+def write_quarterly_reports(df, years=None, dtm=None, output_dir=OUTPUT_DIR):
+    #create a directory for quarterly reports if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    keys = pd.DataFrame({
+        'Year': row_dates(df).dt.year.to_numpy(),
+        'Quarter': df['Quarter'].to_numpy(),
+    })
+    rows = np.ones(len(keys), dtype=bool) if years is None else keys['Year'].isin(years).to_numpy()
+    keys = keys[rows]
+
+    if dtm is not None:
+        common_keywords = top_keywords_from_matrix(keys, dtm.rows(np.flatnonzero(rows)))
+    else:
+        common_keywords = top_keywords_from_lists(keys, df['Title Tokens'].to_numpy()[rows])
+
+    for (year, quarter), keywords in common_keywords.items():
+        # Save quarterly analysis
+        with open(os.path.join(output_dir, f'{year}_{quarter}_common_keywords.txt'), 'w', encoding='utf-8') as f:
+            for keyword, count in keywords:
+                f.write(f"{keyword}: {count}\n")
+
+        print(f"{year} {quarter} analysis complete. Results saved in '{year}_{quarter}_common_keywords.txt'.")
+
+
+#counts every (year, quarter, token) in one groupby over the exploded token lists and keeps the top 10 of each quarter.
+#the sort is stable so tied tokens stay in the order they first show up, same as Counter.most_common
+def top_keywords_from_lists(keys, token_lists, n=10):
+    exploded = keys.assign(Keyword=token_lists).explode('Keyword').dropna(subset=['Keyword'])
+    counts = exploded.groupby(['Year', 'Quarter', 'Keyword'], sort=False).size().reset_index(name='Count')
+    counts = counts.sort_values(['Year', 'Quarter', 'Count'], ascending=[True, True, False], kind='stable')
+    top = counts.groupby(['Year', 'Quarter'], sort=False).head(n)
+    return {group: list(zip(rows['Keyword'], rows['Count'])) for group, rows in top.groupby(['Year', 'Quarter'], sort=False)}
+
+
+#same thing from the document-term matrix. every entry of the matrix is one token of one row, in title order,
+#so the (quarter, term) pairs are counted straight from the entries. ties are broken by the first entry of the term
+#in the quarter, which is the order Counter.most_common and the list version keep, whatever order the vocabulary was built in
+def top_keywords_from_matrix(keys, dtm, n=10):
+    groups = keys.drop_duplicates().sort_values(['Year', 'Quarter']).reset_index(drop=True)
+    group_codes = keys.merge(groups.reset_index(), on=['Year', 'Quarter'], how='left')['index'].to_numpy()
+    matrix = dtm.matrix
+    term_count = len(dtm.terms)
+    entry_groups = group_codes[np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))]
+    pair_keys = entry_groups.astype(np.int64) * term_count + matrix.indices
+
+    pairs, first_entry, pair_codes = np.unique(pair_keys, return_index=True, return_inverse=True)
+    counts = np.bincount(pair_codes.ravel(), weights=matrix.data, minlength=len(pairs))
+    pair_groups = pairs // term_count
+    order = np.lexsort((first_entry, -counts, pair_groups))
+    bounds = np.searchsorted(pair_groups[order], np.arange(len(groups) + 1))
+
+    common_keywords = {}
+    for group, year, quarter in groups.itertuples():
+        top = order[bounds[group]:bounds[group + 1]][:n]
+        common_keywords[(year, quarter)] = [(dtm.terms[pairs[i] % term_count], int(counts[i])) for i in top]
+    return common_keywords
+
+
+#only runs tokens and ner on the rows added since the last run, then merges them into watch_history_nlp.csv.
+#the keyword reports are rebuilt from the merged file but only for the years that got new rows
+def analyze_new_rows(manifest, pending, fmt='csv', ner_batch_size=NER_BATCH_SIZE, location_engine='stanza',
+                     tokenizer='nltk', exclude=()):
+    if not pending:
+        print("No new rows since the last NLP run.")
+        return
+
+    delta_df, delta_dtm = analyze(table_io.read_table(PROCESSED_CSV_PATH, fmt, nrows=pending),
+                                  ner_batch_size, location_engine, tokenizer)
+    table_io.prepend_table(delta_df, NLP_CSV_PATH, fmt)
+    years = set(pd.to_datetime(delta_df['Date']).dt.year)
+    df = table_io.read_table(NLP_CSV_PATH, fmt)
+
+    dtm = None
+    if delta_dtm is not None:
+        #the saved matrix has to stay lined up with the nlp table, if there is none yet it is built for the whole table
+        existing_dtm = token_matrix.load(NLP_CSV_PATH) if token_matrix.exists(NLP_CSV_PATH) else None
+        if existing_dtm is not None and existing_dtm.matrix.shape[0] + len(delta_df) == len(df):
+            dtm = token_matrix.prepend(delta_dtm, existing_dtm)
+        else:
+            dtm = token_matrix.tokenize_titles(df['Video Title'].tolist(), get_stop_words())
+        token_matrix.save(dtm, NLP_CSV_PATH)
+
+    year_mask = pd.to_datetime(df['Date']).dt.year.isin(years).to_numpy()
+    if exclude:
+        #the sessions are worked out over the whole table, a session can start before the new rows.
+        #not &=, the array to_numpy gives back can be read only under copy on write
+        year_mask = year_mask & sessions.keep_mask(sessions.ensure_tags(df), exclude)
+    df = df[year_mask].copy()
+    df['Title Tokens'] = table_io.as_token_lists(df['Title Tokens'])
+    write_quarterly_reports(df, years, dtm.rows(np.flatnonzero(year_mask)) if dtm is not None else None)
+
+    state = manifest['stages']['nlp']
+    incremental.mark_stage(manifest, 'nlp', state['input_rows'] + pending, state['output_rows'] + len(delta_df))
+    incremental.save_manifest(manifest)
+    instrumentation.count_rows('nlp', pending)
+    print(f"NLP analysis complete for {pending} new rows. Processed file updated: 'watch_history_nlp.{fmt}'.")
+
+
+#the rows the keyword reports count. exclude leaves out the rows sessions.py tags as autoplay or rewatch,
+#the nlp table itself keeps every row
+def report_rows(df, dtm=None, exclude=()):
+    if not exclude:
+        return df, dtm
+    keep = sessions.keep_mask(sessions.ensure_tags(df), exclude)
+    return df[keep], dtm.rows(np.flatnonzero(keep)) if dtm is not None else None
 
-#drop the 'Locations' column
-#if anything was added to the locations column, it should automatically get added to either the state column or the country column using the mapping.
-#by dropping the locations column, all "locations" that didnt get added to either get removed thus fixing the problem of false positives
-df.drop(columns=['Locations'], inplace=True)
 
-#create a directory for quarterly reports if it doesn't exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+def main(incremental_run=False, fmt='csv', ner_batch_size=NER_BATCH_SIZE, location_engine='stanza', tokenizer='nltk',
+         exclude=()):
+    manifest = incremental.load_manifest()
+    pending = incremental.pending_rows(manifest, 'nlp', 'preprocessing') if incremental_run else None
+    if pending is not None:
+        analyze_new_rows(manifest, pending, fmt, ner_batch_size, location_engine, tokenizer, exclude)
+        return
 
-#analyze each quarter
-for year in df['Date'].apply(lambda x: pd.to_datetime(x).year).unique():
-    for quarter in ['Q1', 'Q2', 'Q3', 'Q4']:
-        quarter_df = df[(df['Date'].apply(lambda x: pd.to_datetime(x).year) == year) & (df['Quarter'] == quarter)]
-        if not quarter_df.empty:
-            all_tokens = [token for sublist in quarter_df['Title Tokens'] for token in sublist]
-            common_keywords = Counter(all_tokens).most_common(10)
+    #load in processed data
+    df, dtm = analyze(table_io.read_table(PROCESSED_CSV_PATH, fmt), ner_batch_size, location_engine, tokenizer)
+    report_df, report_dtm = report_rows(df, dtm, exclude)
+    write_quarterly_reports(report_df, dtm=report_dtm)
+    instrumentation.count_rows('nlp', len(df))
 
-            # Save quarterly analysis
-            with open(os.path.join(OUTPUT_DIR, f'{year}_{quarter}_common_keywords.txt'), 'w', encoding='utf-8') as f:
-                for keyword, count in common_keywords:
-                    f.write(f"{keyword}: {count}\n")
+    #save processed data with tokens and entities
+    table_io.write_table(df, NLP_CSV_PATH, fmt)
+    if dtm is not None:
+        token_matrix.save(dtm, NLP_CSV_PATH)
+    if manifest:
+        incremental.mark_stage(manifest, 'nlp', len(df), len(df), rebuild=True)
+        incremental.save_manifest(manifest)
 
-            print(f"{year} {quarter} analysis complete. Results saved in '{year}_{quarter}_common_keywords.txt'.")
+    print(f"NLP analysis complete. Processed file saved as 'watch_history_nlp.{fmt}'.")
 
-#save processed data with tokens and entities
-df.to_csv(os.path.join(PROJECT_DIR, 'history', 'watch_history_nlp.csv'), index=False, encoding='utf-8-sig')
 
-print("NLP analysis complete. Processed file saved as 'watch_history_nlp.csv'.")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tokenize titles and extract locations into watch_history_nlp.csv.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only analyze rows added since the last run and merge them into the existing output')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of the input and output tables, parquet stores the title tokens as real lists')
+    parser.add_argument('--ner-batch-size', type=int, default=NER_BATCH_SIZE,
+                        help='number of unique titles sent through stanza per batch')
+    parser.add_argument('--location-engine', choices=LOCATION_ENGINES, default='stanza',
+                        help='stanza runs neural ner, gazetteer matches the known city/state/country names directly and is much faster')
+    parser.add_argument('--tokenizer', choices=TOKENIZERS, default='nltk',
+                        help='regex tokenizes all titles at once and also saves a document-term matrix for the lda script')
+    parser.add_argument('--exclude', nargs='+', choices=sessions.FLAGS, default=[],
+                        help='leave the videos sessions.py tags as autoplay runs or rewatches out of the keyword reports')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'nlp'):
+        main(incremental_run=args.incremental, fmt=args.format, ner_batch_size=args.ner_batch_size,
+             location_engine=args.location_engine, tokenizer=args.tokenizer, exclude=args.exclude)
@@ -5,36 +5,52 @@
 #this prevents flukes and outliers
 
 import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
+import numpy as np
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import os
+import instrumentation
+import sessions
+import table_io
+import token_index
+import token_matrix
 
 #define the project directory
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 NLP_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_nlp.csv')
 OUTPUT_DIR = os.path.join(PROJECT_DIR, 'history', 'lda_analysis_by_quarter')
 
-#load the data with tokens
-df = pd.read_csv(NLP_CSV_PATH, encoding='utf-8')
-
-#combine tokens into a single string for each video title
-df['Title Tokens Combined'] = df['Title Tokens'].apply(lambda x: ' '.join(eval(x)))
-
 #initialize CountVectorizer with increased minimum document frequency to reduce sensitivity
 #if you want more topics outputted, increase sensitivity. if you want only the ones with the highest frequency, decrease it.
-vectorizer = CountVectorizer(min_df=0.027, ngram_range=(1, 3))  # adjust min_df to increase/decrease sensitivity
+#these are the defaults, run_lda also takes them as arguments so the pipeline runner can change them
+MIN_DF = 0.027  # adjust min_df to increase/decrease sensitivity
+NGRAM_RANGE = (1, 3)
 
 #initialize LDA
+#every quarter is fitted with the same seed, so the results are the same no matter how many workers fit them
 n_topics = 5  # change n_topics as needed
-lda = LatentDirichletAllocation(n_components=n_topics, random_state=42)
+RANDOM_STATE = 42
+
+#warm start mode: how many online passes each quarter gets on top of the previous quarter's model
+WARM_START_PASSES = 10
 
 
 #function to display topics
-def display_topics(model, feature_names, no_top_words):
-    topics = {}
-    for topic_idx, topic in enumerate(model.components_):
-        topics[f'Topic {topic_idx + 1}'] = [feature_names[i] for i in topic.argsort()[:-no_top_words - 1:-1]]
+#present can mark which features actually occur in the quarter, the warm started models share one vocabulary
+#for every quarter so words from other quarters are skipped
+def display_topics(components, feature_names, no_top_words, present=None):
+    return {f'Topic {topic_idx + 1}': [feature_names[i] for i in indices]
+            for topic_idx, indices in enumerate(top_feature_indices(components, no_top_words, present))}
+
+
+#same as display_topics but gives the column of every top word, so the counts can be read from the matrix
+def top_feature_indices(components, no_top_words, present=None):
+    topics = []
+    for topic in components:
+        if present is not None:
+            topic = np.where(present, topic, -np.inf)
+        topics.append([i for i in topic.argsort()[:-no_top_words - 1:-1] if present is None or present[i]])
     return topics
 
 
@@ -42,12 +58,12 @@ def display_topics(model, feature_names, no_top_words):
 #this prevents video topics that are watched ust once from appearing
 #if i watch a video with a unique topic just one time, it is reported along with other video topics that span over several different videos
 #that is not indicative of a trend, and can be considered an outlier. so for that reason it is good to filter out these flukes.
-def get_unique_video_urls_per_token(token, tokens_column, urls_column):
-    unique_urls = set()
-    for tokens, url in zip(tokens_column, urls_column):
-        if token in eval(tokens):
-            unique_urls.add(url)
-    return unique_urls
+#the token -> video index is built once per year, after that every topic word is a single lookup
+@instrumentation.timed('token_url_index', rows=lambda index, yearly_df, *args, **kwargs: len(yearly_df))
+def build_url_index(yearly_df, yearly_dtm=None, vocabulary=None):
+    if yearly_dtm is not None:
+        return token_index.TokenUrlIndex.from_matrix(yearly_dtm, yearly_df['URL'], vocabulary)
+    return token_index.TokenUrlIndex.from_lists(yearly_df['Title Tokens'], yearly_df['URL'])
 
 
 #filter out numerical-only tokens. digits are not insightful in this case.
@@ -56,40 +72,226 @@ def filter_numerical_tokens(tokens):
     return [token for token in tokens if not token.isdigit()]
 
 
-#create a directory for LDA analysis if it doesn't exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-#analyze each quarter
-lda_results = []
-for year in df['Date'].apply(lambda x: pd.to_datetime(x).year).unique():
-    yearly_df = df[pd.to_datetime(df['Date']).dt.year == year]
-    for quarter in ['Q1', 'Q2', 'Q3', 'Q4']:
-        quarter_df = df[(pd.to_datetime(df['Date']).dt.year == year) & (df['Quarter'] == quarter)]
-        if not quarter_df.empty:
-            token_matrix = vectorizer.fit_transform(quarter_df['Title Tokens Combined'])
-            lda.fit(token_matrix)
-            feature_names = vectorizer.get_feature_names_out()
-            topics = display_topics(lda, feature_names, no_top_words=10)
-
-            for words in topics.values():
-                for word in words:
-                    if not word.isdigit():  # Skip numerical-only tokens
-                        unique_urls = get_unique_video_urls_per_token(word, yearly_df['Title Tokens'], yearly_df['URL'])
-                        if len(unique_urls) >= 2:  # Ensure the token appears in at least 2 distinct video URLs within the year
-                            word_count = quarter_df['Title Tokens Combined'].str.count(word).sum()
-                            lda_results.append({
-                                'Year': year,
-                                'Date': pd.to_datetime(quarter_df['Date']).dt.strftime('%m %d %Y').unique()[0],
-                                # Ensure date format
-                                'Quarter': quarter,
-                                'Word': word,
-                                'Frequency': word_count
-                            })
-
-#remove duplicates
-lda_results_df = pd.DataFrame(lda_results).drop_duplicates()
+#load the data with tokens.
+#the tokens are turned back into lists once here instead of every time a token gets looked up
+def load_tokens(fmt='csv'):
+    df = table_io.read_table(NLP_CSV_PATH, fmt)
+    df['Title Tokens'] = table_io.as_token_lists(df['Title Tokens'])
+    return combine_tokens(df)
+
+
+#combine tokens into a single string for each video title
+def combine_tokens(df):
+    df['Title Tokens Combined'] = df['Title Tokens'].apply(' '.join)
+    return df
+
+
+#the year of every row. a timestamp the preprocessing step already parsed is used as it is,
+#otherwise the date strings are parsed
+def row_years(df):
+    if 'Timestamp' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+        return df['Timestamp'].dt.year
+    return pd.to_datetime(df['Date']).dt.year
+
+
+#loads the document-term matrix the nlp script saves with --tokenizer regex.
+#it has to have exactly one row per row of the nlp table, otherwise it is left over from an older run
+def load_matrix(df):
+    dtm = token_matrix.load(NLP_CSV_PATH)
+    if dtm.matrix.shape[0] != len(df):
+        raise ValueError(f"The document-term matrix has {dtm.matrix.shape[0]} rows but watch_history_nlp has {len(df)}, "
+                         "rerun 03_nlp_analysis.py with --tokenizer regex.")
+    return dtm
+
+
+#the matrix version of vectorizer.fit_transform: drops the terms that are in fewer than MIN_DF of the videos,
+#the same rule CountVectorizer uses for a fractional min_df. returns the kept columns, which can be empty
+def matrix_columns(dtm_rows, min_df=MIN_DF):
+    matrix = dtm_rows.canonical()
+    document_frequency = np.bincount(matrix.indices, minlength=len(dtm_rows.terms))
+    return np.flatnonzero(document_frequency >= min_df * matrix.shape[0])
+
+
+#cuts the data into one job per quarter, each with its token matrix and feature names.
+#with shared_vocabulary every quarter uses the columns of one vocabulary built over the whole history,
+#which the warm start mode needs so one quarter's topic-word weights line up with the next one's.
+#the document-term matrix already holds the n-grams the nlp script made, so ngram_range only applies without it
+def quarter_jobs(df, dtm=None, shared_vocabulary=False, min_df=MIN_DF, ngram_range=NGRAM_RANGE):
+    #sklearn takes a while to import, so it is only imported once lda actually runs
+    from sklearn.feature_extraction.text import CountVectorizer
+    vectorizer = CountVectorizer(min_df=min_df, ngram_range=ngram_range)
+    vocabulary = dtm.vocabulary if dtm is not None else None
+    if shared_vocabulary:
+        if dtm is not None:
+            shared_columns = matrix_columns(dtm, min_df)
+            shared_features = np.asarray(dtm.terms, dtype=object)[shared_columns]
+        else:
+            shared_vectorizer = vectorizer.fit(df['Title Tokens Combined'])
+            shared_features = shared_vectorizer.get_feature_names_out()
+
+    jobs = []
+    years = row_years(df)
+    for year in years.unique():
+        yearly_mask = years == year
+        yearly_df = df[yearly_mask]
+        url_index = build_url_index(yearly_df, dtm.rows(np.flatnonzero(yearly_mask.to_numpy())) if dtm is not None else None,
+                                    vocabulary)
+        for quarter in ['Q1', 'Q2', 'Q3', 'Q4']:
+            quarter_mask = yearly_mask & (df['Quarter'] == quarter)
+            quarter_df = df[quarter_mask]
+            if quarter_df.empty:
+                continue
+            if dtm is not None:
+                quarter_dtm = dtm.rows(np.flatnonzero(quarter_mask.to_numpy()))
+                columns = shared_columns if shared_vocabulary else matrix_columns(quarter_dtm, min_df)
+                if not len(columns):
+                    continue
+                quarter_matrix = quarter_dtm.canonical()[:, columns]
+                feature_names = shared_features if shared_vocabulary else np.asarray(quarter_dtm.terms, dtype=object)[columns]
+            elif shared_vocabulary:
+                quarter_matrix = shared_vectorizer.transform(quarter_df['Title Tokens Combined'])
+                feature_names = shared_features
+            else:
+                quarter_matrix = vectorizer.fit_transform(quarter_df['Title Tokens Combined'])
+                feature_names = vectorizer.get_feature_names_out()
+            jobs.append({
+                'year': year,
+                'quarter': quarter,
+                'quarter_df': quarter_df,
+                'matrix': quarter_matrix,
+                'feature_names': feature_names,
+                'url_index': url_index,
+            })
+    return jobs
+
+
+#number of videos in all the quarter jobs, for the run report
+def job_rows(jobs):
+    return sum(job['matrix'].shape[0] for job in jobs)
+
+
+#fits one quarter from scratch and gives back its topic-word weights.
+#kept at module level so it can be sent to worker processes
+@instrumentation.timed('lda.fit', rows=lambda components, matrix, *args, **kwargs: matrix.shape[0])
+def fit_quarter(matrix, n_components=n_topics, random_state=RANDOM_STATE):
+    from sklearn.decomposition import LatentDirichletAllocation
+    model = LatentDirichletAllocation(n_components=n_components, random_state=random_state)
+    model.fit(matrix)
+    return model.components_
+
+
+#quarters do not depend on each other, so with more than one worker they are fitted side by side.
+#executor.map gives the results back in the same order as the jobs
+@instrumentation.timed('lda.fit_all_quarters', rows=lambda components, jobs, *args, **kwargs: job_rows(jobs))
+def fit_independent(jobs, workers=1, n_components=n_topics):
+    matrices = [job['matrix'] for job in jobs]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(fit_quarter, matrices, [n_components] * len(matrices)))
+    return [fit_quarter(matrix, n_components) for matrix in matrices]
+
+
+#online lda where each quarter starts from the model of the quarter before it (in time order),
+#so topics carry over and each quarter only needs a few passes instead of a full fit from scratch
+@instrumentation.timed('lda.fit_warm_started', rows=lambda components, jobs, *args, **kwargs: job_rows(jobs))
+def fit_warm_started(jobs, n_components=n_topics):
+    from sklearn.decomposition import LatentDirichletAllocation
+    order = sorted(range(len(jobs)), key=lambda i: (jobs[i]['year'], jobs[i]['quarter']))
+    components = [None] * len(jobs)
+    model = None
+    for i in order:
+        matrix = jobs[i]['matrix']
+        if model is None:
+            model = LatentDirichletAllocation(n_components=n_components, learning_method='online', random_state=RANDOM_STATE)
+        model.total_samples = matrix.shape[0]
+        for _ in range(WARM_START_PASSES):
+            model.partial_fit(matrix)
+        #partial_fit updates components_ in place, so each quarter keeps its own copy
+        components[i] = model.components_.copy()
+    return components
+
+
+#the frequency of a topic word is its column sum in the quarter's token matrix, so it counts whole tokens only
+#("art" no longer also counts the "art" inside "party") and every word of the quarter is counted in one go
+@instrumentation.timed('lda.topic_results', rows=lambda results, job, *args, **kwargs: len(job['quarter_df']))
+def topic_results(job, components, shared_vocabulary=False):
+    quarter_counts = np.asarray(job['matrix'].sum(axis=0)).ravel()
+    present = quarter_counts > 0 if shared_vocabulary else None
+    columns = [i for indices in top_feature_indices(components, 10, present) for i in indices]
+    words = np.asarray(job['feature_names'], dtype=object)[columns]
+
+    keep = [not word.isdigit()  # Skip numerical-only tokens
+            and job['url_index'].distinct_url_count(word) >= 2  # Ensure the token appears in at least 2 distinct video URLs within the year
+            for word in words]
+    columns = np.asarray(columns, dtype=np.int64)[keep]
+
+    #the date is the same for every row of the quarter so it is worked out once
+    date = pd.to_datetime(job['quarter_df']['Date']).dt.strftime('%m %d %Y').unique()[0]  # Ensure date format
+    return pd.DataFrame({
+        'Year': job['year'],
+        'Date': date,
+        'Quarter': job['quarter'],
+        'Word': words[keep],
+        'Frequency': quarter_counts[columns],
+    }, columns=['Year', 'Date', 'Quarter', 'Word', 'Frequency'])
+
+
+#runs lda for every quarter. with a document-term matrix lined up with df, the quarters are cut straight
+#out of it instead of running the vectorizer over the joined token strings again.
+#workers fits the quarters in parallel, warm_start fits them in time order starting from the previous quarter
+def run_lda(df, dtm=None, workers=1, warm_start=False, min_df=MIN_DF, n_topics=n_topics, ngram_range=NGRAM_RANGE):
+    #analyze each quarter
+    jobs = quarter_jobs(df, dtm, warm_start, min_df, ngram_range)
+    if warm_start:
+        all_components = fit_warm_started(jobs, n_topics)
+    else:
+        all_components = fit_independent(jobs, workers, n_topics)
+
+    lda_results = [topic_results(job, components, shared_vocabulary=warm_start)
+                   for job, components in zip(jobs, all_components)]
+    if not lda_results:
+        return pd.DataFrame(columns=['Year', 'Date', 'Quarter', 'Word', 'Frequency'])
+
+    #remove duplicates
+    return pd.concat(lda_results, ignore_index=True).drop_duplicates()
+
 
 #save LDA results to CSV
-lda_results_df.to_csv(os.path.join(OUTPUT_DIR, 'lda_topics_by_quarter.csv'), index=False, encoding='utf-8-sig')
+def save_results(lda_results_df, output_dir=OUTPUT_DIR):
+    #create a directory for LDA analysis if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+    lda_results_df.to_csv(os.path.join(output_dir, 'lda_topics_by_quarter.csv'), index=False, encoding='utf-8-sig')
+
+
+#exclude leaves out the rows sessions.py tags as autoplay or rewatch, so the topics come from videos picked by hand
+def main(fmt='csv', use_dtm=False, workers=1, warm_start=False, exclude=()):
+    df = load_tokens(fmt)
+    dtm = load_matrix(df) if use_dtm else None
+    if exclude:
+        keep = sessions.keep_mask(sessions.ensure_tags(df), exclude)
+        df = df[keep]
+        dtm = dtm.rows(np.flatnonzero(keep)) if dtm is not None else None
+    lda_results_df = run_lda(df, dtm, workers, warm_start)
+    save_results(lda_results_df)
+    instrumentation.count_rows('lda', len(df))
+
+    print("LDA analysis complete. Topics by quarter saved in 'lda_topics_by_quarter.csv'.")
+
 
-print("LDA analysis complete. Topics by quarter saved in 'lda_topics_by_quarter.csv'.")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find topics per quarter with LDA and save them to lda_topics_by_quarter.csv.')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of watch_history_nlp written by the nlp script')
+    parser.add_argument('--use-dtm', action='store_true',
+                        help='fit lda on the document-term matrix saved by 03_nlp_analysis.py --tokenizer regex')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='fit this many quarters at the same time in separate processes')
+    parser.add_argument('--warm-start', action='store_true',
+                        help="fit quarters in time order with online lda, each starting from the previous quarter's topics")
+    parser.add_argument('--exclude', nargs='+', choices=sessions.FLAGS, default=[],
+                        help='leave out the videos sessions.py tags as autoplay runs or rewatches')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'lda'):
+        main(fmt=args.format, use_dtm=args.use_dtm, workers=args.workers, warm_start=args.warm_start,
+             exclude=args.exclude)
@@ -5,116 +5,210 @@
 #youtube does not report watchtime for each video in this dataset so number of clicked on videos will be "watchtime".
 
 import pandas as pd
+import numpy as np
+import argparse
 import os
 import calendar
+import instrumentation
+import sessions
+import table_io
 
 # define the project directory
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROCESSED_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_processed.csv')
 OUTPUT_DIR = os.path.join(PROJECT_DIR, 'history', 'insights')
 
-#load in the processed data
-df = pd.read_csv(PROCESSED_CSV_PATH, encoding='utf-8')
 
-#ensure the 'Date' and 'Time' columns are in the correct datetime format
-df['Date'] = pd.to_datetime(df['Date'])
-df['Time'] = pd.to_datetime(df['Time'], format='%H:%M:%S').dt.time
+#the date and time formats the preprocessing script writes
+DATE_FORMAT = '%d-%b-%Y'
+TIME_FORMAT = '%H:%M:%S'
 
-#peak Watching Months
-df['Month'] = df['Date'].dt.month
-df['Year'] = df['Date'].dt.year
+#replace numeric month values with full month names to ensure readability and user friendlieness
+MONTH_NAMES = np.asarray(calendar.month_name[1:], dtype=object)
+QUARTER_LABELS = np.asarray(['Q1', 'Q2', 'Q3', 'Q4'], dtype=object)
+#placeholder dates that wont be present in the data visualization phase. tableau just likes to have them so well plug in estimates.
+QUARTER_START_DATES = np.asarray(['01-Jan-', '01-Apr-', '01-Jul-', '01-Oct-'], dtype=object)
 
-#generate all possible Year-Month combinations within the date range
-all_months = pd.date_range(start=df['Date'].min().to_period('M').to_timestamp(), end=df['Date'].max().to_period('M').to_timestamp(), freq='M')
-all_months_df = pd.DataFrame([(date.year, date.month) for date in all_months], columns=['Year', 'Month'])
 
-#group by Year and Month and fill missing months with zeros
-#it is important to have missing zeroes in this case. otherwise, the script would just skip over time periods with no activity.
-#this is bad especially in the data visualization phase because those skipped values will cause discontinuities
-#most data visualization softwares cant handle them so its best to represent those periods with no watchtime as zeroes rather than skipping.
-monthly_watchtime = df.groupby(['Year', 'Month']).size().reset_index(name='Total Watchtime')
-monthly_watchtime = all_months_df.merge(monthly_watchtime, on=['Year', 'Month'], how='left').fillna(0)
+#parses every distinct string only once and gives back the code of every row plus the parsed distinct values
+def parse_distinct(values, date_format):
+    codes, uniques = pd.factorize(values)
+    return codes, pd.to_datetime(pd.Index(uniques, dtype=object), format=date_format)
+
 
 #cap outliers using IQR method
 #sometimes I would leave youtube autoplay on while going to sleep, causing outliers in watched videos.
 #it is important to cap those outliers as they can deceivingly skew the data in the data visualization phase.
 #this is standard in the field of statistics as data science.
-Q1 = monthly_watchtime['Total Watchtime'].quantile(0.25)
-Q3 = monthly_watchtime['Total Watchtime'].quantile(0.75)
-IQR = Q3 - Q1
-upper_bound = Q3 + 1.5 * IQR
-
-monthly_watchtime['Total Watchtime'] = monthly_watchtime['Total Watchtime'].apply(lambda x: min(x, upper_bound))
-
-#round 'Total Watchtime' to the nearest integer
-monthly_watchtime['Total Watchtime'] = monthly_watchtime['Total Watchtime'].round().astype(int)
-
-#replace numeric month values with full month names to ensure readability and user friendlieness
-monthly_watchtime['Month'] = monthly_watchtime['Month'].apply(lambda x: calendar.month_name[x])
-
-#save peak watching months to CSV
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-monthly_watchtime.to_csv(os.path.join(OUTPUT_DIR, 'peak_watching_months.csv'), index=False, encoding='utf-8-sig')
-
-#most Active Hours in Each Quarter
-def get_quarter(month):
-    if month in [1, 2, 3]:
-        return 'Q1'
-    elif month in [4, 5, 6]:
-        return 'Q2'
-    elif month in [7, 8, 9]:
-        return 'Q3'
-    else:
-        return 'Q4'
-
-df['Quarter'] = df['Date'].dt.month.apply(get_quarter)
-df['Hour'] = df['Time'].apply(lambda x: x.hour)
-
-#create a DataFrame with all combinations of Year, Quarter, and Hour
-years = df['Year'].unique()
-quarters = df['Quarter'].unique()
-hours = list(range(0, 24))
-
-all_combinations = pd.MultiIndex.from_product([years, quarters, hours], names=['Year', 'Quarter', 'Hour'])
-all_combinations_df = pd.DataFrame(index=all_combinations).reset_index()
-
-#merge with the original data to fill in missing hours with zeros
-#missing zeroes are important for the same reasons commented above.
-quarterly_active_hours = df.groupby(['Year', 'Quarter', 'Hour']).size().reset_index(name='Total Watchtime')
-merged_df = pd.merge(all_combinations_df, quarterly_active_hours, on=['Year', 'Quarter', 'Hour'], how='left').fillna(0)
-
-#generate a date for each row based on the year and quarter
-def generate_date(year, quarter):
-    if quarter == 'Q1':
-        return f'01-Jan-{year}'
-    elif quarter == 'Q2':
-        return f'01-Apr-{year}'
-    elif quarter == 'Q3':
-        return f'01-Jul-{year}'
-    elif quarter == 'Q4':
-        return f'01-Oct-{year}'
-#placeholder dates that wont be present in the data visualization phase. tableau just likes to have them so well plug in estimates.
-merged_df['Date'] = merged_df.apply(lambda row: generate_date(row['Year'], row['Quarter']), axis=1)
-
-#cap the outliers in 'Total Watchtime'
-#capped outliers are important for the same reasons referenced above.
-Q1 = merged_df['Total Watchtime'].quantile(0.25)
-Q3 = merged_df['Total Watchtime'].quantile(0.75)
-IQR = Q3 - Q1
-upper_bound = Q3 + 1.5 * IQR
-
-merged_df['Total Watchtime'] = merged_df['Total Watchtime'].apply(lambda x: min(x, upper_bound))
-
-#save the updated data to a new CSV file
-output_path = os.path.join(OUTPUT_DIR, 'most_active_hours_by_quarter_filled_capped.csv')
-merged_df.to_csv(output_path, index=False, encoding='utf-8-sig')
-
-#top 30 Most Watched YouTubers
-#creating a dataframe for youtubers watched the most.
-top_youtubers = df['Channel Name'].value_counts().head(30).reset_index()
-top_youtubers.columns = ['Channel Name', 'Watch Count']
-
-#save top 30 most watched YouTubers to CSV
-top_youtubers.to_csv(os.path.join(OUTPUT_DIR, 'top_30_youtubers.csv'), index=False, encoding='utf-8-sig')
-
-print("Peak watching months, most active hours by quarter, and top 30 YouTubers analysis complete. CSV files saved.")
+def cap_outliers(watchtime):
+    Q1, Q3 = np.quantile(watchtime, [0.25, 0.75])
+    IQR = Q3 - Q1
+    upper_bound = Q3 + 1.5 * IQR
+    return np.clip(watchtime, None, upper_bound)
+
+
+#all three insights come from counts, so every row is binned once into dense count arrays with np.bincount:
+#one count per month since the first month, one per [year, quarter, hour] and one per channel.
+#a cell nobody watched anything in just stays 0, which is the zero filling the tableau files need
+class ActivityCounts:
+    def __init__(self, first_month, monthly, first_year, hourly, year_order, quarter_order, channels, channel_counts):
+        self.first_month = first_month
+        self.monthly = monthly
+        self.first_year = first_year
+        self.hourly = hourly
+        #years and quarters are listed in the order they first show up in the data, like before
+        self.year_order = year_order
+        self.quarter_order = quarter_order
+        self.channels = channels
+        self.channel_counts = channel_counts
+
+    @classmethod
+    #weights makes every row count for its weight instead of 1, which is how autoplay and rewatches get down-weighted
+    @instrumentation.timed('activity_counts', rows=lambda counts, cls, df, *args, **kwargs: len(df))
+    def from_frame(cls, df, weights=None):
+        day_codes, days = parse_distinct(df['Date'], DATE_FORMAT)
+        clock_codes, clocks = parse_distinct(df['Time'], TIME_FORMAT)
+        valid = (day_codes >= 0) & (clock_codes >= 0)
+        row_weights = None if weights is None else np.asarray(weights, dtype=float)
+
+        #months are counted from year 0, so a month offset is just the difference of two of these
+        month_numbers = (days.year * 12 + days.month - 1).to_numpy()[day_codes[valid]]
+        hours = clocks.hour.to_numpy()[clock_codes[valid]]
+        first_month = month_numbers.min()
+        monthly = np.bincount(month_numbers - first_month, weights=None if row_weights is None else row_weights[valid])
+
+        years = month_numbers // 12
+        quarters = month_numbers % 12 // 3
+        first_year = years.min()
+        year_count = years.max() - first_year + 1
+        cells = ((years - first_year) * 4 + quarters) * 24 + hours
+        hourly = np.bincount(cells, weights=None if row_weights is None else row_weights[valid],
+                             minlength=year_count * 4 * 24).reshape(year_count, 4, 24)
+
+        channel_codes, channels = pd.factorize(df['Channel Name'])
+        channel_counts = np.bincount(channel_codes[channel_codes >= 0],
+                                     weights=None if row_weights is None else row_weights[channel_codes >= 0],
+                                     minlength=len(channels))
+        return cls(first_month, monthly, first_year, hourly, pd.unique(years), pd.unique(quarters),
+                   np.asarray(channels, dtype=object), channel_counts)
+
+    #one row for every month from the first to the last one watched
+    def monthly_watchtime(self):
+        months = self.first_month + np.arange(len(self.monthly))
+        watchtime = cap_outliers(self.monthly.astype(float))
+        return pd.DataFrame({
+            'Year': months // 12,
+            'Month': MONTH_NAMES[months % 12],
+            #round 'Total Watchtime' to the nearest integer
+            'Total Watchtime': np.round(watchtime).astype(int),
+        })
+
+    #one row for every hour of every quarter of every year, read straight out of the count array
+    def quarterly_active_hours(self):
+        years = np.asarray(self.year_order)
+        quarters = np.asarray(self.quarter_order)
+        hours = np.arange(24)
+        watchtime = self.hourly[np.ix_(years - self.first_year, quarters, hours)].ravel().astype(float)
+
+        year_column = np.repeat(years, len(quarters) * 24)
+        quarter_column = np.tile(np.repeat(quarters, 24), len(years))
+        return pd.DataFrame({
+            'Year': year_column,
+            'Quarter': QUARTER_LABELS[quarter_column],
+            'Hour': np.tile(hours, len(years) * len(quarters)),
+            #capped outliers are important for the same reasons referenced above.
+            'Total Watchtime': cap_outliers(watchtime),
+            'Date': QUARTER_START_DATES[quarter_column] + year_column.astype(str).astype(object),
+        })
+
+    #adds up the counts of several histories (the batch runner uses this for the combined team insights).
+    #the count arrays are lined up on their first month and year, channels with the same name are added together.
+    #weighted counts are fractions, so the result only stays whole numbers when every part is
+    @classmethod
+    def combine(cls, counts):
+        dtype = np.result_type(*(part.monthly.dtype for part in counts))
+        first_month = min(part.first_month for part in counts)
+        last_month = max(part.first_month + len(part.monthly) for part in counts)
+        monthly = np.zeros(last_month - first_month, dtype=dtype)
+        first_year = min(part.first_year for part in counts)
+        last_year = max(part.first_year + len(part.hourly) for part in counts)
+        hourly = np.zeros((last_year - first_year, 4, 24), dtype=dtype)
+        for part in counts:
+            offset = part.first_month - first_month
+            monthly[offset:offset + len(part.monthly)] += part.monthly
+            offset = part.first_year - first_year
+            hourly[offset:offset + len(part.hourly)] += part.hourly
+
+        channel_codes, channels = pd.factorize(np.concatenate([part.channels for part in counts]))
+        channel_counts = np.bincount(channel_codes, weights=np.concatenate([part.channel_counts for part in counts]),
+                                     minlength=len(channels)).astype(dtype)
+        return cls(first_month, monthly, first_year, hourly,
+                   pd.unique(np.concatenate([part.year_order for part in counts])),
+                   pd.unique(np.concatenate([part.quarter_order for part in counts])),
+                   np.asarray(channels, dtype=object), channel_counts)
+
+    #the channels with the most watched videos, ties keep the order the channels first show up in
+    def top_channels(self, n=30):
+        order = np.argsort(-self.channel_counts, kind='stable')[:n]
+        return pd.DataFrame({'Channel Name': self.channels[order], 'Watch Count': self.channel_counts[order]})
+
+
+def write_insights(counts, output_dir=OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+
+    #peak Watching Months
+    #it is important to have missing zeroes in this case. otherwise, the script would just skip over time periods with no activity.
+    #this is bad especially in the data visualization phase because those skipped values will cause discontinuities
+    #most data visualization softwares cant handle them so its best to represent those periods with no watchtime as zeroes rather than skipping.
+    monthly_watchtime = counts.monthly_watchtime()
+
+    #save peak watching months to CSV
+    monthly_watchtime.to_csv(os.path.join(output_dir, 'peak_watching_months.csv'), index=False, encoding='utf-8-sig')
+
+    #most Active Hours in Each Quarter
+    #missing zeroes are important for the same reasons commented above.
+    merged_df = counts.quarterly_active_hours()
+
+    #save the updated data to a new CSV file
+    output_path = os.path.join(output_dir, 'most_active_hours_by_quarter_filled_capped.csv')
+    merged_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+
+    #top 30 Most Watched YouTubers
+    #creating a dataframe for youtubers watched the most.
+    top_youtubers = counts.top_channels(30)
+
+    #save top 30 most watched YouTubers to CSV
+    top_youtubers.to_csv(os.path.join(output_dir, 'top_30_youtubers.csv'), index=False, encoding='utf-8-sig')
+
+
+#exclude leaves out the rows sessions.py tags as autoplay or rewatch, the weights count them for less instead
+def main(fmt='csv', exclude=(), autoplay_weight=1.0, rewatch_weight=1.0):
+    #load in the processed data
+    df = table_io.read_table(PROCESSED_CSV_PATH, fmt)
+    rows = len(df)
+    weights = None
+    if exclude or autoplay_weight != 1.0 or rewatch_weight != 1.0:
+        df = sessions.exclude_rows(sessions.ensure_tags(df), exclude)
+        if autoplay_weight != 1.0 or rewatch_weight != 1.0:
+            weights = sessions.row_weights(df, autoplay_weight, rewatch_weight)
+    write_insights(ActivityCounts.from_frame(df, weights))
+    instrumentation.count_rows('active_periods', rows)
+
+    print("Peak watching months, most active hours by quarter, and top 30 YouTubers analysis complete. CSV files saved.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the peak month, active hour and top channel csv files for tableau.')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of watch_history_processed written by the preprocessing script')
+    parser.add_argument('--exclude', nargs='+', choices=sessions.FLAGS, default=[],
+                        help='leave out the videos sessions.py tags as autoplay runs or rewatches')
+    parser.add_argument('--autoplay-weight', type=float, default=1.0,
+                        help='count videos tagged as autoplay for this much instead of 1, like 0.25')
+    parser.add_argument('--rewatch-weight', type=float, default=1.0,
+                        help='count videos tagged as rewatches for this much instead of 1')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'active_periods'):
+        main(fmt=args.format, exclude=args.exclude, autoplay_weight=args.autoplay_weight,
+             rewatch_weight=args.rewatch_weight)
@@ -0,0 +1,216 @@
+#runs the whole pipeline for many takeout exports in one go, for example the watch histories of a whole team.
+#the numbered scripts all work on the one history/watch-history.html of this project, so running them once per person
+#means loading stanza and nltk again every time. this runner takes a directory (or a manifest csv) of exports instead:
+#    python batch_runner.py exports/ --workers 4 --combined
+#collection, preprocessing, the active periods and lda run per user in a pool of worker processes.
+#the nlp step runs in this process, so the stanza model is loaded only once and every user shares the same ner cache.
+#the outputs of every user go to their own folder, history/users/<user>/, with the same file names the scripts use.
+#with --combined the active periods of everyone are also added up into history/users/_combined/
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import csv
+import os
+import re
+import instrumentation
+import stage_loader
+import table_io
+import token_matrix
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+USERS_DIR = os.path.join(PROJECT_DIR, 'history', 'users')
+COMBINED_DIR_NAME = '_combined'
+HTML_FILE_NAME = 'watch-history.html'
+
+
+#turns an export name into a folder name. user names never start with "_" so they cant clash with the combined folder
+def user_name(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('._') or 'user'
+
+
+#a manifest is a csv with a user and a path column. relative paths are relative to the manifest itself
+def read_manifest(manifest_path):
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    exports = {}
+    with open(manifest_path, 'r', encoding='utf-8-sig', newline='') as file:
+        for row in csv.DictReader(file):
+            add_export(exports, row['user'], os.path.join(base, row['path']))
+    return exports
+
+
+#every .html file in the directory is one user (named after the file), and every subdirectory is one user
+#(named after the folder) with the watch-history.html somewhere inside it, like in an unzipped takeout export
+def find_exports(source):
+    if os.path.isfile(source):
+        return read_manifest(source)
+
+    exports = {}
+    for entry in sorted(os.scandir(source), key=lambda entry: entry.name):
+        if entry.is_file() and entry.name.lower().endswith('.html'):
+            add_export(exports, os.path.splitext(entry.name)[0], entry.path)
+        elif entry.is_dir():
+            html_path = find_html(entry.path)
+            if html_path is not None:
+                add_export(exports, entry.name, html_path)
+    return exports
+
+
+def find_html(directory):
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        if HTML_FILE_NAME in files:
+            return os.path.join(root, HTML_FILE_NAME)
+    return None
+
+
+def add_export(exports, name, html_path):
+    user = user_name(name)
+    if user in exports:
+        raise ValueError(f"Two exports map to the user folder '{user}': {exports[user]} and {html_path}")
+    exports[user] = html_path
+
+
+#the same file names the numbered scripts write under history/, just inside the folder of the user
+def user_paths(output_root, user):
+    directory = os.path.join(output_root, user)
+    return {
+        'directory': directory,
+        'raw': os.path.join(directory, 'watch_history.csv'),
+        'processed': os.path.join(directory, 'watch_history_processed.csv'),
+        'nlp': os.path.join(directory, 'watch_history_nlp.csv'),
+        'quarterly_reports': os.path.join(directory, 'quarterly_reports'),
+        'lda': os.path.join(directory, 'lda_analysis_by_quarter'),
+        'insights': os.path.join(directory, 'insights'),
+    }
+
+
+#collection, preprocessing and active periods for one user, run in a worker process.
+#returns the processed rows for the nlp step and the activity counts for the combined insights
+def prepare_user(user, html_path, output_root, fmt='csv'):
+    collection = stage_loader.load_stage('collection')
+    preprocessing = stage_loader.load_stage('preprocessing')
+    active_periods = stage_loader.load_stage('active_periods')
+    paths = user_paths(output_root, user)
+    os.makedirs(paths['directory'], exist_ok=True)
+
+    raw_df = pd.DataFrame(collection.iter_records(html_path), columns=collection.RECORD_COLUMNS)
+    table_io.write_table(raw_df, paths['raw'], fmt)
+    df = preprocessing.preprocess(raw_df)
+    table_io.write_table(df, paths['processed'], fmt)
+
+    counts = None
+    if not df.empty:
+        counts = active_periods.ActivityCounts.from_frame(df)
+        active_periods.write_insights(counts, paths['insights'])
+    return df, counts
+
+
+#the nlp step of one user, run in this process with the models that are already loaded
+def analyze_user(nlp_stage, df, paths, fmt='csv', ner_batch_size=256, location_engine='stanza', tokenizer='nltk'):
+    df, dtm = nlp_stage.analyze(df, ner_batch_size, location_engine, tokenizer)
+    nlp_stage.write_quarterly_reports(df, dtm=dtm, output_dir=paths['quarterly_reports'])
+    table_io.write_table(df, paths['nlp'], fmt)
+    if dtm is not None:
+        token_matrix.save(dtm, paths['nlp'])
+    return df, dtm
+
+
+#lda for one user, run in a worker process
+def fit_user_topics(df, dtm, output_dir, warm_start=False):
+    lda_stage = stage_loader.load_stage('lda')
+    lda_stage.save_results(lda_stage.run_lda(lda_stage.combine_tokens(df), dtm, warm_start=warm_start), output_dir)
+
+
+#runs every export through the pipeline. a user whose export fails is reported and skipped, the others keep going.
+#returns the users that failed
+def run_batch(exports, output_root=USERS_DIR, workers=None, fmt='csv', ner_batch_size=256, location_engine='stanza',
+              tokenizer='nltk', warm_start=False, combined=False):
+    nlp_stage = stage_loader.load_stage('nlp')
+    #the workers send back objects whose classes live in the stage modules (like ActivityCounts).
+    #those can only be unpickled here when the same stages are loaded in this process as well
+    for stage in ('collection', 'preprocessing', 'active_periods'):
+        stage_loader.load_stage(stage)
+    failed = []
+    all_counts = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        prepared = {executor.submit(prepare_user, user, html_path, output_root, fmt): user
+                    for user, html_path in exports.items()}
+        #the model is loaded after the workers are started so they do not get a copy of it
+        if location_engine == 'stanza':
+            nlp_stage.get_nlp(ner_batch_size)
+
+        topic_jobs = {}
+        for future in as_completed(prepared):
+            user = prepared[future]
+            try:
+                df, counts = future.result()
+                if counts is not None:
+                    all_counts.append(counts)
+                paths = user_paths(output_root, user)
+                with instrumentation.stage('nlp') as stage_counts:
+                    df, dtm = analyze_user(nlp_stage, df, paths, fmt, ner_batch_size, location_engine, tokenizer)
+                    stage_counts['rows'] = len(df)
+            except Exception as e:
+                print(f"{user}: failed ({e})")
+                failed.append(user)
+                continue
+            print(f"{user}: {len(df)} videos collected, preprocessed and analyzed.")
+            topic_jobs[executor.submit(fit_user_topics, df, dtm, paths['lda'], warm_start)] = user
+
+        for future in as_completed(topic_jobs):
+            user = topic_jobs[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{user}: lda failed ({e})")
+                failed.append(user)
+                continue
+            print(f"{user}: lda complete.")
+
+    if combined and all_counts:
+        active_periods = stage_loader.load_stage('active_periods')
+        active_periods.write_insights(active_periods.ActivityCounts.combine(all_counts),
+                                      os.path.join(output_root, COMBINED_DIR_NAME))
+        print(f"Combined insights of {len(all_counts)} users saved in '{COMBINED_DIR_NAME}'.")
+    return failed
+
+
+def main(source, output_root=USERS_DIR, workers=None, fmt='csv', ner_batch_size=256, location_engine='stanza',
+         tokenizer='nltk', warm_start=False, combined=False):
+    exports = find_exports(source)
+    if not exports:
+        print(f"No exports found in '{source}'.")
+        return 1
+    print(f"Processing {len(exports)} exports.")
+    failed = run_batch(exports, output_root, workers, fmt, ner_batch_size, location_engine, tokenizer, warm_start, combined)
+    if failed:
+        print(f"{len(failed)} of {len(exports)} exports failed: {', '.join(sorted(set(failed)))}")
+        return 1
+    print(f"Batch complete. Outputs saved in '{output_root}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the whole pipeline for a directory or manifest of takeout exports.')
+    parser.add_argument('source', help='directory with one html file or unzipped takeout folder per user, '
+                                       'or a csv manifest with user and path columns')
+    parser.add_argument('--output-dir', default=USERS_DIR, help='every user gets a folder with their outputs in here')
+    parser.add_argument('--workers', type=int, help='number of worker processes, defaults to the number of cpus')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv', help='file format of the intermediate tables')
+    parser.add_argument('--ner-batch-size', type=int, default=256, help='number of unique titles sent through stanza per batch')
+    parser.add_argument('--location-engine', choices=['stanza', 'gazetteer'], default='stanza',
+                        help='stanza runs neural ner, gazetteer matches the known city/state/country names directly')
+    parser.add_argument('--tokenizer', choices=['nltk', 'regex'], default='nltk',
+                        help='regex tokenizes all titles at once and fits lda on the document-term matrix')
+    parser.add_argument('--warm-start', action='store_true',
+                        help="fit each user's quarters in time order, each starting from the previous quarter's topics")
+    parser.add_argument('--combined', action='store_true',
+                        help='also save the active periods and top channels of all users together')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'batch'):
+        exit_code = main(args.source, args.output_dir, args.workers, args.format, args.ner_batch_size,
+                         args.location_engine, args.tokenizer, args.warm_start, args.combined)
+    raise SystemExit(exit_code)
@@ -0,0 +1,75 @@
+#compares the gazetteer location engine with stanza ner on your own processed watch history.
+#stanza is used as the reference: recall is the share of the states/countries stanza found (after the csv mapping)
+#that the gazetteer found for the same titles. extra counts what the gazetteer found that stanza did not.
+#stanza gets an empty cache file so its time is real ner work, the model loading time is reported separately.
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+import stage_loader
+import table_io
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+#the state and country names a list of raw locations ends up as, which is what actually lands in the nlp output
+def mapped_locations(nlp_stage, locations):
+    states, countries = nlp_stage.map_locations(locations)
+    return Counter(name for name in states.split(', ') + countries.split(', ') if name)
+
+
+def compare(nlp_stage, stanza_locations, gazetteer_locations):
+    reference = found = extra = 0
+    for stanza_found, gazetteer_found in zip(stanza_locations, gazetteer_locations):
+        expected = mapped_locations(nlp_stage, stanza_found)
+        actual = mapped_locations(nlp_stage, gazetteer_found)
+        reference += sum(expected.values())
+        found += sum((expected & actual).values())
+        extra += sum((actual - expected).values())
+    return reference, found, extra
+
+
+def main(limit, fmt, ner_batch_size):
+    nlp_stage = stage_loader.load_stage('nlp')
+    df = table_io.read_table(nlp_stage.PROCESSED_CSV_PATH, fmt, nrows=limit)
+    titles = df['Video Title'].tolist()
+    print(f"Benchmarking location engines on {len(titles)} titles ({len(set(titles))} unique).")
+
+    _, load_seconds = timed(lambda: nlp_stage.get_nlp(ner_batch_size))
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, 'ner_cache.json')
+        stanza_locations, stanza_seconds = timed(
+            lambda: nlp_stage.extract_locations_batch(titles, ner_batch_size, cache_path))
+
+    nlp_stage.location_matcher = None
+    _, build_seconds = timed(lambda: nlp_stage.extract_locations_gazetteer([]))
+    gazetteer_locations, gazetteer_seconds = timed(lambda: nlp_stage.extract_locations_gazetteer(titles))
+
+    reference, found, extra = compare(nlp_stage, stanza_locations, gazetteer_locations)
+    recall = found / reference if reference else float('nan')
+
+    print(f"{'engine':<10} {'setup s':>9} {'run s':>9} {'titles/s':>12}")
+    print(f"{'stanza':<10} {load_seconds:>9.2f} {stanza_seconds:>9.2f} {len(titles) / max(stanza_seconds, 1e-9):>12.0f}")
+    print(f"{'gazetteer':<10} {build_seconds:>9.2f} {gazetteer_seconds:>9.2f} {len(titles) / max(gazetteer_seconds, 1e-9):>12.0f}")
+    print(f"Speedup: {stanza_seconds / max(gazetteer_seconds, 1e-9):.0f}x")
+    print(f"Recall vs stanza: {found}/{reference} mapped locations ({recall:.1%}), {extra} found only by the gazetteer.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare speed and recall of the stanza and gazetteer location engines.')
+    parser.add_argument('--limit', type=int, default=5000, help='number of processed rows to benchmark on')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of watch_history_processed written by the preprocessing script')
+    parser.add_argument('--ner-batch-size', type=int, default=256, help='number of unique titles sent through stanza per batch')
+    args = parser.parse_args()
+    main(args.limit, args.format, args.ner_batch_size)
@@ -0,0 +1,161 @@
+#times every stage of the pipeline on synthetic histories of growing size (see synthetic_takeout.py),
+#so the throughput of each stage can be followed from 10 thousand to 10 million rows without a real export.
+#the histories are generated with a fixed seed, so two runs on the same machine measure the same work.
+#every size gets one row per stage with the wall time, rows per second and peak memory so far,
+#saved as csv so the curves can be plotted or compared with an earlier run:
+#    python benchmarks/pipeline_benchmark.py --sizes 10000 100000 1000000
+#    python benchmarks/pipeline_benchmark.py --baseline history/benchmarks/before.csv --tolerance 0.2
+#--baseline exits with an error when any stage got slower than the baseline by more than the tolerance.
+#with the default regex tokenizer everything runs offline: the stop words are the fixed list below instead of
+#the nltk stopwords corpus, and locations are found with the gazetteer engine (running stanza over millions of titles
+#would take hours and is measured on real titles by location_engines.py instead).
+#--tokenizer nltk needs the nltk punkt data on disk, see resources.py.
+import pandas as pd
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+import instrumentation
+import stage_loader
+import synthetic_takeout
+
+OUTPUT_PATH = os.path.join(PROJECT_DIR, 'history', 'benchmarks', 'pipeline_throughput.csv')
+DEFAULT_SIZES = [10000, 100000, 1000000]
+STAGES = ['collection', 'preprocessing', 'nlp', 'lda', 'active_periods']
+RESULT_COLUMNS = ['rows', 'stage', 'seconds', 'rows_per_second', 'peak_rss_mb']
+
+#fixed stop words so the nlp stage never has to load or download the nltk corpus.
+#the synthetic titles are made up words plus "in <place>", so a short list removes the same words nltk's would
+STOP_WORDS = frozenset(['a', 'an', 'and', 'at', 'by', 'for', 'from', 'in', 'is', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def run_collection(html_path, workers):
+    collection = stage_loader.load_stage('collection')
+    if workers > 1:
+        records = collection.iter_records_parallel(html_path, workers)
+    else:
+        records = collection.iter_records(html_path)
+    return pd.DataFrame(records, columns=collection.RECORD_COLUMNS)
+
+
+def run_active_periods(df):
+    active_periods = stage_loader.load_stage('active_periods')
+    counts = active_periods.ActivityCounts.from_frame(df)
+    return counts.monthly_watchtime(), counts.quarterly_active_hours(), counts.top_channels()
+
+
+#runs the five stages one after the other on one history, the same way pipeline.py hands the tables along.
+#returns {stage: seconds}, the fastest of repeat runs for every stage
+def time_stages(html_path, stages=STAGES, repeat=1, workers=1, tokenizer='regex'):
+    preprocessing = stage_loader.load_stage('preprocessing')
+    nlp_stage = stage_loader.load_stage('nlp')
+    nlp_stage.stop_words = STOP_WORDS
+    lda_stage = stage_loader.load_stage('lda')
+
+    best = {}
+    for _ in range(repeat):
+        seconds = {}
+        raw_df, seconds['collection'] = timed(lambda: run_collection(html_path, workers))
+        df, seconds['preprocessing'] = timed(lambda: preprocessing.preprocess(raw_df, time_columns=True))
+        if 'nlp' in stages or 'lda' in stages:
+            (nlp_df, dtm), seconds['nlp'] = timed(lambda: nlp_stage.analyze(df.copy(), location_engine='gazetteer',
+                                                                            tokenizer=tokenizer))
+        if 'lda' in stages:
+            _, seconds['lda'] = timed(lambda: lda_stage.run_lda(lda_stage.combine_tokens(nlp_df), dtm, workers))
+        if 'active_periods' in stages:
+            _, seconds['active_periods'] = timed(lambda: run_active_periods(df))
+        for stage, stage_seconds in seconds.items():
+            best[stage] = min(best.get(stage, stage_seconds), stage_seconds)
+    return {stage: best[stage] for stage in stages if stage in best}
+
+
+def benchmark(sizes=DEFAULT_SIZES, stages=STAGES, repeat=1, workers=1, tokenizer='regex', seed=0, keep_dir=None):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = keep_dir or temp_dir
+        for rows in sizes:
+            html_path = os.path.join(directory, f'watch-history-{rows}-seed{seed}.html')
+            if not os.path.exists(html_path):
+                _, generate_seconds = timed(lambda: synthetic_takeout.write_history(html_path, rows, seed))
+                print(f"Generated {rows} rows in {generate_seconds:.1f}s.")
+            for stage, seconds in time_stages(html_path, stages, repeat, workers, tokenizer).items():
+                results.append({
+                    'rows': rows,
+                    'stage': stage,
+                    'seconds': round(seconds, 4),
+                    'rows_per_second': round(rows / seconds, 1) if seconds else None,
+                    'peak_rss_mb': instrumentation.peak_rss_mb(),
+                })
+                print(f"{rows:>10} {stage:<16} {seconds:>10.2f}s {rows / max(seconds, 1e-9):>14.0f} rows/s")
+    return results
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Throughput saved to {path}")
+
+
+#the (rows, stage) pairs whose rows per second dropped below (1 - tolerance) times the baseline
+def regressions(results, baseline_path, tolerance=0.2):
+    with open(baseline_path, 'r', encoding='utf-8', newline='') as file:
+        baseline = {(int(row['rows']), row['stage']): float(row['rows_per_second'])
+                    for row in csv.DictReader(file) if row['rows_per_second']}
+    slower = []
+    for row in results:
+        before = baseline.get((row['rows'], row['stage']))
+        if before and row['rows_per_second'] is not None and row['rows_per_second'] < before * (1 - tolerance):
+            slower.append((row['rows'], row['stage'], before, row['rows_per_second']))
+    return slower
+
+
+def main(sizes=DEFAULT_SIZES, stages=STAGES, repeat=1, workers=1, tokenizer='regex', seed=0, keep_dir=None,
+         output_path=OUTPUT_PATH, baseline_path=None, tolerance=0.2):
+    print(f"{'rows':>10} {'stage':<16} {'seconds':>11} {'throughput':>20}")
+    results = benchmark(sizes, stages, repeat, workers, tokenizer, seed, keep_dir)
+    write_results(results, output_path)
+
+    if baseline_path:
+        slower = regressions(results, baseline_path, tolerance)
+        for rows, stage, before, after in slower:
+            print(f"Regression: {stage} at {rows} rows went from {before:.0f} to {after:.0f} rows/s.")
+        if slower:
+            return 1
+        print(f"No stage is more than {tolerance:.0%} slower than {baseline_path}.")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic histories of several sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='number of rows of every history')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                        help='stages to report, collection and preprocessing always run since the others need their output')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size, the fastest one counts')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the html parse and lda')
+    parser.add_argument('--tokenizer', choices=['nltk', 'regex'], default='regex', help='tokenizer of the nlp stage')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic histories')
+    parser.add_argument('--keep-dir', help='keep the generated histories in this directory and reuse them on later runs')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='csv file the throughput is saved to')
+    parser.add_argument('--baseline', help='earlier output csv to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='share of the baseline rows per second a stage may lose before it counts as a regression')
+    args = parser.parse_args()
+    if args.keep_dir:
+        os.makedirs(args.keep_dir, exist_ok=True)
+    raise SystemExit(main(args.sizes, args.stages, args.repeat, args.workers, args.tokenizer, args.seed, args.keep_dir,
+                          args.output, args.baseline, args.tolerance))
@@ -0,0 +1,89 @@
+#measures how long every script takes to import, each in a fresh python process so nothing is already loaded.
+#importing a stage should be cheap now that nltk, stanza and sklearn are only loaded when they are used,
+#so a stage that suddenly takes seconds to import points at a heavy import that crept back to the top of a file.
+#with --models it also times loading the nltk stop words and the stanza pipeline from disk.
+#--max-seconds makes it exit with an error when any import is slower than that, so it can run as a check:
+#    python benchmarks/startup.py --repeat 5 --max-seconds 2
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+import stage_loader
+
+#what gets timed in the fresh process, the time is printed as the last line
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {project_dir!r})
+start = time.perf_counter()
+import stage_loader
+stage_loader.load_stage({stage!r})
+print(time.perf_counter() - start)
+"""
+
+MODEL_SNIPPETS = {
+    'nltk stop words': "nlp_stage.get_stop_words()",
+    'stanza pipeline': "nlp_stage.get_nlp()",
+}
+
+MODEL_SNIPPET = """
+import sys, time
+sys.path.insert(0, {project_dir!r})
+import stage_loader
+nlp_stage = stage_loader.load_stage('nlp')
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def time_snippet(snippet):
+    result = subprocess.run([sys.executable, '-c', snippet], capture_output=True, text=True, cwd=PROJECT_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(snippet, repeat):
+    try:
+        times = [time_snippet(snippet) for _ in range(repeat)]
+    except RuntimeError as e:
+        return None, str(e)
+    return times, None
+
+
+def main(repeat=3, models=False, max_seconds=None):
+    cases = [(f'import {stage}', IMPORT_SNIPPET.format(project_dir=PROJECT_DIR, stage=stage))
+             for stage in stage_loader.STAGE_FILES]
+    if models:
+        cases += [(f'load {name}', MODEL_SNIPPET.format(project_dir=PROJECT_DIR, code=code))
+                  for name, code in MODEL_SNIPPETS.items()]
+
+    print(f"{'step':<26} {'min s':>8} {'median s':>9}")
+    too_slow = []
+    for name, snippet in cases:
+        times, error = measure(snippet, repeat)
+        if times is None:
+            print(f"{name:<26} failed: {error}")
+            continue
+        print(f"{name:<26} {min(times):>8.3f} {statistics.median(times):>9.3f}")
+        if max_seconds is not None and name.startswith('import') and min(times) > max_seconds:
+            too_slow.append(name)
+
+    if too_slow:
+        print(f"Slower than {max_seconds}s: {', '.join(too_slow)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time how long the scripts take to import and the models take to load.')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per step, the fastest one counts')
+    parser.add_argument('--models', action='store_true', help='also time loading the nltk stop words and the stanza pipeline')
+    parser.add_argument('--max-seconds', type=float, help='exit with an error when an import takes longer than this')
+    args = parser.parse_args()
+    raise SystemExit(main(args.repeat, args.models, args.max_seconds))
@@ -0,0 +1,207 @@
+#writes a made up watch-history.html with the same markup a real takeout export has, so the pipeline can be
+#measured at any size without anyones private history. the same seed always gives the same file.
+#every entry is an outer-cell div with the video link, the channel link and the "Jul 20, 2024, 10:15:32 PM EDT"
+#line at the end of the first content cell, exactly what 01_data_collection.py looks for, newest entry first.
+#videos are drawn from a pool with a few very popular ones (rewatches and autoplay repeat titles a lot),
+#titles are built from a made up vocabulary where some words are much more common than others,
+#some titles mention a city, state or country from the mapping csvs so the location step has something to find,
+#and a few channels get most of the views like on a real account:
+#    python benchmarks/synthetic_takeout.py --rows 1000000 --output history/synthetic/watch-history.html
+import pandas as pd
+import numpy as np
+import argparse
+import html
+import os
+import sys
+from datetime import date, timedelta
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_DIR = os.path.join(PROJECT_DIR, 'history')
+OUTPUT_PATH = os.path.join(HISTORY_DIR, 'synthetic', 'watch-history.html')
+
+OUTER_CELL_CLASS = 'outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp'
+CONTENT_CELL_CLASS = 'content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1'
+
+HEADER = ('<html><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
+          '<title>Watch history</title></head><body><div class="mdl-grid">\n')
+FOOTER = '</div></body></html>\n'
+
+#one watched video, laid out like takeout does it. the date is the last text of the first content cell
+ENTRY = ('<div class="' + OUTER_CELL_CLASS + '"><div class="mdl-grid">'
+         '<div class="header-cell mdl-cell mdl-cell--12-col"><p class="mdl-typography--title">YouTube<br></p></div>'
+         '<div class="' + CONTENT_CELL_CLASS + '">Watched\xa0<a href="https://www.youtube.com/watch?v={video_id}">{title}</a>'
+         '<br><a href="https://www.youtube.com/channel/{channel_id}">{channel}</a><br>{date_time}</div>'
+         '<div class="content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1 mdl-typography--text-right"></div>'
+         '<div class="content-cell mdl-cell mdl-cell--12-col mdl-typography--caption">'
+         '<b>Products:</b><br> YouTube<br></div></div></div>\n')
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'te', 'su', 'no', 'vi', 'da', 'pe', 'zu', 'ha', 'ri', 'mo', 'ne', 'ba', 'ti',
+             'go', 'le', 'fa', 'shi', 'qua', 'ron', 'dex', 'tor', 'lin', 'mar', 'vel', 'sta', 'gri']
+ID_CHARACTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'))
+MONTH_ABBREVIATIONS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+#share of the views per hour of the day, quiet at night and busiest in the evening
+HOUR_WEIGHTS = np.array([3, 2, 1, 1, 1, 1, 1, 2, 3, 3, 3, 4, 4, 4, 4, 5, 5, 6, 7, 8, 9, 9, 7, 5], dtype=float)
+
+#rows are drawn and written this many at a time, so even 10 million rows only keep one chunk in memory
+CHUNK_SIZE = 100000
+
+
+#probabilities falling off like 1 / rank ** exponent, the usual shape of word and channel popularity
+def zipf_weights(n, exponent):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+#made up words from syllables, all different and at least two syllables long so no real stop word shows up
+def make_vocabulary(size, rng):
+    words = []
+    seen = set()
+    while len(words) < size:
+        syllable_count = rng.integers(2, 5)
+        word = ''.join(rng.choice(SYLLABLES, syllable_count))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return np.array(words, dtype=object)
+
+
+def random_ids(n, length, rng, prefix=''):
+    characters = ID_CHARACTERS[rng.integers(0, len(ID_CHARACTERS), size=(n, length))]
+    return [prefix + ''.join(row) for row in characters]
+
+
+#the city, state and country names the nlp step maps, so the mentioned locations really end up in the output
+def load_places(history_dir=HISTORY_DIR):
+    places = []
+    for file_name, columns in (('city_state_mapping.csv', ['City', 'State']), ('citiestocountries.csv', ['City', 'Country'])):
+        path = os.path.join(history_dir, file_name)
+        if os.path.exists(path):
+            mapping = pd.read_csv(path, encoding='utf-8-sig')
+            for column in columns:
+                places.extend(mapping[column].dropna().astype(str))
+    return sorted(set(places))
+
+
+#the pool of videos the history is drawn from, every video with its own id, title and channel
+def make_videos(n_videos, vocabulary, places, n_channels, rng, title_words=(3, 9), location_rate=0.05,
+                word_exponent=1.1, channel_exponent=1.2):
+    word_weights = zipf_weights(len(vocabulary), word_exponent)
+    lengths = rng.integers(title_words[0], title_words[1] + 1, size=n_videos)
+    words = rng.choice(vocabulary, size=lengths.sum(), p=word_weights)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    titles = [' '.join(words[offsets[i]:offsets[i + 1]]).capitalize() for i in range(n_videos)]
+
+    if places and location_rate > 0:
+        mentions = np.flatnonzero(rng.random(n_videos) < location_rate)
+        for i, place in zip(mentions, rng.choice(np.array(places, dtype=object), size=len(mentions))):
+            titles[i] = f"{titles[i]} in {place}"
+
+    channel_names = [f"{name.capitalize()} {kind}" for name, kind in
+                     zip(make_vocabulary(n_channels, rng), rng.choice(['TV', 'Official', 'Studio', 'Live', 'Plays'], n_channels))]
+    channel_ids = random_ids(n_channels, 22, rng, prefix='UC')
+    channels = rng.choice(n_channels, size=n_videos, p=zipf_weights(n_channels, channel_exponent))
+    return {
+        'video_ids': random_ids(n_videos, 11, rng),
+        'titles': [html.escape(title, quote=False) for title in titles],
+        'channels': channels,
+        'channel_names': [html.escape(name, quote=False) for name in channel_names],
+        'channel_ids': channel_ids,
+    }
+
+
+#takeout writes "Jul 20, 2024, 10:15:32 PM EDT". the zone is just EDT in summer and EST in winter,
+#the collection script drops it anyway
+def format_days(first_day, day_count):
+    labels = []
+    for offset in range(day_count):
+        day = first_day + timedelta(days=offset)
+        zone = 'EDT' if 3 < day.month < 11 else 'EST'
+        labels.append((f"{MONTH_ABBREVIATIONS[day.month - 1]} {day.day}, {day.year}", zone))
+    return labels
+
+
+def format_clock(seconds):
+    hour, rest = divmod(int(seconds), 3600)
+    minute, second = divmod(rest, 60)
+    return f"{hour % 12 or 12}:{minute:02d}:{second:02d} {'AM' if hour < 12 else 'PM'}"
+
+
+#the moment of every view as (day offset, second of the day), newest first like takeout lists them
+def draw_times(rows, day_count, rng):
+    days = rng.integers(0, day_count, size=rows)
+    hours = rng.choice(24, size=rows, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = hours * 3600 + rng.integers(0, 3600, size=rows)
+    moments = np.sort(days.astype(np.int64) * 86400 + seconds)[::-1]
+    return moments // 86400, moments % 86400
+
+
+#writes the history and returns the number of entries written
+def write_history(output_path=OUTPUT_PATH, rows=10000, seed=0, vocabulary_size=5000, videos=None, channels=500,
+                  location_rate=0.05, start='2015-01-01', end='2024-12-31', title_words=(3, 9), video_exponent=1.0,
+                  channel_exponent=1.2, word_exponent=1.1):
+    rng = np.random.default_rng(seed)
+    first_day = date.fromisoformat(start)
+    day_count = (date.fromisoformat(end) - first_day).days + 1
+    if day_count <= 0:
+        raise ValueError(f"The end date {end} is before the start date {start}.")
+
+    #roughly a third of the views are repeats of a video that was already watched
+    n_videos = videos or max(1, rows * 2 // 3)
+    pool = make_videos(n_videos, make_vocabulary(vocabulary_size, rng), load_places(), channels, rng, title_words,
+                       location_rate, word_exponent, channel_exponent)
+    video_weights = zipf_weights(n_videos, video_exponent)
+    day_labels = format_days(first_day, day_count)
+    clock_labels = {}
+
+    day_offsets, clock_seconds = draw_times(rows, day_count, rng)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        file.write(HEADER)
+        for chunk_start in range(0, rows, CHUNK_SIZE):
+            chunk_days = day_offsets[chunk_start:chunk_start + CHUNK_SIZE]
+            chunk_clocks = clock_seconds[chunk_start:chunk_start + CHUNK_SIZE]
+            picks = rng.choice(n_videos, size=len(chunk_days), p=video_weights)
+            entries = []
+            for video, day, second in zip(picks, chunk_days, chunk_clocks):
+                day_label, zone = day_labels[day]
+                if second not in clock_labels:
+                    clock_labels[second] = format_clock(second)
+                channel = pool['channels'][video]
+                entries.append(ENTRY.format(video_id=pool['video_ids'][video], title=pool['titles'][video],
+                                            channel_id=pool['channel_ids'][channel],
+                                            channel=pool['channel_names'][channel],
+                                            date_time=f"{day_label}, {clock_labels[second]} {zone}"))
+            file.write(''.join(entries))
+        file.write(FOOTER)
+    return rows
+
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic watch-history.html for benchmarking the pipeline.')
+    parser.add_argument('--rows', type=int, default=10000, help='number of watched videos in the history')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='path of the html file to write')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed always writes the same file')
+    parser.add_argument('--vocabulary-size', type=int, default=5000, help='number of different words titles are built from')
+    parser.add_argument('--title-words', type=parse_range, default=(3, 9), help='words per title, like 3-9')
+    parser.add_argument('--videos', type=int, help='number of different videos, defaults to two thirds of the rows')
+    parser.add_argument('--channels', type=int, default=500, help='number of different channels')
+    parser.add_argument('--channel-exponent', type=float, default=1.2,
+                        help='how much the views pile up on the biggest channels, 0 spreads them evenly')
+    parser.add_argument('--location-rate', type=float, default=0.05,
+                        help='share of the videos whose title mentions a city, state or country')
+    parser.add_argument('--start', default='2015-01-01', help='first day of the history')
+    parser.add_argument('--end', default='2024-12-31', help='last day of the history')
+    args = parser.parse_args()
+    try:
+        written = write_history(args.output, args.rows, args.seed, args.vocabulary_size, args.videos, args.channels,
+                                args.location_rate, args.start, args.end, args.title_words,
+                                channel_exponent=args.channel_exponent)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"{written} synthetic entries written to {args.output}")
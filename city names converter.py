@@ -7,56 +7,82 @@
 #the reason this script was sequestered was because of the fact that it utilizes network requests.
 #trying to merge this with the nlp wouuldve greately and unnecesarily increased runtime and also forced one of the keystone scripts to rely on network availibility
 #user may also add their own cities theyd like to be mapped for specific use cases.
+#every answer is cached in history/geocode_cache.sqlite (see geocode_cache.py), so later runs only look up new cities.
+#with --offline no network requests are made at all, cities come from the cache or from a geonames dump (--geonames)
 
 import pandas as pd
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+import argparse
+import asyncio
 import os
-import time
-
-#initialize the geolocator with a user agent
-geolocator = Nominatim(user_agent="city_to_state_converter")
-
-def get_state(city):
-    try:
-        location = geolocator.geocode(city + ', USA', exactly_one=True)
-        if location:
-            #reverse geocode to get the state
-            location = geolocator.reverse((location.latitude, location.longitude), exactly_one=True, addressdetails=True)
-            address = location.raw['address']
-            if 'state' in address:
-                return address['state']
-    except GeocoderTimedOut:
-        time.sleep(1)
-        return get_state(city)
-    except Exception as e:
-        print(f"Error fetching state for {city}: {e}")
-    return None
+import geocode_cache
 
 #define the project directory
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 HISTORY_DIR = os.path.join(PROJECT_DIR, 'history')
+INPUT_FILE = os.path.join(HISTORY_DIR, 'city_names.txt')
+OUTPUT_FILE = os.path.join(HISTORY_DIR, 'city_state_mapping.csv')
+CACHE_FILE = os.path.join(HISTORY_DIR, 'geocode_cache.sqlite')
+
+
+#initialize the geolocator with a user agent
+def default_geocoder():
+    from geopy.geocoders import Nominatim
+    return Nominatim(user_agent="city_to_state_converter")
+
 
 #read the city names from the provided text file
-input_file = os.path.join(HISTORY_DIR, 'city_names.txt')
-with open(input_file, 'r') as file:
-    cities = [line.strip() for line in file.readlines()]
+def read_cities(input_file):
+    with open(input_file, 'r') as file:
+        return [line.strip() for line in file.readlines() if line.strip()]
+
+
+#geocoder can be any object with geopy's geocode/reverse methods, which is how a stub gets swapped in.
+#offline never creates one
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, cache_file=CACHE_FILE, offline=False, geocoder=None,
+         geonames_file=None, admin1_file=None, concurrency=2, min_interval=1.0, retries=3):
+    cities = read_cities(input_file)
+    geonames = geocode_cache.load_geonames(geonames_file, admin1_file) if geonames_file else None
+    if geocoder is None and not offline:
+        geocoder = default_geocoder()
+
+    cache = geocode_cache.GeocodeCache(cache_file)
+    try:
+        states = asyncio.run(geocode_cache.resolve_cities(cities, cache, None if offline else geocoder, geonames,
+                                                          concurrency, min_interval, retries))
+    finally:
+        cache.close()
+
+    #create a DataFrame to store the city-state mappings
+    city_state_mapping = []
+    for city in cities:
+        state = states[city]
+        if state:
+            city_state_mapping.append({'City': city, 'State': state})
+        else:
+            print(f"State not found for city: {city}")
 
-#create a DataFrame to store the city-state mappings
-city_state_mapping = []
+    #convert to DataFrame
+    df_city_state_mapping = pd.DataFrame(city_state_mapping, columns=['City', 'State'])
 
-for city in cities:
-    state = get_state(city)
-    if state:
-        city_state_mapping.append({'City': city, 'State': state})
-    else:
-        print(f"State not found for city: {city}")
+    #save to CSV
+    df_city_state_mapping.to_csv(output_file, index=False, encoding='utf-8-sig')
 
-#convert to DataFrame
-df_city_state_mapping = pd.DataFrame(city_state_mapping)
+    print(f"City to state mapping saved to {output_file}")
 
-#save to CSV
-output_file = os.path.join(HISTORY_DIR, 'city_state_mapping.csv')
-df_city_state_mapping.to_csv(output_file, index=False, encoding='utf-8-sig')
 
-print(f"City to state mapping saved to {output_file}")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map the cities in city_names.txt to their us state.')
+    parser.add_argument('--input', default=INPUT_FILE, help='text file with one city per line')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='csv file the city/state mapping is written to')
+    parser.add_argument('--cache', default=CACHE_FILE, help='sqlite file the geocoding results are cached in')
+    parser.add_argument('--offline', action='store_true',
+                        help='make no network requests, only use the cache and the geonames dump')
+    parser.add_argument('--geonames', help='geonames cities dump (like cities15000.txt or US.txt) to look cities up in first')
+    parser.add_argument('--admin1', help="geonames admin1CodesASCII.txt, only needed for places outside the us")
+    parser.add_argument('--concurrency', type=int, default=2, help='lookups running at the same time')
+    parser.add_argument('--min-interval', type=float, default=1.0,
+                        help='seconds between two requests to the geocoding service, nominatim allows one per second')
+    parser.add_argument('--retries', type=int, default=3, help='times a timed out request is tried again')
+    args = parser.parse_args()
+    main(args.input, args.output, args.cache, args.offline, None, args.geonames, args.admin1, args.concurrency,
+         args.min_interval, args.retries)
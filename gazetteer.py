@@ -0,0 +1,89 @@
+#fast location matcher that can stand in for stanza ner in the nlp script.
+#the nlp script throws away every stanza entity that is not in the two mapping csvs anyway,
+#so instead of running a neural model we can look for exactly those names in the titles directly.
+#all names are compiled into one aho-corasick automaton, which finds every name in a title in a single pass
+#no matter how many names there are.
+import pandas as pd
+from collections import deque
+
+
+#matches are only kept when they are whole words, so "Orange" does not match inside "Oranges"
+def is_boundary(text, index):
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class Gazetteer:
+    def __init__(self, names):
+        #every node of the trie is a dict of next characters, plus a failure link and the names that end there
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for pattern, name in names:
+            self.add(pattern, name)
+        self.build()
+
+    def add(self, pattern, name):
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.outputs[node].append((len(pattern), name))
+
+    #breadth first pass that sets the failure links, the standard aho-corasick construction
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    #returns the location names found in the text in the order they appear.
+    #when matches overlap the longest one wins, so "New York" is reported instead of "York"
+    def find(self, text):
+        matches = []
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, name in self.outputs[node]:
+                start = index - length + 1
+                if is_boundary(text, start - 1) and is_boundary(text, index + 1):
+                    matches.append((start, -length, name))
+
+        found = []
+        end = -1
+        for start, negative_length, name in sorted(matches):
+            if start > end:
+                found.append(name)
+                end = start - negative_length - 1
+        return found
+
+
+#builds the matcher from the same two mapping csvs the nlp script uses.
+#youtube titles are often written in all caps so the upper case spelling of every name is added as well,
+#both spellings report the name the way it is written in the csv so the existing state/country mapping still works
+def from_mappings(city_state_mapping, city_country_mapping):
+    names = set()
+    for column in (city_state_mapping['City'], city_state_mapping['State'],
+                   city_country_mapping['City'], city_country_mapping['Country']):
+        names.update(name for name in column.dropna() if isinstance(name, str) and name.strip())
+
+    patterns = set()
+    for name in names:
+        patterns.add((name, name))
+        patterns.add((name.upper(), name))
+    return Gazetteer(sorted(patterns))
+
+
+def from_csvs(city_state_csv_path, city_country_csv_path):
+    return from_mappings(pd.read_csv(city_state_csv_path), pd.read_csv(city_country_csv_path))
@@ -0,0 +1,195 @@
+#geocoding helpers for city names converter.py.
+#every city that gets looked up is saved in a small sqlite database, so running the converter again
+#(for example after adding a few cities to city_names.txt) only sends the new cities to the geocoding service.
+#the cities that are not cached yet are looked up a few at a time with asyncio, while a rate limiter keeps the
+#requests at least a set time apart (nominatim asks for no more than one request per second) and timeouts are
+#retried a few times with a growing wait instead of recursing forever.
+#offline, the cities come only from the cache or from a geonames dump (https://download.geonames.org/export/dump/).
+#the geocoder is passed in, so anything with the same geocode/reverse methods as geopy's Nominatim works,
+#like a stub that answers from a dict.
+import pandas as pd
+import asyncio
+import sqlite3
+import time
+
+#state abbreviations used as the admin1 code of us places in geonames dumps
+US_STATES = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California', 'CO': 'Colorado',
+    'CT': 'Connecticut', 'DE': 'Delaware', 'DC': 'District of Columbia', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas',
+    'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts',
+    'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana',
+    'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico',
+    'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
+    'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota',
+    'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
+    'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+
+#columns of the geonames cities files (cities500.txt, cities15000.txt, US.txt, ...)
+GEONAMES_COLUMNS = ['geonameid', 'name', 'asciiname', 'alternatenames', 'latitude', 'longitude', 'feature class',
+                    'feature code', 'country code', 'cc2', 'admin1 code', 'admin2 code', 'admin3 code', 'admin4 code',
+                    'population', 'elevation', 'dem', 'timezone', 'modification date']
+
+
+#the cache key of a city: case, surrounding spaces and repeated spaces do not matter
+def normalize_city(city):
+    return ' '.join(city.split()).casefold()
+
+
+class GeocodeCache:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                                'key TEXT PRIMARY KEY, city TEXT, state TEXT, source TEXT, resolved_at REAL)')
+        self.connection.commit()
+
+    #the cached results of the given cities as {key: state}. a state of None means the city was looked up
+    #and no state was found, so it is not asked again either
+    def get_many(self, cities):
+        keys = list({normalize_city(city) for city in cities})
+        found = {}
+        #sqlite limits the number of parameters in one query
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(f"SELECT key, state FROM geocodes WHERE key IN ({','.join('?' * len(chunk))})",
+                                           chunk)
+            found.update(rows)
+        return found
+
+    def put(self, city, state, source):
+        self.connection.execute('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)',
+                                (normalize_city(city), city, state, source, time.time()))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+#reads a geonames cities dump into {key: state} for the places of one country.
+#when a name is used by several places the one with the most people wins, the same way a geocoder ranks them.
+#admin1_path can point to admin1CodesASCII.txt for countries other than the us
+def load_geonames(cities_path, admin1_path=None, country='US'):
+    places = pd.read_csv(cities_path, sep='\t', header=None, names=GEONAMES_COLUMNS, quoting=3, dtype=str,
+                         keep_default_na=False, usecols=['name', 'asciiname', 'country code', 'admin1 code', 'population'])
+    places = places[places['country code'] == country]
+    if admin1_path:
+        admin1 = pd.read_csv(admin1_path, sep='\t', header=None, names=['code', 'name', 'asciiname', 'geonameid'],
+                             quoting=3, dtype=str, keep_default_na=False)
+        state_names = dict(zip(admin1['code'], admin1['name']))
+        states = (places['country code'] + '.' + places['admin1 code']).map(state_names)
+    else:
+        states = places['admin1 code'].map(US_STATES)
+    places = places.assign(state=states, population=pd.to_numeric(places['population'], errors='coerce').fillna(0))
+    places = places.dropna(subset=['state']).sort_values('population', ascending=False, kind='stable')
+
+    lookup = {}
+    for column in ('name', 'asciiname'):
+        for name, state in zip(places[column], places['state']):
+            lookup.setdefault(normalize_city(name), state)
+    return lookup
+
+
+#keeps the requests at least min_interval seconds apart, no matter how many lookups run at the same time
+class RateLimiter:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.lock = asyncio.Lock()
+        self.next_time = 0.0
+
+    async def wait(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_time = loop.time() + self.min_interval
+
+
+#the errors that are worth trying again. geopy is only imported here so a stub geocoder works without it
+def retryable_errors():
+    try:
+        from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+    except ImportError:
+        return (TimeoutError,)
+    return (GeocoderTimedOut, GeocoderUnavailable, TimeoutError)
+
+
+class AsyncResolver:
+    def __init__(self, geocoder, concurrency=2, min_interval=1.0, retries=3, backoff=1.0, suffix=', USA'):
+        self.geocoder = geocoder
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = RateLimiter(min_interval)
+        self.retries = retries
+        self.backoff = backoff
+        self.suffix = suffix
+        self.errors = retryable_errors()
+
+    #one geocoder call in a thread (geopy is blocking), behind the rate limiter and retried on timeouts.
+    #the wait doubles after every failed try
+    async def call(self, method, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            await self.rate_limiter.wait()
+            try:
+                return await asyncio.to_thread(method, *args, **kwargs)
+            except self.errors:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    #asking for the address details with the forward geocode usually gives the state right away,
+    #the reverse geocode the script used to do for every city is only needed when it does not
+    async def resolve(self, city):
+        async with self.semaphore:
+            location = await self.call(self.geocoder.geocode, city + self.suffix, exactly_one=True, addressdetails=True)
+            if not location:
+                return None
+            state = location.raw.get('address', {}).get('state')
+            if state is None:
+                #reverse geocode to get the state
+                location = await self.call(self.geocoder.reverse, (location.latitude, location.longitude),
+                                           exactly_one=True, addressdetails=True)
+                state = location.raw.get('address', {}).get('state') if location else None
+            return state
+
+
+#looks up every city and returns {city: state or None} in the order of the cities.
+#cached cities are answered from the cache, the rest from the geonames lookup (if given) and then the geocoder
+#(if given, which it is not in offline mode). every new answer is written to the cache as soon as it comes in.
+#lookups that still fail after the retries are printed and left out of the cache so they are tried again next time
+async def resolve_cities(cities, cache, geocoder=None, geonames=None, concurrency=2, min_interval=1.0, retries=3,
+                         backoff=1.0):
+    cached = cache.get_many(cities)
+    #spellings of the same city share one lookup, the first spelling is the one sent to the geocoder
+    first_spelling = {}
+    for city in cities:
+        first_spelling.setdefault(normalize_city(city), city)
+
+    states = {}
+    missing = []
+    for key, city in first_spelling.items():
+        if key in cached:
+            states[key] = cached[key]
+        elif geonames is not None and key in geonames:
+            states[key] = geonames[key]
+            cache.put(city, states[key], 'geonames')
+        elif geocoder is not None:
+            missing.append(key)
+        else:
+            states[key] = None
+
+    if missing:
+        resolver = AsyncResolver(geocoder, concurrency, min_interval, retries, backoff)
+
+        async def resolve_one(key):
+            city = first_spelling[key]
+            try:
+                states[key] = await resolver.resolve(city)
+            except Exception as e:
+                print(f"Error fetching state for {city}: {e!r}")
+                states[key] = None
+                return
+            cache.put(city, states[key], 'geocoder')
+
+        await asyncio.gather(*(resolve_one(key) for key in missing))
+    return {city: states[normalize_city(city)] for city in cities}
@@ -0,0 +1,144 @@
+#this module keeps track of what has already been ingested so monthly re-downloads of takeout only process new rows.
+#takeout lists watch history newest first, so new videos always show up at the top of the html and of every csv.
+#the manifest remembers the newest timestamp we have seen plus hashes of the rows at that timestamp,
+#and for every stage how many rows of its input it has already processed.
+#a stage's delta is then simply the first (upstream rows - rows already processed) rows of its input.
+import pandas as pd
+from datetime import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(PROJECT_DIR, 'history', 'ingest_manifest.json')
+
+RECORD_COLUMNS = ['Video Title', 'URL', 'Channel Name', 'Channel URL', 'Date', 'Time']
+
+#stages that keep outputs built up from the rows, each with the stage whose output it reads.
+#the rollup cube (rollup_cube.py) reads the processed rows like the nlp stage does, so a rebuilt nlp output leaves it alone
+UPSTREAM = {'collection': None, 'preprocessing': 'collection', 'nlp': 'preprocessing', 'rollup': 'preprocessing'}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+#written to a temp file first so a crash halfway through never leaves a broken manifest behind
+def save_manifest(manifest, path=MANIFEST_PATH):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False) as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(file.name, path)
+
+
+def row_hash(record):
+    content = '\x1f'.join(str(record[column]) for column in RECORD_COLUMNS)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+#sortable timestamp string for a parsed record, or None for rows whose date could not be parsed
+def record_timestamp(record):
+    try:
+        timestamp = datetime.strptime(f"{record['Date']} {record['Time']}", '%d-%b-%Y %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def is_known(record, manifest):
+    newest = manifest.get('newest_timestamp')
+    timestamp = record_timestamp(record)
+    if newest is None or timestamp is None:
+        return False
+    if timestamp < newest:
+        return True
+    return timestamp == newest and row_hash(record) in manifest.get('boundary_hashes', [])
+
+
+#yields records until the first one we have already ingested.
+#since the html is newest first, everything after that point is old so the caller can stop reading the file
+def take_new_records(records, manifest):
+    for record in records:
+        if is_known(record, manifest):
+            break
+        yield record
+
+
+#passes records through while moving the watermark forward, the manifest is updated once the records run out.
+#the boundary hashes tell apart different videos that were watched within the same second as the watermark.
+#the content hash chains the hash of every ingested row, so it changes whenever anything new gets ingested
+def track_watermark(records, manifest):
+    content_hash = hashlib.sha1(manifest.get('content_hash', '').encode('utf-8'))
+    newest = manifest.get('newest_timestamp')
+    boundary_hashes = set(manifest.get('boundary_hashes', []))
+    for record in records:
+        digest = row_hash(record)
+        content_hash.update(digest.encode('utf-8'))
+        timestamp = record_timestamp(record)
+        if timestamp is not None:
+            if newest is None or timestamp > newest:
+                newest = timestamp
+                boundary_hashes = {digest}
+            elif timestamp == newest:
+                boundary_hashes.add(digest)
+        yield record
+
+    manifest['newest_timestamp'] = newest
+    manifest['boundary_hashes'] = sorted(boundary_hashes)
+    manifest['content_hash'] = content_hash.hexdigest()
+
+
+#every stage that reads the output of the given stage, directly or through other stages
+def downstream_stages(stage):
+    found = []
+    for other, upstream in UPSTREAM.items():
+        if upstream == stage:
+            found.append(other)
+            found.extend(downstream_stages(other))
+    return found
+
+
+#records that a stage has seen input_rows rows of its input and its output now holds output_rows rows.
+#a stage that rebuilt its output from scratch invalidates the stages that read it, so those start over too
+def mark_stage(manifest, stage, input_rows, output_rows, rebuild=False):
+    stages = manifest.setdefault('stages', {})
+    if rebuild:
+        for later_stage in downstream_stages(stage):
+            stages.pop(later_stage, None)
+    stages[stage] = {'input_rows': input_rows, 'output_rows': output_rows}
+    return manifest
+
+
+#number of new rows sitting at the top of a stage's input, or None when the stage has to start over.
+#starting over happens when the stage never ran or when the upstream file got rebuilt from scratch
+def pending_rows(manifest, stage, upstream_stage):
+    upstream_rows = manifest.get('stages', {}).get(upstream_stage, {}).get('output_rows')
+    state = manifest.get('stages', {}).get(stage)
+    if upstream_rows is None or state is None or state['input_rows'] > upstream_rows:
+        return None
+    return upstream_rows - state['input_rows']
+
+
+#writes the new rows above the existing ones without loading the old file.
+#the delta goes into a temp file with the header, then the old file is copied after it minus its own header line
+def prepend_csv(delta_df, path):
+    if not os.path.exists(path):
+        delta_df.to_csv(path, index=False, encoding='utf-8-sig')
+        return
+
+    columns = pd.read_csv(path, encoding='utf-8', nrows=0).columns
+    delta_df = delta_df[list(columns)]
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8-sig', newline='', dir=directory, delete=False) as out:
+        delta_df.to_csv(out, index=False)
+        out.flush()
+        with open(path, 'rb') as existing:
+            existing.readline()
+            shutil.copyfileobj(existing, out.buffer)
+    os.replace(out.name, path)
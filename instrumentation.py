@@ -0,0 +1,239 @@
+#timing and throughput numbers for the scripts, so it is visible where the time of a run goes.
+#it records the wall time, rows per second and peak memory of every stage and of the hot functions
+#(html parsing, tokenizing, ner, lda fitting, the token to video index), plus the hit rates of the caches.
+#nothing is recorded unless a script is run with --report, and then the numbers are written out as json or csv:
+#    python 03_nlp_analysis.py --report history/run_reports/nlp.json
+#--profile cprofile (or pyinstrument, if it is installed) also saves a profile of the whole run next to the report.
+import csv
+import cProfile
+import functools
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_DIR = os.path.join(PROJECT_DIR, 'history', 'run_reports')
+PROFILERS = ['cprofile', 'pyinstrument']
+
+REPORT_COLUMNS = ['kind', 'name', 'calls', 'seconds', 'rows', 'rows_per_second', 'peak_rss_mb', 'hits', 'misses',
+                  'hit_rate']
+
+enabled = False
+records = {}
+started_at = None
+
+
+#peak resident memory of this process so far, in megabytes. None where it cant be measured
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 1024 / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #linux reports kilobytes, macos bytes
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def record(kind, name):
+    key = (kind, name)
+    if key not in records:
+        records[key] = {'kind': kind, 'name': name, 'calls': 0, 'seconds': 0.0, 'rows': 0, 'peak_rss_mb': None,
+                        'hits': 0, 'misses': 0}
+    return records[key]
+
+
+#times a block of code as one stage. the block can set the number of rows it handled on the yielded dict:
+#    with instrumentation.stage('collection') as stage:
+#        ...
+#        stage['rows'] = len(df)
+@contextmanager
+def stage(name, kind='stage'):
+    counts = {'rows': 0}
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        if enabled:
+            entry = record(kind, name)
+            entry['calls'] += 1
+            entry['seconds'] += time.perf_counter() - start
+            entry['rows'] += counts['rows'] or 0
+            entry['peak_rss_mb'] = peak_rss_mb()
+
+
+#decorator for hot functions. rows works out the number of rows from the arguments and the result
+#(for example lambda result, *args: len(result)), without it every call counts as one row.
+#when recording is off the function is called straight away
+def timed(name, rows=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            entry = record('function', name)
+            entry['calls'] += 1
+            entry['seconds'] += time.perf_counter() - start
+            entry['rows'] += rows(result, *args, **kwargs) if rows is not None else 1
+            entry['peak_rss_mb'] = peak_rss_mb()
+            return result
+        return wrapper
+    return decorator
+
+
+#timed for generator functions, every yielded item counts as one row.
+#only the time spent inside the generator counts, not the time the caller spends on the items in between.
+#a caller that stops early (like the incremental collection at the first known record) still gets recorded
+def timed_generator(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                yield from function(*args, **kwargs)
+                return
+            entry = record('function', name)
+            entry['calls'] += 1
+            generator = function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        entry['seconds'] += time.perf_counter() - start
+                    entry['rows'] += 1
+                    yield item
+            finally:
+                generator.close()
+                entry['peak_rss_mb'] = peak_rss_mb()
+        return wrapper
+    return decorator
+
+
+def count_cache(name, hits, misses):
+    if enabled:
+        entry = record('cache', name)
+        entry['hits'] += hits
+        entry['misses'] += misses
+
+
+#adds the rows a script handled to its stage, the time of the stage comes from session
+def count_rows(name, rows):
+    if enabled:
+        record('stage', name)['rows'] += rows
+
+
+#the hits and misses a functools.lru_cache function had so far
+def count_lru_cache(name, function):
+    if enabled:
+        info = function.cache_info()
+        entry = record('cache', name)
+        entry['hits'], entry['misses'] = info.hits, info.misses
+
+
+def report_rows():
+    rows = []
+    for entry in records.values():
+        row = dict(entry)
+        row['seconds'] = round(row['seconds'], 6)
+        row['rows_per_second'] = round(row['rows'] / row['seconds'], 1) if row['seconds'] and row['rows'] else None
+        lookups = row['hits'] + row['misses']
+        row['hit_rate'] = round(row['hits'] / lookups, 4) if lookups else None
+        rows.append(row)
+    return rows
+
+
+#json gets the run details and every record, csv one line per record. the format follows the file extension
+def write_report(path, script):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows = report_rows()
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        report = {
+            'script': script,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at)),
+            'python': platform.python_version(),
+            'peak_rss_mb': peak_rss_mb(),
+            'records': rows,
+        }
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    print(f"Run report saved to {path}")
+
+
+@contextmanager
+def profiler(mode, path):
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("--profile pyinstrument needs pyinstrument. Install it with 'pip install pyinstrument'.") from None
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(profile.output_html())
+    else:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+    print(f"Profile saved to {path}")
+
+
+def add_arguments(parser):
+    parser.add_argument('--report', metavar='PATH',
+                        help='record timings, rows/sec, peak memory and cache hit rates and save them to this json or csv file')
+    parser.add_argument('--profile', choices=PROFILERS,
+                        help='also profile the whole run, saved next to the report (or in history/run_reports)')
+
+
+#turns recording on for the code inside it when the script was run with --report or --profile,
+#times it as the stage named script and writes the report and the profile when it is done
+@contextmanager
+def session(args, script):
+    global enabled, started_at
+    report_path = getattr(args, 'report', None)
+    profile_mode = getattr(args, 'profile', None)
+    if not report_path and not profile_mode:
+        yield
+        return
+
+    enabled = True
+    started_at = time.time()
+    records.clear()
+    base = os.path.splitext(report_path)[0] if report_path else os.path.join(REPORT_DIR, script)
+    try:
+        with stage(script):
+            if profile_mode:
+                os.makedirs(os.path.dirname(os.path.abspath(base)), exist_ok=True)
+                with profiler(profile_mode, base + ('.html' if profile_mode == 'pyinstrument' else '.prof')):
+                    yield
+            else:
+                yield
+    finally:
+        if report_path:
+            write_report(report_path, script)
+        enabled = False
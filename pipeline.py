@@ -0,0 +1,298 @@
+#runs the five scripts as one pipeline. every stage is called as a function and hands its dataframe straight to the next one,
+#so nothing has to be written out as csv and parsed back in between stages.
+#every stage gets a fingerprint made of its inputs (the html file, the fingerprints of the stages before it,
+#the code of the stage and its settings like min_df or n_topics) and its output is cached under that fingerprint.
+#a stage whose fingerprint did not change is skipped, so changing an lda setting only reruns lda,
+#the html parse and the ner are read back from the cache.
+#    python pipeline.py run
+#    python pipeline.py run --until lda --n-topics 8
+#    python pipeline.py run --force nlp
+#    python pipeline.py clean
+import pandas as pd
+import argparse
+import ast
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+import instrumentation
+import stage_loader
+import table_io
+import token_matrix
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+HTML_FILE_PATH = os.path.join(PROJECT_DIR, 'history', 'watch-history.html')
+CACHE_DIR = os.path.join(PROJECT_DIR, 'history', '.pipeline_cache')
+
+#the stages in the order they run, with the stages each one needs and the files that make up its code and data.
+#a change in any of those files changes the fingerprint of the stage and of every stage after it.
+#the project modules the scripts import are found by stage_files, so they do not have to be listed here
+STAGES = {
+    'collection': {'upstream': [], 'files': ['01_data_collection.py']},
+    'preprocessing': {'upstream': ['collection'], 'files': ['02_data_preprocessing.py']},
+    'nlp': {'upstream': ['preprocessing'],
+            'files': ['03_nlp_analysis.py', 'gazetteer.py', 'token_matrix.py',
+                      os.path.join('history', 'city_state_mapping.csv'), os.path.join('history', 'citiestocountries.csv')]},
+    'lda': {'upstream': ['nlp'], 'files': ['04_lda_analysis.py', 'token_index.py', 'token_matrix.py']},
+    'active_periods': {'upstream': ['preprocessing'], 'files': ['05_active_periods_analysis.py']},
+}
+STAGE_ORDER = list(STAGES)
+
+#the settings that change what a stage puts out. settings that only change how fast it runs
+#(workers, ner batch size) are left out so changing them keeps the cache
+STAGE_PARAMS = {
+    'collection': [],
+    'preprocessing': [],
+    'nlp': ['location_engine', 'tokenizer'],
+    'lda': ['min_df', 'n_topics', 'ngram_range', 'warm_start'],
+    'active_periods': [],
+}
+
+#the same defaults the scripts use on their own
+DEFAULT_PARAMS = {
+    'location_engine': 'stanza',
+    'tokenizer': 'nltk',
+    'min_df': 0.027,
+    'n_topics': 5,
+    'ngram_range': [1, 3],
+    'warm_start': False,
+}
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+#the project modules a python file imports, directly or through other project modules, as paths relative to the project.
+#imports inside functions count too, since the stages import some modules only when they are used
+def imported_modules(path, found=None):
+    found = set() if found is None else found
+    with open(path, 'r', encoding='utf-8') as file:
+        tree = ast.parse(file.read(), path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            file_name = name.split('.')[0] + '.py'
+            if file_name not in found and os.path.exists(os.path.join(PROJECT_DIR, file_name)):
+                found.add(file_name)
+                imported_modules(os.path.join(PROJECT_DIR, file_name), found)
+    return found
+
+
+#the files listed for a stage plus every project module its scripts import (table_io.py, sessions.py, ...),
+#so an edit to shared code changes the fingerprint of the stages that run it
+@functools.lru_cache(maxsize=None)
+def stage_files(stage):
+    files = list(STAGES[stage]['files'])
+    modules = set()
+    for path in files:
+        if path.endswith('.py'):
+            imported_modules(os.path.join(PROJECT_DIR, path), modules)
+    return files + sorted(modules - set(files))
+
+
+#every stage that depends on one of the given stages, including the stages themselves
+def downstream(stages):
+    found = set(stages)
+    for stage in STAGE_ORDER:
+        if any(upstream in found for upstream in STAGES[stage]['upstream']):
+            found.add(stage)
+    return found
+
+
+#the nlp stage hands on the dataframe together with its document-term matrix
+def stage_rows(output):
+    if isinstance(output, tuple):
+        output = output[0]
+    return len(output) if hasattr(output, '__len__') else 0
+
+
+class Pipeline:
+    def __init__(self, html_path=HTML_FILE_PATH, cache_dir=CACHE_DIR, params=None, force=(), save_tables=False,
+                 fmt='csv', workers=1, ner_batch_size=256):
+        self.html_path = html_path
+        self.cache_dir = cache_dir
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        #forcing a stage also reruns everything after it
+        self.force = downstream(force)
+        self.save_tables = save_tables
+        self.fmt = fmt
+        self.workers = workers
+        self.ner_batch_size = ner_batch_size
+        self.fingerprints = {}
+        self.outputs = {}
+
+    def fingerprint(self, stage):
+        if stage not in self.fingerprints:
+            inputs = {
+                'stage': stage,
+                'upstream': [self.fingerprint(upstream) for upstream in STAGES[stage]['upstream']],
+                'files': [file_digest(os.path.join(PROJECT_DIR, path)) for path in stage_files(stage)],
+                'params': {name: self.params[name] for name in STAGE_PARAMS[stage]},
+            }
+            if stage == 'collection':
+                inputs['html'] = file_digest(self.html_path)
+            self.fingerprints[stage] = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+        return self.fingerprints[stage]
+
+    def cache_path(self, stage):
+        return os.path.join(self.cache_dir, f'{stage}-{self.fingerprint(stage)[:16]}.pkl')
+
+    def is_cached(self, stage):
+        return stage not in self.force and os.path.exists(self.cache_path(stage))
+
+    #the output of a stage, from memory, from the cache or by running it (and the stages it needs) right now
+    def output(self, stage):
+        if stage not in self.outputs:
+            if self.is_cached(stage):
+                with open(self.cache_path(stage), 'rb') as file:
+                    self.outputs[stage] = pickle.load(file)
+            else:
+                inputs = [self.output(upstream) for upstream in STAGES[stage]['upstream']]
+                print(f"Running {stage}...")
+                with instrumentation.stage(stage) as counts:
+                    self.outputs[stage] = getattr(self, f'run_{stage}')(*inputs)
+                    #rows going into the stage, collection counts the rows it parsed
+                    counts['rows'] = stage_rows(inputs[0] if inputs else self.outputs[stage])
+                self.save_cache(stage)
+        return self.outputs[stage]
+
+    #only the newest output of every stage is kept
+    def save_cache(self, stage):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(stage)
+        for old_path in glob.glob(os.path.join(self.cache_dir, f'{stage}-*.pkl')):
+            if old_path != path:
+                os.remove(old_path)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(self.outputs[stage], file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    #runs every stage up to and including the target. stages that are still cached are skipped without loading them
+    def run(self, until=STAGE_ORDER[-1]):
+        for stage in STAGE_ORDER[:STAGE_ORDER.index(until) + 1]:
+            if self.is_cached(stage):
+                print(f"Skipping {stage}, its inputs did not change.")
+                instrumentation.count_cache('pipeline_cache', 1, 0)
+            else:
+                self.output(stage)
+                instrumentation.count_cache('pipeline_cache', 0, 1)
+
+    def run_collection(self):
+        collection = stage_loader.load_stage('collection')
+        if self.workers > 1:
+            records = collection.iter_records_parallel(self.html_path, self.workers)
+        else:
+            records = collection.iter_records(self.html_path)
+        df = pd.DataFrame(records, columns=collection.RECORD_COLUMNS)
+        self.write_table(df, collection.CSV_OUTPUT_PATH)
+        return df
+
+    #the timestamp is parsed once here and kept, so nlp and lda dont have to parse the dates again
+    def run_preprocessing(self, raw_df):
+        preprocessing = stage_loader.load_stage('preprocessing')
+        df = preprocessing.preprocess(raw_df, time_columns=True)
+        self.write_table(df, preprocessing.PROCESSED_CSV_PATH)
+        return df
+
+    def run_nlp(self, processed_df):
+        nlp_stage = stage_loader.load_stage('nlp')
+        #analyze adds its columns in place, the copy keeps the cached preprocessing output as it was
+        df, dtm = nlp_stage.analyze(processed_df.copy(), self.ner_batch_size, self.params['location_engine'],
+                                    self.params['tokenizer'])
+        nlp_stage.write_quarterly_reports(df, dtm=dtm)
+        self.write_table(df, nlp_stage.NLP_CSV_PATH)
+        if self.save_tables and dtm is not None:
+            token_matrix.save(dtm, nlp_stage.NLP_CSV_PATH)
+        return df, dtm
+
+    def run_lda(self, nlp_output):
+        lda_stage = stage_loader.load_stage('lda')
+        df, dtm = nlp_output
+        lda_results_df = lda_stage.run_lda(lda_stage.combine_tokens(df.copy()), dtm, self.workers,
+                                           self.params['warm_start'], self.params['min_df'],
+                                           self.params['n_topics'], tuple(self.params['ngram_range']))
+        lda_stage.save_results(lda_results_df)
+        return lda_results_df
+
+    def run_active_periods(self, processed_df):
+        active_periods = stage_loader.load_stage('active_periods')
+        counts = active_periods.ActivityCounts.from_frame(processed_df)
+        active_periods.write_insights(counts)
+        return counts
+
+    #the tables between the stages are only written to disk when asked for, the final outputs always are
+    def write_table(self, df, csv_path):
+        if self.save_tables:
+            table_io.write_table(df, csv_path, self.fmt)
+
+
+def clean(cache_dir=CACHE_DIR):
+    paths = glob.glob(os.path.join(cache_dir, '*.pkl'))
+    for path in paths:
+        os.remove(path)
+    print(f"Removed {len(paths)} cached stage outputs.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the whole pipeline, skipping the stages whose inputs did not change.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the pipeline')
+    run_parser.add_argument('--until', choices=STAGE_ORDER, default=STAGE_ORDER[-1],
+                            help='last stage to run, stages after it in the order above are left out')
+    run_parser.add_argument('--force', choices=STAGE_ORDER, action='append', default=[],
+                            help='rerun this stage and every stage after it even if they are cached, can be given more than once')
+    run_parser.add_argument('--html', default=HTML_FILE_PATH, help='the watch-history.html to analyze')
+    run_parser.add_argument('--save-tables', action='store_true',
+                            help='also write the tables between the stages (watch_history.csv, ..._processed, ..._nlp) to disk')
+    run_parser.add_argument('--format', choices=table_io.FORMATS, default='csv', help='file format of the saved tables')
+    run_parser.add_argument('--workers', type=int, default=1, help='worker processes for the html parse and lda')
+    run_parser.add_argument('--ner-batch-size', type=int, default=256, help='number of unique titles sent through stanza per batch')
+    run_parser.add_argument('--location-engine', choices=['stanza', 'gazetteer'], default='stanza',
+                            help='stanza runs neural ner, gazetteer matches the known city/state/country names directly')
+    run_parser.add_argument('--tokenizer', choices=['nltk', 'regex'], default='nltk',
+                            help='regex tokenizes all titles at once and fits lda on the document-term matrix')
+    run_parser.add_argument('--min-df', type=float, default=DEFAULT_PARAMS['min_df'], help='minimum document frequency of an lda term')
+    run_parser.add_argument('--n-topics', type=int, default=DEFAULT_PARAMS['n_topics'], help='number of lda topics per quarter')
+    run_parser.add_argument('--ngram-range', type=int, nargs=2, default=DEFAULT_PARAMS['ngram_range'], metavar=('MIN', 'MAX'),
+                            help='n-gram sizes lda counts when it vectorizes the tokens itself')
+    run_parser.add_argument('--warm-start', action='store_true',
+                            help="fit quarters in time order, each starting from the previous quarter's topics")
+
+    instrumentation.add_arguments(run_parser)
+
+    commands.add_parser('clean', help='delete the cached stage outputs')
+    args = parser.parse_args()
+
+    if args.command == 'clean':
+        clean()
+    else:
+        params = {
+            'location_engine': args.location_engine,
+            'tokenizer': args.tokenizer,
+            'min_df': args.min_df,
+            'n_topics': args.n_topics,
+            'ngram_range': args.ngram_range,
+            'warm_start': args.warm_start,
+        }
+        pipeline = Pipeline(args.html, CACHE_DIR, params, args.force, args.save_tables, args.format, args.workers,
+                            args.ner_batch_size)
+        with instrumentation.session(args, 'pipeline'):
+            pipeline.run(args.until)
+        print("Pipeline complete.")
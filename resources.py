@@ -0,0 +1,122 @@
+#finds and loads the nltk data and stanza models the nlp script needs, offline first.
+#the nlp script used to call nltk.download and stanza.download every time it was imported, which asks the internet
+#on every run and fails on machines without it. here every resource is first looked up on disk (no network call),
+#and only a resource that is really missing gets downloaded. with offline mode on it is never downloaded,
+#a missing resource raises an error that says how to get it instead.
+#offline mode is switched on with the TAKEOUT_OFFLINE=1 environment variable or set_offline(True).
+#to check what is installed, or to download everything in one go on a machine with internet:
+#    python resources.py
+#    python resources.py --download
+import argparse
+import os
+
+#nltk resource name -> the path nltk.data.find looks for.
+#word_tokenize needs punkt_tab on newer nltk versions and punkt on older ones, either one is enough
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',
+    'stopwords': 'corpora/stopwords',
+}
+TOKENIZER_RESOURCES = ['punkt_tab', 'punkt']
+
+STANZA_LANGUAGE = 'en'
+
+offline = os.environ.get('TAKEOUT_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def set_offline(value=True):
+    global offline
+    offline = value
+
+
+def nltk_available(name):
+    import nltk
+    try:
+        nltk.data.find(NLTK_RESOURCES[name])
+    except LookupError:
+        return False
+    return True
+
+
+#makes sure at least one of the given nltk resources is on disk, downloading the first one if none is
+def ensure_nltk(*names):
+    if any(nltk_available(name) for name in names):
+        return
+    if offline:
+        raise LookupError(f"The NLTK resource '{names[0]}' is not installed and offline mode is on. "
+                          "Run 'python resources.py --download' on a machine with internet access, "
+                          "or copy its nltk_data folder over.")
+    import nltk
+    for name in names:
+        if nltk.download(name, quiet=True) and nltk_available(name):
+            return
+    raise LookupError(f"Could not download the NLTK resource '{names[0]}'.")
+
+
+def stop_words(language='english'):
+    ensure_nltk('stopwords')
+    from nltk.corpus import stopwords
+    return set(stopwords.words(language))
+
+
+#word_tokenize and ngrams, imported only when the nltk tokenizer is actually used
+def nltk_tokenizers():
+    ensure_nltk(*TOKENIZER_RESOURCES)
+    from nltk.tokenize import word_tokenize
+    from nltk.util import ngrams
+    return word_tokenize, ngrams
+
+
+#the folder stanza keeps its models in, worked out the same way stanza does it but without importing it
+def stanza_dir():
+    return os.environ.get('STANZA_RESOURCES_DIR', os.path.join(os.path.expanduser('~'), 'stanza_resources'))
+
+
+def stanza_available(language=STANZA_LANGUAGE):
+    directory = stanza_dir()
+    return os.path.exists(os.path.join(directory, 'resources.json')) and os.path.isdir(os.path.join(directory, language))
+
+
+def ensure_stanza(language=STANZA_LANGUAGE):
+    if stanza_available(language):
+        return
+    if offline:
+        raise LookupError(f"The Stanza '{language}' models are not in {stanza_dir()} and offline mode is on. "
+                          "Run 'python resources.py --download' on a machine with internet access, "
+                          "or copy the stanza_resources folder over and point STANZA_RESOURCES_DIR at it.")
+    import stanza
+    stanza.download(language, model_dir=stanza_dir())
+
+
+#builds a stanza pipeline from the models on disk. download_method=None stops stanza from checking online
+#for a newer resources.json every time a pipeline is built
+def stanza_pipeline(language=STANZA_LANGUAGE, **kwargs):
+    ensure_stanza(language)
+    import stanza
+    return stanza.Pipeline(language, dir=stanza_dir(), download_method=None, **kwargs)
+
+
+def status():
+    tokenizer_found = any(nltk_available(name) for name in TOKENIZER_RESOURCES)
+    return {
+        'nltk tokenizer (' + ' or '.join(TOKENIZER_RESOURCES) + ')': tokenizer_found,
+        'nltk stopwords': nltk_available('stopwords'),
+        f'stanza {STANZA_LANGUAGE} models': stanza_available(),
+    }
+
+
+def main(download=False):
+    if download:
+        ensure_nltk(*TOKENIZER_RESOURCES)
+        ensure_nltk('stopwords')
+        ensure_stanza()
+    for name, found in status().items():
+        print(f"{name}: {'found' if found else 'missing'}")
+    print(f"Offline mode is {'on' if offline else 'off'}.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check which nltk and stanza resources are installed, without going online.')
+    parser.add_argument('--download', action='store_true', help='download the resources that are missing')
+    args = parser.parse_args()
+    main(download=args.download)
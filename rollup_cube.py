@@ -0,0 +1,265 @@
+#precomputed watch counts for answering questions about the history without going over every row again.
+#05_active_periods_analysis.py only writes a few fixed files, so a question like "top channels in Q3 2022 between 1 and 4am"
+#used to mean another script that scans the whole processed table. the cube counts the videos once per
+#(channel, year, quarter, month, hour, weekday), and once per (video, year, quarter, month) for the video level,
+#and every question is then just a filter and a sum over those counts, which takes milliseconds.
+#the counts are saved as one parquet file per year under history/rollup_cube/<level>/, so a query only reads
+#the years it asks about and an update only rewrites the years that got new rows.
+#    python rollup_cube.py build
+#    python rollup_cube.py update
+#    python rollup_cube.py top --year 2022 --quarter 3 --hour 1-4
+#    python rollup_cube.py top --level videos --year 2023 --n 20
+#    python rollup_cube.py slice --by Hour Weekday --channel "Some Channel"
+import pandas as pd
+import numpy as np
+import argparse
+import glob
+import os
+import incremental
+import instrumentation
+import stage_loader
+import table_io
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROCESSED_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_processed.csv')
+CUBE_DIR = os.path.join(PROJECT_DIR, 'history', 'rollup_cube')
+
+#the key columns and the time columns every level is counted over
+LEVELS = {
+    'channels': {'keys': ['Channel Name'], 'times': ['Year', 'Quarter', 'Month', 'Hour', 'Weekday']},
+    'videos': {'keys': ['URL', 'Video Title', 'Channel Name'], 'times': ['Year', 'Quarter', 'Month']},
+}
+TIME_COLUMNS = ['Year', 'Quarter', 'Month', 'Hour', 'Weekday']
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+#the date and time formats the preprocessing script writes
+DATE_FORMAT = '%d-%b-%Y'
+TIME_FORMAT = '%H:%M:%S'
+
+
+#the year, quarter, month, hour and weekday (0 is monday) of every row.
+#a timestamp the preprocessing step already parsed (--time-columns) is used as it is, otherwise every distinct
+#date and time string is parsed once, the same way the active periods script does it
+def time_parts(df):
+    if 'Timestamp' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+        timestamp = df['Timestamp'].dt
+        parts = {'Year': timestamp.year, 'Quarter': timestamp.quarter, 'Month': timestamp.month,
+                 'Hour': timestamp.hour, 'Weekday': timestamp.dayofweek}
+        return pd.DataFrame({column: values.to_numpy() for column, values in parts.items()}, index=df.index)
+
+    active_periods = stage_loader.load_stage('active_periods')
+    day_codes, days = active_periods.parse_distinct(df['Date'], DATE_FORMAT)
+    clock_codes, clocks = active_periods.parse_distinct(df['Time'], TIME_FORMAT)
+    return pd.DataFrame({
+        'Year': days.year.to_numpy()[day_codes],
+        'Quarter': days.quarter.to_numpy()[day_codes],
+        'Month': days.month.to_numpy()[day_codes],
+        'Hour': clocks.hour.to_numpy()[clock_codes],
+        'Weekday': days.dayofweek.to_numpy()[day_codes],
+    }, index=df.index)
+
+
+#sums the counts of rows with the same keys and times. the key columns are categorical,
+#so observed=True keeps the groupby to the combinations that actually show up instead of every possible one
+def sum_counts(cube, level):
+    columns = LEVELS[level]['keys'] + LEVELS[level]['times']
+    cube = cube.astype({column: 'category' for column in LEVELS[level]['keys']})
+    return cube.groupby(columns, observed=True, sort=False)['Count'].sum().reset_index()
+
+
+#counts the rows of a processed table into the cube of one level
+@instrumentation.timed('rollup_cube.build', rows=lambda cube, df, *args, **kwargs: len(df))
+def build_cube(df, level='channels'):
+    parts = time_parts(df)
+    cube = pd.concat([df[LEVELS[level]['keys']], parts[LEVELS[level]['times']]], axis=1)
+    cube = cube.assign(Count=np.ones(len(cube), dtype=np.int64))
+    cube = sum_counts(cube, level)
+    return cube.astype({'Year': np.int16, **{column: np.int8 for column in LEVELS[level]['times'][1:]}})
+
+
+def level_dir(level, directory=CUBE_DIR):
+    return os.path.join(directory, level)
+
+
+def partition_path(year, level, directory=CUBE_DIR):
+    return os.path.join(level_dir(level, directory), f'{year}.parquet')
+
+
+def cube_years(level='channels', directory=CUBE_DIR):
+    paths = glob.glob(os.path.join(level_dir(level, directory), '*.parquet'))
+    return sorted(int(os.path.splitext(os.path.basename(path))[0]) for path in paths)
+
+
+#the counts of the given years (all of them by default), an empty cube if nothing was built yet
+def read_cube(level='channels', years=None, directory=CUBE_DIR):
+    table_io.import_pyarrow()
+    stored = cube_years(level, directory)
+    years = stored if years is None else [year for year in years if year in stored]
+    if not years:
+        return pd.DataFrame(columns=LEVELS[level]['keys'] + LEVELS[level]['times'] + ['Count'])
+    return pd.concat([pd.read_parquet(partition_path(year, level, directory)) for year in years], ignore_index=True)
+
+
+#writes every year of the cube to its own file. with replace_all the years that are not in the cube are removed,
+#which a full rebuild needs so a year that no longer has any rows does not stick around
+def write_cube(cube, level='channels', directory=CUBE_DIR, replace_all=False):
+    table_io.import_pyarrow()
+    os.makedirs(level_dir(level, directory), exist_ok=True)
+    years = set()
+    for year, part in cube.groupby('Year', sort=True):
+        years.add(int(year))
+        part.to_parquet(partition_path(int(year), level, directory), index=False)
+    if replace_all:
+        for year in set(cube_years(level, directory)) - years:
+            os.remove(partition_path(year, level, directory))
+
+
+#adds the counts of new rows to the stored cube. only the years the new rows fall in are read and rewritten
+def update_cube(delta_df, level='channels', directory=CUBE_DIR):
+    delta = build_cube(delta_df, level)
+    if delta.empty:
+        return delta
+    years = sorted(int(year) for year in delta['Year'].unique())
+    merged = sum_counts(pd.concat([read_cube(level, years, directory), delta], ignore_index=True), level)
+    write_cube(merged, level, directory)
+    return merged
+
+
+#the rows of the cube that match every filter. a filter left at None matches everything,
+#otherwise it is a list of the values to keep (years, quarters 1-4, months 1-12, hours 0-23, weekdays 0-6)
+def select(cube, years=None, quarters=None, months=None, hours=None, weekdays=None, channels=None):
+    filters = {'Year': years, 'Quarter': quarters, 'Month': months, 'Hour': hours, 'Weekday': weekdays,
+               'Channel Name': channels}
+    mask = np.ones(len(cube), dtype=bool)
+    for column, values in filters.items():
+        if values is None:
+            continue
+        if column not in cube.columns:
+            raise ValueError(f"This level has no '{column}' column to filter on.")
+        mask &= cube[column].isin(values).to_numpy()
+    return cube[mask]
+
+
+#the total count of every value (or combination of values) of the by columns within the filters, biggest first
+def totals(cube, by, **filters):
+    missing = [column for column in by if column not in cube.columns]
+    if missing:
+        raise ValueError(f"This level has no {', '.join(missing)} column to count along.")
+    selected = select(cube, **filters)
+    result = selected.groupby(by, observed=True, sort=False)['Count'].sum().reset_index()
+    return result.sort_values('Count', ascending=False, kind='stable', ignore_index=True)
+
+
+#the n channels (or videos) watched the most within the filters
+def top_n(cube, n=10, level='channels', **filters):
+    return totals(cube, LEVELS[level]['keys'], **filters).head(n)
+
+
+#counts along the given time columns within the filters, with every value in time order
+def time_slice(cube, by, **filters):
+    return totals(cube, by, **filters).sort_values(by, ignore_index=True)
+
+
+#only the years a query asks about have to be read
+def query_cube(level='channels', directory=CUBE_DIR, **filters):
+    return read_cube(level, filters.get('years'), directory)
+
+
+#builds every level from the whole processed table
+def build(fmt='csv', directory=CUBE_DIR):
+    df = table_io.read_table(PROCESSED_CSV_PATH, fmt)
+    for level in LEVELS:
+        write_cube(build_cube(df, level), level, directory, replace_all=True)
+    instrumentation.count_rows('rollup_cube', len(df))
+    manifest = incremental.load_manifest()
+    if manifest.get('stages', {}).get('preprocessing'):
+        incremental.mark_stage(manifest, 'rollup', manifest['stages']['preprocessing']['output_rows'], len(df))
+        incremental.save_manifest(manifest)
+    print(f"Rollup cube built from {len(df)} rows, years {', '.join(map(str, cube_years(directory=directory)))}.")
+
+
+#adds only the rows preprocessing prepended since the last build or update (see incremental.py).
+#without a manifest, or when the processed file was rebuilt since, the cube is built again from scratch
+def update(fmt='csv', directory=CUBE_DIR):
+    manifest = incremental.load_manifest()
+    pending = incremental.pending_rows(manifest, 'rollup', 'preprocessing')
+    if pending is None or not cube_years(directory=directory):
+        build(fmt, directory)
+        return
+    if pending == 0:
+        print("No new rows since the last rollup cube update.")
+        return
+
+    delta_df = table_io.read_table(PROCESSED_CSV_PATH, fmt, nrows=pending)
+    for level in LEVELS:
+        update_cube(delta_df, level, directory)
+    state = manifest['stages']['rollup']
+    incremental.mark_stage(manifest, 'rollup', state['input_rows'] + pending, state['output_rows'] + len(delta_df))
+    incremental.save_manifest(manifest)
+    instrumentation.count_rows('rollup_cube', pending)
+    print(f"Added {pending} new rows to the rollup cube.")
+
+
+#"3" is [3], "1-4" is [1, 2, 3, 4] and "1,5,7-8" is [1, 5, 7, 8]
+def parse_values(value):
+    values = []
+    for part in value.split(','):
+        low, _, high = part.partition('-')
+        values.extend(range(int(low), int(high or low) + 1))
+    return values
+
+
+def filter_arguments(args):
+    return {'years': args.year, 'quarters': args.quarter, 'months': args.month, 'hours': args.hour,
+            'weekdays': args.weekday, 'channels': args.channel}
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--level', choices=list(LEVELS), default='channels', help='count per channel or per video')
+    parser.add_argument('--year', type=parse_values, help='years to include, like 2022 or 2020-2022')
+    parser.add_argument('--quarter', type=parse_values, help='quarters to include, like 3 or 1-2')
+    parser.add_argument('--month', type=parse_values, help='months to include, 1 is january')
+    parser.add_argument('--hour', type=parse_values, help='hours of the day to include, like 1-4 for 1am to 4:59am')
+    parser.add_argument('--weekday', type=parse_values, help='weekdays to include, 0 is monday and 6 is sunday')
+    parser.add_argument('--channel', nargs='+', help='only count these channels')
+    parser.add_argument('--dir', default=CUBE_DIR, help='directory the cube is saved in')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build, update and query the precomputed watch count cube.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('build', 'build the cube from the whole processed table'),
+                            ('update', 'add the rows preprocessed since the last build or update')):
+        command_parser = commands.add_parser(name, help=help_text)
+        command_parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                                    help='file format of watch_history_processed written by the preprocessing script')
+        command_parser.add_argument('--dir', default=CUBE_DIR, help='directory the cube is saved in')
+        instrumentation.add_arguments(command_parser)
+
+    top_parser = commands.add_parser('top', help='the channels or videos watched the most')
+    top_parser.add_argument('--n', type=int, default=10, help='number of channels or videos to show')
+    add_filter_arguments(top_parser)
+
+    slice_parser = commands.add_parser('slice', help='watch counts along time columns')
+    slice_parser.add_argument('--by', nargs='+', choices=TIME_COLUMNS, default=['Hour'], help='time columns to count along')
+    add_filter_arguments(slice_parser)
+    args = parser.parse_args()
+
+    if args.command in ('build', 'update'):
+        with instrumentation.session(args, 'rollup_cube'):
+            (build if args.command == 'build' else update)(args.format, args.dir)
+    else:
+        filters = filter_arguments(args)
+        cube = query_cube(args.level, args.dir, **filters)
+        try:
+            if args.command == 'top':
+                result = top_n(cube, args.n, args.level, **filters)
+            else:
+                result = time_slice(cube, args.by, **filters)
+        except ValueError as e:
+            parser.error(str(e))
+        if 'Weekday' in result.columns:
+            result['Weekday'] = result['Weekday'].map(dict(enumerate(WEEKDAY_NAMES)))
+        print(result.to_string(index=False) if not result.empty else 'No views match these filters.')
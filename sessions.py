@@ -0,0 +1,171 @@
+#splits the watch history into viewing sessions and tags the rows that were most likely not really watched.
+#autoplay left running while falling asleep fills the history with long chains of videos a few minutes apart,
+#and replaying the same video puts it in the history again and again. the active periods script only caps those
+#outliers after counting, this tags the rows themselves so 03, 04 and 05 can leave them out (--exclude) or
+#05 can count them for less (--autoplay-weight, --rewatch-weight).
+#everything is done with numpy over the whole table at once: the rows are sorted by time once (the only n log n step),
+#the gaps between neighbours come from one np.diff, and sessions and runs are numbered with np.cumsum.
+#    python sessions.py
+#    python sessions.py --gap 45 --min-chain 6
+#the tags it adds are:
+#    Session            number of the viewing session, a new one starts after a gap longer than --gap minutes
+#    Session Position   0 for the first video of a session, 1 for the second and so on
+#    Autoplay           video that followed the previous one within --autoplay-gap minutes, in a same channel chain
+#                       of at least --min-chain videos or in an unbroken run of at least --min-dense videos.
+#                       the first video of such a run was picked by hand, so it is not tagged
+#    Rewatch            same video as the one right before it in the same session
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import instrumentation
+import table_io
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROCESSED_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_processed.csv')
+SESSIONS_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_sessions.csv')
+
+#thresholds in seconds and in videos
+SESSION_GAP = 30 * 60
+AUTOPLAY_GAP = 10 * 60
+MIN_CHAIN = 4
+MIN_DENSE = 12
+
+#the tags that can be excluded or weighted, with the column each one is stored in
+FLAG_COLUMNS = {'autoplay': 'Autoplay', 'rewatch': 'Rewatch'}
+FLAGS = list(FLAG_COLUMNS)
+SESSION_COLUMNS = ['Session', 'Session Position', 'Autoplay', 'Rewatch']
+
+#the date and time formats the preprocessing script writes
+DATE_FORMAT = '%d-%b-%Y'
+TIME_FORMAT = '%H:%M:%S'
+
+
+#seconds since 1970 of every row. a timestamp the preprocessing step already parsed (--time-columns) is used as it is,
+#timezone aware ones count in real seconds so the hour the clocks change is not a gap.
+#otherwise every distinct date and time string is parsed once and spread back over the rows by their codes
+def epoch_seconds(df):
+    if 'Timestamp' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+        timestamp = df['Timestamp']
+        return ((timestamp - pd.Timestamp(0, tz=timestamp.dt.tz)) // pd.Timedelta(seconds=1)).to_numpy()
+
+    day_codes, days = pd.factorize(df['Date'])
+    clock_codes, clocks = pd.factorize(df['Time'])
+    days = pd.to_datetime(pd.Index(days, dtype=object), format=DATE_FORMAT)
+    clocks = pd.to_datetime(pd.Index(clocks, dtype=object), format=TIME_FORMAT)
+    day_seconds = days.to_numpy().astype('datetime64[s]').astype(np.int64)
+    clock_seconds = (clocks.hour * 3600 + clocks.minute * 60 + clocks.second).to_numpy()
+    return day_seconds[day_codes] + clock_seconds[clock_codes]
+
+
+#link says for every event whether it carries on the run of the event before it.
+#gives back the position of every event in its run and the length of that run
+def run_positions(link):
+    starts = ~link
+    run_ids = np.cumsum(starts) - 1
+    start_index = np.flatnonzero(starts)
+    positions = np.arange(len(link)) - start_index[run_ids]
+    lengths = np.diff(np.append(start_index, len(link)))[run_ids]
+    return positions, lengths
+
+
+#true for every event that has the same code as the event before it. missing values (code -1) never match
+def same_as_previous(codes):
+    same = np.zeros(len(codes), dtype=bool)
+    same[1:] = (codes[1:] == codes[:-1]) & (codes[1:] >= 0)
+    return same
+
+
+#adds the session tags to every row, the rows stay in the order they came in
+@instrumentation.timed('sessions.tag', rows=lambda result, df, *args, **kwargs: len(df))
+def tag_sessions(df, gap=SESSION_GAP, autoplay_gap=AUTOPLAY_GAP, min_chain=MIN_CHAIN, min_dense=MIN_DENSE):
+    n = len(df)
+    epoch = epoch_seconds(df)
+    #takeout lists the newest video first, so of two videos in the same second the lower one came first.
+    #sorting the reversed rows stably keeps it that way
+    order = n - 1 - np.argsort(epoch[::-1], kind='stable')
+    times = epoch[order]
+    url_codes = pd.factorize(df['URL'])[0][order]
+    channel_codes = pd.factorize(df['Channel Name'])[0][order]
+
+    gaps = np.diff(times)
+    new_session = np.ones(n, dtype=bool)
+    new_session[1:] = gaps > gap
+    session = np.cumsum(new_session) - 1
+    session_position, _ = run_positions(~new_session)
+
+    quick = np.zeros(n, dtype=bool)
+    quick[1:] = (gaps <= autoplay_gap) & ~new_session[1:]
+    chain_position, chain_length = run_positions(quick & same_as_previous(channel_codes))
+    dense_position, dense_length = run_positions(quick)
+    autoplay = (((chain_position > 0) & (chain_length >= min_chain)) |
+                ((dense_position > 0) & (dense_length >= min_dense)))
+    rewatch = same_as_previous(url_codes) & ~new_session
+
+    #back to the order of the rows
+    back = np.empty(n, dtype=np.int64)
+    back[order] = np.arange(n)
+    return df.assign(**{'Session': session[back], 'Session Position': session_position[back],
+                        'Autoplay': autoplay[back], 'Rewatch': rewatch[back]})
+
+
+#the table with the session tags, the ones it already has are kept
+def ensure_tags(df):
+    if all(column in df.columns for column in SESSION_COLUMNS):
+        return df
+    return tag_sessions(df)
+
+
+#which rows to keep when the given tags are left out, as a boolean array
+def keep_mask(df, exclude=()):
+    keep = np.ones(len(df), dtype=bool)
+    for flag in exclude:
+        keep &= ~df[FLAG_COLUMNS[flag]].to_numpy(dtype=bool)
+    return keep
+
+
+#how much every row counts. a row with both tags gets both weights multiplied
+def row_weights(df, autoplay_weight=1.0, rewatch_weight=1.0):
+    weights = np.ones(len(df))
+    weights[df['Autoplay'].to_numpy(dtype=bool)] *= autoplay_weight
+    weights[df['Rewatch'].to_numpy(dtype=bool)] *= rewatch_weight
+    return weights
+
+
+#leaves out the rows with the given tags, tagging the table first if it has no tags yet
+def exclude_rows(df, exclude=()):
+    if not exclude:
+        return df
+    df = ensure_tags(df)
+    return df[keep_mask(df, exclude)]
+
+
+def main(fmt='csv', gap=SESSION_GAP, autoplay_gap=AUTOPLAY_GAP, min_chain=MIN_CHAIN, min_dense=MIN_DENSE):
+    df = tag_sessions(table_io.read_table(PROCESSED_CSV_PATH, fmt), gap, autoplay_gap, min_chain, min_dense)
+    table_io.write_table(df, SESSIONS_CSV_PATH, fmt)
+    instrumentation.count_rows('sessions', len(df))
+
+    sessions = df['Session'].nunique()
+    print(f"{len(df)} videos in {sessions} sessions, {len(df) / max(sessions, 1):.1f} videos per session on average.")
+    print(f"Tagged {int(df['Autoplay'].sum())} as autoplay ({df['Autoplay'].mean():.1%}) "
+          f"and {int(df['Rewatch'].sum())} as rewatches ({df['Rewatch'].mean():.1%}).")
+    print(f"Session tags saved as 'watch_history_sessions.{fmt}'.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split the history into viewing sessions and tag autoplay runs and rewatches.')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of watch_history_processed and of the tagged output')
+    parser.add_argument('--gap', type=float, default=SESSION_GAP / 60,
+                        help='minutes without a video after which a new session starts')
+    parser.add_argument('--autoplay-gap', type=float, default=AUTOPLAY_GAP / 60,
+                        help='minutes within which a video has to follow the previous one to count towards an autoplay run')
+    parser.add_argument('--min-chain', type=int, default=MIN_CHAIN,
+                        help='videos of the same channel in a row that count as an autoplay run')
+    parser.add_argument('--min-dense', type=int, default=MIN_DENSE,
+                        help='videos of any channel in a row that count as an autoplay run')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args, 'sessions'):
+        main(args.format, args.gap * 60, args.autoplay_gap * 60, args.min_chain, args.min_dense)
@@ -0,0 +1,37 @@
+#the numbered scripts cant be imported with a normal import statement because their names start with a digit.
+#this loads them by file name so other scripts (benchmarks, runners) can reuse their functions.
+import importlib.util
+import os
+import sys
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGE_FILES = {
+    'collection': '01_data_collection.py',
+    'preprocessing': '02_data_preprocessing.py',
+    'nlp': '03_nlp_analysis.py',
+    'lda': '04_lda_analysis.py',
+    'active_periods': '05_active_periods_analysis.py',
+}
+
+
+#the module is registered in sys.modules under its name without the number in front (data_collection, nlp_analysis, ...)
+#so worker processes can find the functions of a loaded stage when they get pickled
+def load_stage(stage):
+    file_name = STAGE_FILES[stage]
+    module_name = os.path.splitext(file_name)[0].split('_', 1)[1]
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(PROJECT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
@@ -0,0 +1,136 @@
+#reading and writing of the tables the stages hand to each other.
+#csv is what tableau wants for the final outputs, but between stages it is slow to write, slow to read,
+#and the title tokens have to be turned into a string and evaluated back into a list every time.
+#the parquet format keeps real types instead: a datetime64 timestamp, categorical channel names and the tokens as list<string>.
+#pyarrow is only needed when the parquet format is actually picked.
+import pandas as pd
+import ast
+import os
+import incremental
+
+FORMATS = ['csv', 'parquet']
+TOKEN_COLUMN = 'Title Tokens'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.compute
+    except ImportError as e:
+        raise ImportError("The parquet format needs pyarrow, install it with 'pip install pyarrow'.") from e
+    return pyarrow
+
+
+#the stages keep their csv paths as constants, the parquet file sits next to it with the other extension
+def table_path(csv_path, fmt='csv'):
+    if fmt == 'csv':
+        return csv_path
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+def table_exists(csv_path, fmt='csv'):
+    return os.path.exists(table_path(csv_path, fmt))
+
+
+def read_table(csv_path, fmt='csv', nrows=None):
+    if fmt == 'csv':
+        return pd.read_csv(csv_path, encoding='utf-8', nrows=nrows)
+    import_pyarrow()
+    df = pd.read_parquet(table_path(csv_path, fmt))
+    return df.head(nrows) if nrows is not None else df
+
+
+def write_table(df, csv_path, fmt='csv'):
+    if fmt == 'csv':
+        df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+        return
+    pa = import_pyarrow()
+    pa.parquet.write_table(to_arrow(df), table_path(csv_path, fmt))
+
+
+#the tokens column holds real lists in parquet and their string form in csv, this gives back lists either way
+def as_token_lists(series):
+    return series.apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else list(x))
+
+
+#adds the typed timestamp column next to the date and time strings the rest of the scripts still use.
+#a timestamp the preprocessing script already parsed (and maybe made timezone aware) is kept as it is
+def with_timestamp(df):
+    if 'Timestamp' not in df.columns and 'Date' in df.columns and 'Time' in df.columns:
+        timestamp = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Time'].astype(str),
+                                   format='%d-%b-%Y %H:%M:%S', errors='coerce')
+        df = df.assign(Timestamp=timestamp)
+    return df
+
+
+#converts a dataframe into an arrow table with the typed columns.
+#channel names are dictionary encoded by arrow itself, so every batch the streaming writer produces has the same schema
+def to_arrow(df):
+    pa = import_pyarrow()
+    df = with_timestamp(df)
+    if 'Channel Name' in df.columns:
+        df = df.assign(**{'Channel Name': df['Channel Name'].astype(object)})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if 'Channel Name' in df.columns:
+        index = table.schema.get_field_index('Channel Name')
+        column = pa.compute.dictionary_encode(table.column(index))
+        table = table.set_column(index, 'Channel Name', column)
+    if TOKEN_COLUMN in df.columns:
+        index = table.schema.get_field_index(TOKEN_COLUMN)
+        column = table.column(index).cast(pa.list_(pa.string()))
+        table = table.set_column(index, TOKEN_COLUMN, column)
+    return table
+
+
+#writes tables a batch at a time into one file, used by the streaming parser.
+#the csv is opened once with utf-8-sig so the byte order mark is written a single time at the top
+class CsvBatchWriter:
+    def __init__(self, csv_path):
+        self.file = open(csv_path, 'w', encoding='utf-8-sig', newline='')
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.file, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+#each batch becomes its own row group in the same parquet file
+class ParquetBatchWriter:
+    def __init__(self, csv_path):
+        self.path = table_path(csv_path, 'parquet')
+        self.writer = None
+
+    def write(self, df):
+        pa = import_pyarrow()
+        table = to_arrow(df)
+        if self.writer is None:
+            self.writer = pa.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def batch_writer(csv_path, fmt='csv'):
+    if fmt == 'csv':
+        return CsvBatchWriter(csv_path)
+    return ParquetBatchWriter(csv_path)
+
+
+#puts new rows on top of an existing table. csv gets appended without loading the old rows,
+#parquet files cannot be appended to so the two get concatenated and written again
+def prepend_table(delta_df, csv_path, fmt='csv'):
+    if fmt == 'csv':
+        incremental.prepend_csv(delta_df, csv_path)
+        return
+    if not table_exists(csv_path, fmt):
+        write_table(delta_df, csv_path, fmt)
+        return
+    existing = read_table(csv_path, fmt)
+    write_table(pd.concat([delta_df, existing], ignore_index=True), csv_path, fmt)
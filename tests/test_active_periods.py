@@ -0,0 +1,80 @@
+#the binned counts have to give the same insight files as the groupby and value_counts version they replaced.
+#the reference functions below are that version, with the month range fixed: it used freq='M' (month ends)
+#between the first days of the first and the last month, which always left out the last month
+import calendar
+import numpy as np
+import pandas as pd
+import stage_loader
+
+CHANNEL_ROWS = {'four': 80, 'three': 60, 'two': 40, 'one': 20}
+
+
+#a few months of history with nothing watched in january, every channel with a different count
+def processed_rows(seed=0):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2022-11-01', '2023-03-31', freq='D')
+    days = days[days.month != 1]
+    rows = sum(CHANNEL_ROWS.values())
+    channels = np.repeat(list(CHANNEL_ROWS), list(CHANNEL_ROWS.values()))
+    seconds = rng.integers(0, 86400, size=rows)
+    return pd.DataFrame({
+        'Channel Name': rng.permutation(channels),
+        'Date': days[rng.integers(0, len(days), size=rows)].strftime('%d-%b-%Y'),
+        'Time': [f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in seconds],
+    })
+
+
+def cap(series):
+    Q1 = series.quantile(0.25)
+    Q3 = series.quantile(0.75)
+    upper_bound = Q3 + 1.5 * (Q3 - Q1)
+    return series.apply(lambda x: min(x, upper_bound))
+
+
+def reference_months(df, freq='MS'):
+    df = df.assign(Date=pd.to_datetime(df['Date'], format='%d-%b-%Y'))
+    df['Month'] = df['Date'].dt.month
+    df['Year'] = df['Date'].dt.year
+    all_months = pd.date_range(start=df['Date'].min().to_period('M').to_timestamp(),
+                               end=df['Date'].max().to_period('M').to_timestamp(), freq=freq)
+    all_months_df = pd.DataFrame([(date.year, date.month) for date in all_months], columns=['Year', 'Month'])
+    monthly_watchtime = df.groupby(['Year', 'Month']).size().reset_index(name='Total Watchtime')
+    monthly_watchtime = all_months_df.merge(monthly_watchtime, on=['Year', 'Month'], how='left').fillna(0)
+    monthly_watchtime['Total Watchtime'] = cap(monthly_watchtime['Total Watchtime']).round().astype(int)
+    monthly_watchtime['Month'] = monthly_watchtime['Month'].apply(lambda x: calendar.month_name[x])
+    return monthly_watchtime
+
+
+def reference_hours(df):
+    dates = pd.to_datetime(df['Date'], format='%d-%b-%Y')
+    df = df.assign(Year=dates.dt.year, Quarter='Q' + dates.dt.quarter.astype(str),
+                   Hour=pd.to_datetime(df['Time'], format='%H:%M:%S').dt.hour)
+    all_combinations = pd.MultiIndex.from_product([df['Year'].unique(), df['Quarter'].unique(), range(24)],
+                                                  names=['Year', 'Quarter', 'Hour'])
+    counts = df.groupby(['Year', 'Quarter', 'Hour']).size().reset_index(name='Total Watchtime')
+    merged_df = pd.DataFrame(index=all_combinations).reset_index().merge(
+        counts, on=['Year', 'Quarter', 'Hour'], how='left').fillna(0)
+    starts = {'Q1': '01-Jan-', 'Q2': '01-Apr-', 'Q3': '01-Jul-', 'Q4': '01-Oct-'}
+    merged_df['Date'] = [starts[quarter] + str(year) for year, quarter in zip(merged_df['Year'], merged_df['Quarter'])]
+    merged_df['Total Watchtime'] = cap(merged_df['Total Watchtime'])
+    return merged_df
+
+
+def test_counts_match_groupby_version():
+    active_periods = stage_loader.load_stage('active_periods')
+    df = processed_rows()
+    counts = active_periods.ActivityCounts.from_frame(df)
+
+    monthly = counts.monthly_watchtime()
+    pd.testing.assert_frame_equal(monthly, reference_months(df), check_dtype=False)
+    #the old month ends range stopped one month short, march is the month that was missing
+    assert len(reference_months(df, freq='ME')) == len(monthly) - 1
+    assert monthly.iloc[-1][['Year', 'Month']].tolist() == [2023, 'March']
+    assert monthly.loc[monthly['Month'] == 'January', 'Total Watchtime'].tolist() == [0]
+
+    pd.testing.assert_frame_equal(counts.quarterly_active_hours(), reference_hours(df), check_dtype=False)
+
+    top = counts.top_channels(30)
+    expected = df['Channel Name'].value_counts().head(30)
+    assert top['Channel Name'].tolist() == expected.index.tolist()
+    assert top['Watch Count'].tolist() == expected.tolist()
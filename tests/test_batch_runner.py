@@ -0,0 +1,34 @@
+#runs the batch runner end to end on two small synthetic exports, with real worker processes
+import os
+import sys
+import batch_runner
+import stage_loader
+
+sys.path.insert(0, os.path.join(batch_runner.PROJECT_DIR, 'benchmarks'))
+
+import synthetic_takeout
+
+
+def test_run_batch_two_exports(tmp_path, monkeypatch):
+    exports_dir = tmp_path / 'exports'
+    for seed, user in enumerate(['alice', 'bob']):
+        synthetic_takeout.write_history(str(exports_dir / f'{user}.html'), rows=400, seed=seed, vocabulary_size=200,
+                                        channels=20, start='2022-01-01', end='2023-06-30')
+    #a fixed stop word list keeps the regex tokenizer from needing the nltk data
+    nlp_stage = stage_loader.load_stage('nlp')
+    monkeypatch.setattr(nlp_stage, 'stop_words', {'the', 'in'})
+
+    output_root = tmp_path / 'users'
+    exports = batch_runner.find_exports(str(exports_dir))
+    assert sorted(exports) == ['alice', 'bob']
+    failed = batch_runner.run_batch(exports, str(output_root), workers=2, location_engine='gazetteer',
+                                    tokenizer='regex', combined=True)
+
+    assert failed == []
+    for user in exports:
+        paths = batch_runner.user_paths(str(output_root), user)
+        for key in ('raw', 'processed', 'nlp'):
+            assert os.path.exists(paths[key])
+        assert os.path.exists(os.path.join(paths['insights'], 'top_30_youtubers.csv'))
+        assert os.path.exists(os.path.join(paths['lda'], 'lda_topics_by_quarter.csv'))
+    assert os.path.exists(os.path.join(str(output_root), batch_runner.COMBINED_DIR_NAME, 'peak_watching_months.csv'))
@@ -0,0 +1,80 @@
+#the streaming parser has to give back exactly what the beautifulsoup one does, on markup laid out like takeout
+import os
+import sys
+import stage_loader
+
+sys.path.insert(0, os.path.join(stage_loader.PROJECT_DIR, 'benchmarks'))
+
+import synthetic_takeout
+
+#escaped ampersands, no-break spaces written both ways and multi byte characters a small chunk can split in half
+TITLES = ['Tom &amp; Jerry', 'No\xa0break space', 'Entity&nbsp;space', 'Caf\xe9 \U0001F600 &lt;live&gt;', 'Plain title']
+
+
+def write_fixture(path, copies=20):
+    entries = []
+    for i in range(copies * len(TITLES)):
+        entries.append(synthetic_takeout.ENTRY.format(
+            video_id=f'video{i:06d}', title=TITLES[i % len(TITLES)], channel_id=f'UC{i % 7:022d}',
+            channel=f'Channel &amp; {i % 7}', date_time=f"Jul {1 + i % 28}, 2024, {1 + i % 12}:{i % 60:02d}:05 PM EDT"))
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(synthetic_takeout.HEADER + ''.join(entries) + synthetic_takeout.FOOTER)
+    return len(entries)
+
+
+def test_streaming_matches_beautifulsoup(tmp_path):
+    collection = stage_loader.load_stage('collection')
+    html_path = str(tmp_path / 'watch-history.html')
+    count = write_fixture(html_path)
+
+    expected = collection.parse_html(collection.load_html(html_path))
+    assert len(expected) == count
+    assert expected[0]['Video Title'] == 'Tom & Jerry'
+    assert expected[1]['Video Title'] == 'No\xa0break space'
+    assert expected[2]['Video Title'] == 'Entity\xa0space'
+    assert expected[0]['Channel Name'] == 'Channel & 0'
+    assert expected[0]['Date'] == '01-Jul-2024'
+    #chunks of a few bytes split tags, entities and multi byte characters everywhere
+    for chunk_size in (7, 64, collection.STREAM_CHUNK_SIZE):
+        assert list(collection.iter_records(html_path, chunk_size=chunk_size)) == expected
+
+
+#every shard starts right on an outer-cell div, so joining the shards gives back every entry once
+def test_shards_cut_on_entry_boundaries(tmp_path):
+    collection = stage_loader.load_stage('collection')
+    html_path = str(tmp_path / 'watch-history.html')
+    write_fixture(html_path)
+    expected = collection.parse_html(collection.load_html(html_path))
+
+    shards = collection.find_shard_offsets(html_path, 13)
+    assert len(shards) > 1
+    assert shards[0][0] == 0 and shards[-1][1] == os.path.getsize(html_path)
+    with open(html_path, 'rb') as file:
+        content = file.read()
+    for (start, end), (next_start, _) in zip(shards, shards[1:]):
+        assert end == next_start
+        assert content.startswith(collection.OUTER_CELL_MARKER, next_start)
+    records = []
+    for start, end in shards:
+        records.extend(collection.iter_records(html_path, chunk_size=64, start=start, end=end))
+    assert records == expected
+
+
+#a marker cut in half by the search blocks is still found
+def test_find_next_marker_across_blocks(tmp_path):
+    collection = stage_loader.load_stage('collection')
+    html_path = str(tmp_path / 'watch-history.html')
+    write_fixture(html_path, copies=1)
+    with open(html_path, 'rb') as file:
+        first = file.read().find(collection.OUTER_CELL_MARKER)
+        for block_size in (5, 16, len(collection.OUTER_CELL_MARKER)):
+            assert collection.find_next_marker(file, 1, block_size) == first
+
+
+def test_parallel_matches_beautifulsoup(tmp_path):
+    collection = stage_loader.load_stage('collection')
+    html_path = str(tmp_path / 'watch-history.html')
+    write_fixture(html_path)
+    expected = collection.parse_html(collection.load_html(html_path))
+    #3 workers cut the file into 12 shards, so plenty of entries sit right at a cut
+    assert list(collection.iter_records_parallel(html_path, workers=3)) == expected
@@ -0,0 +1,125 @@
+#the city converter with a stub geocoder that answers from a dict, so nothing here goes over the network
+import asyncio
+import importlib.util
+import os
+import pandas as pd
+import pytest
+import geocode_cache
+import stage_loader
+
+STATES = {'Springfield, USA': 'Illinois', 'Austin, USA': 'Texas', 'Nowhere, USA': None}
+
+
+class Location:
+    def __init__(self, state):
+        self.raw = {'address': {'state': state}}
+        self.latitude = 0.0
+        self.longitude = 0.0
+
+
+#answers from STATES and remembers every query. the first `timeouts` calls time out instead
+class StubGeocoder:
+    def __init__(self, timeouts=0):
+        self.queries = []
+        self.timeouts = timeouts
+
+    def geocode(self, query, exactly_one=True, addressdetails=False):
+        self.queries.append(query)
+        if self.timeouts:
+            self.timeouts -= 1
+            raise TimeoutError(query)
+        state = STATES.get(query)
+        return Location(state) if state else None
+
+    def reverse(self, point, exactly_one=True, addressdetails=False):
+        raise AssertionError('the forward geocode already has the state')
+
+
+def resolve(cities, cache, geocoder, **kwargs):
+    return asyncio.run(geocode_cache.resolve_cities(cities, cache, geocoder, min_interval=0, backoff=0, **kwargs))
+
+
+#the script name has spaces in it, so it is loaded by path
+def load_converter():
+    spec = importlib.util.spec_from_file_location('city_names_converter',
+                                                  os.path.join(stage_loader.PROJECT_DIR, 'city names converter.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_cached_cities_are_not_looked_up_again(tmp_path):
+    cache = geocode_cache.GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    geocoder = StubGeocoder()
+    assert resolve(['Springfield', 'Austin'], cache, geocoder) == {'Springfield': 'Illinois', 'Austin': 'Texas'}
+    assert sorted(geocoder.queries) == ['Austin, USA', 'Springfield, USA']
+
+    #other spellings of a cached city are answered from the cache too
+    geocoder = StubGeocoder()
+    assert resolve(['  springfield', 'AUSTIN'], cache, geocoder) == {'  springfield': 'Illinois', 'AUSTIN': 'Texas'}
+    assert geocoder.queries == []
+    cache.close()
+
+
+#a city the geocoder does not know is cached as None, so it is not asked for again either
+def test_missing_cities_are_cached(tmp_path):
+    cache = geocode_cache.GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    geocoder = StubGeocoder()
+    assert resolve(['Nowhere'], cache, geocoder) == {'Nowhere': None}
+    assert geocoder.queries == ['Nowhere, USA']
+    assert cache.get_many(['Nowhere']) == {'nowhere': None}
+
+    geocoder = StubGeocoder()
+    assert resolve(['Nowhere'], cache, geocoder) == {'Nowhere': None}
+    assert geocoder.queries == []
+    cache.close()
+
+
+#timeouts are tried again after a wait that doubles every time
+def test_timeouts_are_retried_with_backoff(tmp_path, monkeypatch):
+    waits = []
+
+    async def sleep(delay):
+        waits.append(delay)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    cache = geocode_cache.GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    geocoder = StubGeocoder(timeouts=2)
+    states = asyncio.run(geocode_cache.resolve_cities(['Austin'], cache, geocoder, min_interval=0, retries=3,
+                                                      backoff=0.5))
+    assert states == {'Austin': 'Texas'}
+    assert geocoder.queries == ['Austin, USA'] * 3
+    assert waits == [0.5, 1.0]
+    cache.close()
+
+
+#a lookup that still times out after the retries is left out of the cache, so the next run tries it again
+def test_failed_lookups_are_not_cached(tmp_path):
+    cache = geocode_cache.GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    geocoder = StubGeocoder(timeouts=3)
+    assert resolve(['Austin'], cache, geocoder, retries=2) == {'Austin': None}
+    assert len(geocoder.queries) == 3
+    assert cache.get_many(['Austin']) == {}
+    cache.close()
+
+
+@pytest.mark.parametrize('offline', [True, False])
+def test_offline_never_calls_the_geocoder(tmp_path, offline):
+    converter = load_converter()
+    input_file = tmp_path / 'city_names.txt'
+    input_file.write_text('Springfield\nAustin\n', encoding='utf-8')
+    cache_file = str(tmp_path / 'cache.sqlite')
+    cache = geocode_cache.GeocodeCache(cache_file)
+    cache.put('Springfield', 'Illinois', 'geocoder')
+    cache.close()
+
+    geocoder = StubGeocoder()
+    output_file = str(tmp_path / 'city_state_mapping.csv')
+    converter.main(str(input_file), output_file, cache_file, offline=offline, geocoder=geocoder, min_interval=0)
+    mapping = pd.read_csv(output_file, encoding='utf-8-sig')
+    if offline:
+        assert geocoder.queries == []
+        assert mapping.values.tolist() == [['Springfield', 'Illinois']]
+    else:
+        assert geocoder.queries == ['Austin, USA']
+        assert mapping.values.tolist() == [['Springfield', 'Illinois'], ['Austin', 'Texas']]
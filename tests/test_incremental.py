@@ -0,0 +1,161 @@
+#an incremental run over an old export and then a newer one has to end up with the same tables as one full run
+#over the newer export, for the collection, preprocessing and nlp outputs alike
+import functools
+import os
+import sys
+import pandas as pd
+import incremental
+import stage_loader
+import token_matrix
+
+sys.path.insert(0, os.path.join(stage_loader.PROJECT_DIR, 'benchmarks'))
+
+import synthetic_takeout
+
+TABLES = ['watch_history.csv', 'watch_history_processed.csv', 'watch_history_nlp.csv']
+NEW_ENTRIES = 40
+
+#the manifest path is a default argument of these, bound when incremental.py was imported
+LOAD_MANIFEST = incremental.load_manifest
+SAVE_MANIFEST = incremental.save_manifest
+
+
+#writes the newer export and the older one, which is the same file without its newest entries
+def write_exports(directory):
+    new_path = str(directory / 'watch-history-new.html')
+    synthetic_takeout.write_history(new_path, rows=300, seed=3, vocabulary_size=200, channels=20,
+                                    start='2023-01-01', end='2024-06-30')
+    with open(new_path, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines(keepends=True)
+    old_path = str(directory / 'watch-history-old.html')
+    with open(old_path, 'w', encoding='utf-8') as file:
+        file.write(lines[0] + ''.join(lines[1 + NEW_ENTRIES:]))
+    return old_path, new_path
+
+
+#points every stage, the manifest and the keyword reports at one directory
+def use_directory(monkeypatch, directory, html_path):
+    collection = stage_loader.load_stage('collection')
+    preprocessing = stage_loader.load_stage('preprocessing')
+    nlp_stage = stage_loader.load_stage('nlp')
+    raw_path, processed_path, nlp_path = (str(directory / name) for name in TABLES)
+    monkeypatch.setattr(collection, 'HTML_FILE_PATH', html_path)
+    monkeypatch.setattr(collection, 'CSV_OUTPUT_PATH', raw_path)
+    monkeypatch.setattr(preprocessing, 'RAW_CSV_PATH', raw_path)
+    monkeypatch.setattr(preprocessing, 'PROCESSED_CSV_PATH', processed_path)
+    monkeypatch.setattr(nlp_stage, 'PROCESSED_CSV_PATH', processed_path)
+    monkeypatch.setattr(nlp_stage, 'NLP_CSV_PATH', nlp_path)
+    monkeypatch.setattr(nlp_stage, 'write_quarterly_reports',
+                        functools.partial(nlp_stage.write_quarterly_reports, output_dir=str(directory / 'reports')))
+    manifest_path = str(directory / 'ingest_manifest.json')
+    monkeypatch.setattr(incremental, 'MANIFEST_PATH', manifest_path)
+    monkeypatch.setattr(incremental, 'load_manifest', functools.partial(LOAD_MANIFEST, manifest_path))
+    monkeypatch.setattr(incremental, 'save_manifest', functools.partial(SAVE_MANIFEST, path=manifest_path))
+    return collection, preprocessing, nlp_stage
+
+
+def run_nlp(nlp_stage, incremental_run=False, exclude=()):
+    nlp_stage.main(incremental_run=incremental_run, location_engine='gazetteer', tokenizer='regex', exclude=exclude)
+
+
+#one full run of the three stages in directory, gives back the number of raw rows and the manifest
+def run_full(monkeypatch, directory, html_path, exclude=()):
+    directory.mkdir()
+    with monkeypatch.context() as patch:
+        collection, preprocessing, nlp_stage = use_directory(patch, directory, html_path)
+        collection.main()
+        preprocessing.preprocess_data()
+        run_nlp(nlp_stage, exclude=exclude)
+        return len(pd.read_csv(str(directory / TABLES[0]))), incremental.load_manifest()
+
+
+#a full run over the old export followed by an incremental one over the new export
+def run_incremental(monkeypatch, directory, old_path, new_path, exclude=()):
+    old_rows, _ = run_full(monkeypatch, directory, old_path, exclude)
+    with monkeypatch.context() as patch:
+        collection, preprocessing, nlp_stage = use_directory(patch, directory, new_path)
+        collection.ingest_new_records(new_path, collection.CSV_OUTPUT_PATH)
+        preprocessing.preprocess_data(incremental_run=True)
+        run_nlp(nlp_stage, incremental_run=True, exclude=exclude)
+        return old_rows, incremental.load_manifest()
+
+
+def assert_same_reports(directory, expected_directory):
+    reports = sorted(os.listdir(str(expected_directory / 'reports')))
+    assert reports
+    assert sorted(os.listdir(str(directory / 'reports'))) == reports
+    for name in reports:
+        assert (directory / 'reports' / name).read_text(encoding='utf-8') == \
+            (expected_directory / 'reports' / name).read_text(encoding='utf-8')
+
+
+def test_incremental_matches_full_rebuild(tmp_path, monkeypatch):
+    old_path, new_path = write_exports(tmp_path)
+    nlp_stage = stage_loader.load_stage('nlp')
+    #a fixed stop word list keeps the regex tokenizer from needing the nltk data
+    monkeypatch.setattr(nlp_stage, 'stop_words', {'the', 'in'})
+
+    full_dir = tmp_path / 'full'
+    full_rows, full_manifest = run_full(monkeypatch, full_dir, new_path)
+    incremental_dir = tmp_path / 'incremental'
+    old_rows, incremental_manifest = run_incremental(monkeypatch, incremental_dir, old_path, new_path)
+
+    for name in TABLES:
+        full = pd.read_csv(str(full_dir / name), encoding='utf-8')
+        pd.testing.assert_frame_equal(pd.read_csv(str(incremental_dir / name), encoding='utf-8'), full)
+    assert old_rows == full_rows - NEW_ENTRIES
+
+    #the prepended matrix has the new terms at the end of its vocabulary, the tokens of every row are the same
+    assert (token_matrix.load(str(incremental_dir / TABLES[2])).token_lists() ==
+            token_matrix.load(str(full_dir / TABLES[2])).token_lists())
+
+    #only the years with new rows were rewritten, the rest are still the ones of the first run
+    assert_same_reports(incremental_dir, full_dir)
+
+    #the content hash chains the rows in the order they were ingested so it differs, everything else has to match
+    for key in ('newest_timestamp', 'boundary_hashes', 'stages'):
+        assert incremental_manifest[key] == full_manifest[key]
+
+
+#the keyword reports leave out the tagged rows of the whole table, also when only some of them are new
+def test_incremental_reports_with_exclude(tmp_path, monkeypatch):
+    old_path, new_path = write_exports(tmp_path)
+    nlp_stage = stage_loader.load_stage('nlp')
+    monkeypatch.setattr(nlp_stage, 'stop_words', {'the', 'in'})
+
+    exclude = ['autoplay', 'rewatch']
+    full_dir = tmp_path / 'full'
+    run_full(monkeypatch, full_dir, new_path, exclude)
+    incremental_dir = tmp_path / 'incremental'
+    _, manifest = run_incremental(monkeypatch, incremental_dir, old_path, new_path, exclude)
+
+    assert manifest['stages']['nlp']['input_rows'] == manifest['stages']['preprocessing']['output_rows']
+    assert_same_reports(incremental_dir, full_dir)
+
+
+#the new rows go on top in the column order of the existing file, under a single header
+def test_prepend_csv_keeps_header_and_columns(tmp_path):
+    path = str(tmp_path / 'table.csv')
+    pd.DataFrame({'a': [3, 4], 'b': ['c', 'd']}).to_csv(path, index=False, encoding='utf-8-sig')
+    incremental.prepend_csv(pd.DataFrame({'b': ['x', 'y'], 'a': [1, 2]}), path)
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    assert df.columns.tolist() == ['a', 'b']
+    assert df.to_dict('list') == {'a': [1, 2, 3, 4], 'b': ['x', 'y', 'c', 'd']}
+
+
+#a rebuild only starts over the stages that read its output, the rollup cube reads the processed rows and not the nlp table
+def test_rebuild_drops_only_dependent_stages():
+    manifest = {}
+    for stage in incremental.UPSTREAM:
+        incremental.mark_stage(manifest, stage, 10, 10)
+
+    incremental.mark_stage(manifest, 'nlp', 12, 12, rebuild=True)
+    assert sorted(manifest['stages']) == ['collection', 'nlp', 'preprocessing', 'rollup']
+
+    incremental.mark_stage(manifest, 'preprocessing', 12, 12, rebuild=True)
+    assert sorted(manifest['stages']) == ['collection', 'preprocessing']
+
+    incremental.mark_stage(manifest, 'rollup', 12, 12)
+    incremental.mark_stage(manifest, 'collection', 14, 14, rebuild=True)
+    assert sorted(manifest['stages']) == ['collection']
+    assert incremental.pending_rows(manifest, 'preprocessing', 'collection') is None
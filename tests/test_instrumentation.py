@@ -0,0 +1,33 @@
+import itertools
+import instrumentation
+
+
+@instrumentation.timed_generator('numbers')
+def numbers(n):
+    yield from range(n)
+
+
+@instrumentation.timed('total', rows=lambda result, values: len(values))
+def total(values):
+    return sum(values)
+
+
+#generators count every item they yield, also when the caller stops early, and every record gets the peak memory
+def test_generator_and_function_records(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'enabled', True)
+    monkeypatch.setattr(instrumentation, 'records', {})
+    assert list(numbers(3)) == [0, 1, 2]
+    assert list(itertools.islice(numbers(10), 4)) == [0, 1, 2, 3]
+    assert total([1, 2, 3]) == 6
+
+    records = {row['name']: row for row in instrumentation.report_rows()}
+    assert (records['numbers']['calls'], records['numbers']['rows']) == (2, 7)
+    assert (records['total']['calls'], records['total']['rows']) == (1, 3)
+    if instrumentation.peak_rss_mb() is not None:
+        assert records['numbers']['peak_rss_mb'] and records['total']['peak_rss_mb']
+
+
+def test_nothing_recorded_when_disabled(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'records', {})
+    assert list(numbers(2)) == [0, 1]
+    assert instrumentation.records == {}
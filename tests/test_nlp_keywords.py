@@ -0,0 +1,61 @@
+#the keyword reports from the document-term matrix have to match the ones from the token lists
+#and Counter.most_common, including the order of tokens with the same count
+import pandas as pd
+import numpy as np
+from collections import Counter
+import stage_loader
+import token_matrix
+
+#every word shows up the same number of times in its quarter, so the order is decided by the ties alone
+TITLES = [
+    'zebra apple', 'mango zebra', 'apple mango', 'kiwi banana', 'banana kiwi cherry',
+    'cherry kiwi banana', 'plum zebra', 'zebra plum', 'lemon lime', 'lime lemon',
+]
+YEARS = [2021, 2021, 2021, 2021, 2022, 2022, 2022, 2022, 2022, 2022]
+QUARTERS = ['Q1', 'Q1', 'Q1', 'Q2', 'Q3', 'Q3', 'Q3', 'Q4', 'Q4', 'Q4']
+
+
+def keys():
+    return pd.DataFrame({'Year': YEARS, 'Quarter': QUARTERS})
+
+
+def most_common(token_lists, n):
+    expected = {}
+    for year, quarter, tokens in zip(YEARS, QUARTERS, token_lists):
+        expected.setdefault((year, quarter), Counter()).update(tokens)
+    return {group: [(token, count) for token, count in counter.most_common(n)] for group, counter in expected.items()}
+
+
+def test_matrix_keywords_match_lists_with_ties():
+    nlp_stage = stage_loader.load_stage('nlp')
+    dtm = token_matrix.tokenize_titles(TITLES, set())
+    token_lists = dtm.token_lists()
+
+    for n in (1, 3, 10):
+        from_lists = nlp_stage.top_keywords_from_lists(keys(), pd.Series(token_lists).to_numpy(), n)
+        from_matrix = nlp_stage.top_keywords_from_matrix(keys(), dtm, n)
+        assert from_matrix == from_lists
+        assert from_matrix == most_common(token_lists, n)
+
+
+#a matrix whose vocabulary was built in another order (like after an incremental run) gives the same reports
+def test_matrix_keywords_do_not_depend_on_vocabulary_order():
+    nlp_stage = stage_loader.load_stage('nlp')
+    dtm = token_matrix.tokenize_titles(TITLES, set())
+    reversed_dtm = token_matrix.tokenize_titles(TITLES[::-1], set()).rows(np.arange(len(TITLES))[::-1])
+    assert reversed_dtm.terms != dtm.terms
+
+    assert nlp_stage.top_keywords_from_matrix(keys(), reversed_dtm) == nlp_stage.top_keywords_from_matrix(keys(), dtm)
+
+
+#a run without rows (like an incremental run over an export that only had unavailable videos) gives an empty table
+def test_analyze_empty_frame(monkeypatch):
+    nlp_stage = stage_loader.load_stage('nlp')
+    monkeypatch.setattr(nlp_stage, 'stop_words', {'the', 'in'})
+    assert token_matrix.tokenize_titles([], set()).token_lists() == []
+
+    df = pd.DataFrame(columns=['Video Title', 'URL', 'Channel Name', 'Channel URL', 'Date', 'Time'], dtype=object)
+    df, dtm = nlp_stage.analyze(df, location_engine='gazetteer', tokenizer='regex')
+    assert dtm.matrix.shape[0] == 0
+    assert len(df) == 0
+    assert {'Title Tokens', 'Quarter', 'State', 'Country'} <= set(df.columns)
@@ -0,0 +1,21 @@
+import pipeline
+
+
+#shared modules the stages import change the fingerprint too, not just the numbered scripts
+def test_stage_files_include_shared_modules():
+    for stage in pipeline.STAGE_ORDER:
+        assert {'table_io.py', 'instrumentation.py', 'incremental.py'} <= set(pipeline.stage_files(stage))
+    assert 'resources.py' in pipeline.stage_files('nlp')
+    for stage in ('nlp', 'lda', 'active_periods'):
+        assert 'sessions.py' in pipeline.stage_files(stage)
+
+
+def test_fingerprint_changes_with_shared_module(tmp_path, monkeypatch):
+    html_path = tmp_path / 'watch-history.html'
+    html_path.write_text('<html></html>', encoding='utf-8')
+    before = pipeline.Pipeline(str(html_path), str(tmp_path)).fingerprint('active_periods')
+    digest = pipeline.file_digest
+    monkeypatch.setattr(pipeline, 'file_digest',
+                        lambda path: 'changed' if path.endswith('sessions.py') else digest(path))
+    after = pipeline.Pipeline(str(html_path), str(tmp_path)).fingerprint('active_periods')
+    assert before != after
@@ -0,0 +1,30 @@
+import pandas as pd
+import stage_loader
+
+
+def raw_rows():
+    return pd.DataFrame({
+        'Video Title': ['a', 'b'],
+        'URL': ['https://www.youtube.com/watch?v=a', 'https://www.youtube.com/watch?v=b'],
+        'Channel Name': ['one', 'two'],
+        'Channel URL': ['https://www.youtube.com/channel/1', 'https://www.youtube.com/channel/2'],
+        'Date': ['20-Jul-2024', '02-Jan-2023'],
+        'Time': ['22:15:32', '08:00:00'],
+    })
+
+
+#a timezone on its own still gives the timezone aware timestamp instead of being dropped
+def test_timezone_implies_time_columns():
+    preprocessing = stage_loader.load_stage('preprocessing')
+    df = preprocessing.preprocess(raw_rows(), timezone='America/New_York')
+    assert str(df['Timestamp'].dt.tz) == 'America/New_York'
+    assert df['Hour'].tolist() == [22, 8]
+
+
+#the quarter labels match the ones the nlp script writes, so the two Quarter columns never disagree
+def test_quarter_uses_nlp_labels():
+    preprocessing = stage_loader.load_stage('preprocessing')
+    nlp_stage = stage_loader.load_stage('nlp')
+    df = preprocessing.preprocess(raw_rows(), time_columns=True)
+    assert df['Quarter'].tolist() == ['Q3', 'Q1']
+    assert df['Quarter'].tolist() == nlp_stage.quarter_labels(nlp_stage.row_dates(df)).tolist()
@@ -0,0 +1,39 @@
+import pandas as pd
+import subprocess
+import sys
+import rollup_cube
+
+
+def processed_rows():
+    return pd.DataFrame({
+        'Video Title': ['a', 'b', 'c', 'a'],
+        'URL': ['https://www.youtube.com/watch?v=a', 'https://www.youtube.com/watch?v=b',
+                'https://www.youtube.com/watch?v=c', 'https://www.youtube.com/watch?v=a'],
+        'Channel Name': ['one', 'two', 'one', 'one'],
+        #a monday, a monday, a wednesday and a sunday
+        'Date': ['04-Jul-2022', '04-Jul-2022', '06-Jul-2022', '10-Jul-2022'],
+        'Time': ['01:15:00', '23:00:00', '02:30:00', '03:00:00'],
+    })
+
+
+def build(directory):
+    df = processed_rows()
+    for level in rollup_cube.LEVELS:
+        rollup_cube.write_cube(rollup_cube.build_cube(df, level), level, str(directory), replace_all=True)
+
+
+def test_top_channels_in_time_slice(tmp_path):
+    build(tmp_path)
+    cube = rollup_cube.read_cube('channels', [2022], str(tmp_path))
+    top = rollup_cube.top_n(cube, 5, years=[2022], quarters=[3], hours=[1, 2, 3, 4])
+    assert list(zip(top['Channel Name'], top['Count'])) == [('one', 3)]
+
+
+#slice --by Weekday prints the names of the days, not their numbers
+def test_slice_cli_prints_weekday_names(tmp_path):
+    build(tmp_path)
+    result = subprocess.run([sys.executable, rollup_cube.__file__, 'slice', '--by', 'Weekday', '--dir', str(tmp_path)],
+                            capture_output=True, text=True, check=True)
+    lines = result.stdout.split('\n')
+    assert lines[0].split() == ['Weekday', 'Count']
+    assert [line.split() for line in lines[1:4]] == [['Monday', '2'], ['Wednesday', '1'], ['Sunday', '1']]
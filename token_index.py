@@ -0,0 +1,100 @@
+#inverted index from every title token to the videos whose titles contain it.
+#the lda script needs to know if a topic word shows up in at least two different videos, and it used to answer that
+#by scanning every row of the year for every single topic word. this index is built once and then answers it with a lookup.
+#it is stored as a sparse matrix with one column per token and one row per distinct video url,
+#so the number of distinct videos for a token is just the length of its column.
+#it can also be run on its own to see which videos mention a token:
+#    python token_index.py "new york" --year 2023
+import pandas as pd
+import numpy as np
+import scipy.sparse
+import argparse
+import os
+import table_io
+
+#define the project directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+NLP_CSV_PATH = os.path.join(PROJECT_DIR, 'history', 'watch_history_nlp.csv')
+
+
+class TokenUrlIndex:
+    def __init__(self, url_token_matrix, vocabulary, urls):
+        #csc so the videos of one token are a contiguous slice of indices
+        self.matrix = url_token_matrix.tocsc()
+        self.matrix.sum_duplicates()
+        self.vocabulary = vocabulary
+        self.urls = urls
+
+    #builds the index from a column of token lists and the matching urls
+    @classmethod
+    def from_lists(cls, token_lists, urls):
+        url_codes, unique_urls = factorize_urls(urls)
+        vocabulary = {}
+        rows = []
+        columns = []
+        for tokens, url_code in zip(token_lists, url_codes):
+            if url_code < 0:
+                continue
+            for token in tokens:
+                rows.append(url_code)
+                columns.append(vocabulary.setdefault(token, len(vocabulary)))
+        matrix = scipy.sparse.coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                         shape=(len(unique_urls), len(vocabulary)))
+        return cls(matrix, vocabulary, unique_urls)
+
+    #builds the index from a document-term matrix (token_matrix.DocumentTermMatrix) lined up with the urls.
+    #a url-by-row indicator matrix times the document-term matrix gives the url-by-token matrix in one product.
+    #the vocabulary can be passed in when several indexes are built over the same matrix
+    @classmethod
+    def from_matrix(cls, dtm, urls, vocabulary=None):
+        url_codes, unique_urls = factorize_urls(urls)
+        rows = np.flatnonzero(url_codes >= 0)
+        indicator = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (url_codes[rows], rows)),
+                                            shape=(len(unique_urls), len(url_codes)))
+        return cls(indicator @ dtm.canonical(), vocabulary if vocabulary is not None else dtm.vocabulary, unique_urls)
+
+    def url_codes(self, token):
+        column = self.vocabulary.get(token)
+        if column is None:
+            return np.empty(0, dtype=np.int32)
+        return self.matrix.indices[self.matrix.indptr[column]:self.matrix.indptr[column + 1]]
+
+    #number of different videos whose title contains the token
+    def distinct_url_count(self, token):
+        column = self.vocabulary.get(token)
+        if column is None:
+            return 0
+        return int(self.matrix.indptr[column + 1] - self.matrix.indptr[column])
+
+    def urls_for(self, token):
+        return set(self.urls[self.url_codes(token)])
+
+
+#every url (including 'No URL') counts as a video like before, missing urls get the code -1 and are left out
+def factorize_urls(urls):
+    url_codes, unique_urls = pd.factorize(pd.Series(urls).reset_index(drop=True))
+    return url_codes, np.asarray(unique_urls, dtype=object)
+
+
+def main(tokens, year=None, fmt='csv'):
+    df = table_io.read_table(NLP_CSV_PATH, fmt)
+    if year is not None:
+        df = df[pd.to_datetime(df['Date'], format='%d-%b-%Y').dt.year == year]
+    df = df.dropna(subset=['URL'])
+    index = TokenUrlIndex.from_lists(table_io.as_token_lists(df['Title Tokens']), df['URL'])
+    titles = dict(zip(df['URL'], df['Video Title']))
+    for token in tokens:
+        urls = sorted(index.urls_for(token))
+        print(f"'{token}' is in {len(urls)} distinct videos")
+        for url in urls:
+            print(f"  {url}  {titles.get(url, '')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the videos whose title tokens contain the given tokens.')
+    parser.add_argument('tokens', nargs='+', help='tokens to look up, n-grams are written with spaces ("new york")')
+    parser.add_argument('--year', type=int, help='only look at videos watched in this year')
+    parser.add_argument('--format', choices=table_io.FORMATS, default='csv',
+                        help='file format of watch_history_nlp written by the nlp script')
+    args = parser.parse_args()
+    main([token.lower() for token in args.tokens], args.year, args.format)
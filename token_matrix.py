@@ -0,0 +1,133 @@
+#batched tokenizer that turns the whole title column into a sparse document-term matrix in one go.
+#the nltk tokenizer in the nlp script runs word_tokenize and builds n-gram strings row by row, and the result is a python list per cell
+#that later has to be written out as a string and evaluated back. this works on the title column at once instead:
+#every unique title is tokenized only once with a precompiled regex, words and n-grams are interned into integer ids,
+#and the result is a csr matrix (one row per video, one column per term) that the keyword counts and the lda script can use directly.
+#the regex keeps runs of letters and digits, which is close to word_tokenize followed by the isalnum filter,
+#except that contractions like "don't" become "don" and "t" instead of being dropped.
+import pandas as pd
+import numpy as np
+import scipy.sparse
+import json
+import os
+import re
+import instrumentation
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+class DocumentTermMatrix:
+    def __init__(self, matrix, terms):
+        self.matrix = matrix
+        self.terms = terms
+
+    @property
+    def vocabulary(self):
+        return {term: index for index, term in enumerate(self.terms)}
+
+    #the tokens of one row in the same order process_title would list them: unigrams, then bigrams, then trigrams
+    def row_tokens(self, row):
+        start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        return [self.terms[index] for index in self.matrix.indices[start:end]]
+
+    #the tokens of every row at once, for the 'Title Tokens' column of the nlp table
+    def token_lists(self):
+        #np.split of an empty array still gives back one empty piece, a table without rows has no token lists at all
+        if self.matrix.shape[0] == 0:
+            return []
+        terms = np.asarray(self.terms, dtype=object)
+        return [list(row) for row in np.split(terms[self.matrix.indices], self.matrix.indptr[1:-1])]
+
+    def rows(self, positions):
+        return DocumentTermMatrix(self.matrix[positions], self.terms)
+
+    #total count of every term over the given rows (or all rows), straight from the column sums
+    def term_counts(self, positions=None):
+        matrix = self.matrix if positions is None else self.matrix[positions]
+        return np.asarray(matrix.sum(axis=0)).ravel()
+
+    #copy of the matrix with repeated terms of a row summed into a single entry, which is what sklearn expects
+    def canonical(self):
+        matrix = self.matrix.copy()
+        matrix.sum_duplicates()
+        return matrix
+
+
+#tokenizes a list of titles into a DocumentTermMatrix.
+#the terms of each row are stored in the order they appear in the title (duplicates are kept, not summed),
+#which is what lets row_tokens give back the same list the nltk path produces
+@instrumentation.timed('tokenize_titles', rows=lambda dtm, *args, **kwargs: dtm.matrix.shape[0])
+def tokenize_titles(titles, stop_words, ngram_range=(1, 3)):
+    codes, unique_titles = pd.factorize(pd.Series(titles, dtype=object).fillna(''))
+    word_ids = {}
+    term_ids = {}
+    terms = []
+    indptr = [0]
+    indices = []
+
+    for title in unique_titles:
+        words = [word for word in TOKEN_PATTERN.findall(title.lower()) if word not in stop_words]
+        ids = [word_ids.setdefault(word, len(word_ids)) for word in words]
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            for start in range(len(ids) - n + 1):
+                key = tuple(ids[start:start + n])
+                term = term_ids.get(key)
+                if term is None:
+                    term = term_ids[key] = len(terms)
+                    terms.append(' '.join(words[start:start + n]))
+                indices.append(term)
+        indptr.append(len(indices))
+
+    data = np.ones(len(indices), dtype=np.int32)
+    unique_matrix = scipy.sparse.csr_matrix((data, np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+                                            shape=(len(unique_titles), len(terms)))
+    #repeated titles just reuse the row of their unique title
+    return DocumentTermMatrix(unique_matrix[codes], terms)
+
+
+#puts the rows of a newer matrix on top of an older one. the older matrix keeps its term ids,
+#terms that only show up in the new rows get appended to the vocabulary
+def prepend(delta, existing):
+    vocabulary = existing.vocabulary
+    terms = list(existing.terms)
+    remap = np.empty(len(delta.terms), dtype=np.int32)
+    for index, term in enumerate(delta.terms):
+        if term not in vocabulary:
+            vocabulary[term] = len(terms)
+            terms.append(term)
+        remap[index] = vocabulary[term]
+
+    delta_matrix = scipy.sparse.csr_matrix((delta.matrix.data, remap[delta.matrix.indices], delta.matrix.indptr),
+                                           shape=(delta.matrix.shape[0], len(terms)))
+    existing_matrix = existing.matrix.copy()
+    existing_matrix.resize((existing_matrix.shape[0], len(terms)))
+    return DocumentTermMatrix(scipy.sparse.vstack([delta_matrix, existing_matrix], format='csr'), terms)
+
+
+#the matrix is stored next to the nlp table as an npz file plus a json list of the terms
+def matrix_paths(table_csv_path):
+    base = os.path.splitext(table_csv_path)[0]
+    return base + '_dtm.npz', base + '_dtm_terms.json'
+
+
+def save(dtm, table_csv_path):
+    matrix_path, terms_path = matrix_paths(table_csv_path)
+    #sorted indices would lose the order of the terms in each row, so the raw csr arrays are saved as they are
+    np.savez_compressed(matrix_path, data=dtm.matrix.data, indices=dtm.matrix.indices,
+                        indptr=dtm.matrix.indptr, shape=np.asarray(dtm.matrix.shape))
+    with open(terms_path, 'w', encoding='utf-8') as file:
+        json.dump(dtm.terms, file, ensure_ascii=False)
+
+
+def load(table_csv_path):
+    matrix_path, terms_path = matrix_paths(table_csv_path)
+    with np.load(matrix_path) as arrays:
+        matrix = scipy.sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                         shape=tuple(arrays['shape']))
+    with open(terms_path, 'r', encoding='utf-8') as file:
+        terms = json.load(file)
+    return DocumentTermMatrix(matrix, terms)
+
+
+def exists(table_csv_path):
+    return all(os.path.exists(path) for path in matrix_paths(table_csv_path))